@@ -0,0 +1,299 @@
+"""
+Microbenchmarks for the compute kernels, with a stored baseline and regression check.
+
+Kernels: the SMA update (update_market_data), calculate_multi_period_momentum, the momentum
+ranking (rank_sectors_by_momentum), the HFEA and Golden HFEA Lite allocation math,
+calculate_monthly_investments and the rebalancers' order planning (plan_orders). They run on
+synthetic bars (seeded random walks) or on recorded data, across universe sizes and years of
+history, fully offline: market data comes from the files/replay providers, state from a
+temporary SQLite store, and any HTTP request fails the case.
+
+Usage:
+    python3 benchmarks.py                          # run the grid, compare with the baseline
+    python3 benchmarks.py --save-baseline          # run the grid and store it as the baseline
+    python3 benchmarks.py --quick --kernels rank_sectors sma
+    python3 benchmarks.py --data-dir market_data   # recorded bars (export_market_data output)
+    python3 benchmarks.py --fixture market_data_fixture.json
+
+Each case reports the best time per iteration and its throughput (symbols per second, or calls
+per second for kernels that do not scale). A case whose throughput falls more than --threshold
+below the baseline is a regression; the exit status is 1 if any case regressed or failed.
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import requests
+
+import main
+
+SYMBOL_SIZES = (1, 10, 100, 500)
+YEAR_SIZES = (1, 5, 30)
+QUICK_SYMBOL_SIZES = (1, 10, 100)
+QUICK_YEAR_SIZES = (1, 5)
+DEFAULT_YEARS = 2  # History for kernels that read a fixed window (400-500 calendar days)
+SYNTHETIC_PATHS = 20  # Distinct random walks; symbols share them so 500 x 30 years fits in memory
+BASELINE_PATH = "benchmark_baseline.json"
+
+API = {"API_KEY": "benchmark", "SECRET_KEY": "benchmark", "BASE_URL": "https://paper-api.alpaca.markets"}
+
+
+def synthetic_bars(years, seed):
+    """Daily bars (business days ending today) of a geometric random walk."""
+    rng = np.random.RandomState(seed)
+    dates = pd.bdate_range(end=datetime.date.today(), periods=int(years * 252) + 1).strftime("%Y-%m-%d").tolist()
+    closes = 100 * np.exp(np.cumsum(rng.normal(0.0003, 0.015, len(dates))))
+    opens = closes * (1 + rng.normal(0, 0.003, len(dates)))
+    volumes = rng.randint(100000, 5000000, len(dates))
+    return [
+        {"t": date, "o": float(o), "h": float(max(o, c) * 1.005), "l": float(min(o, c) * 0.995), "c": float(c), "v": int(v)}
+        for date, o, c, v in zip(dates, opens, closes, volumes)
+    ]
+
+
+def load_synthetic(symbols, years):
+    """Serve synthetic bars for symbols through the files provider."""
+    main.market_data_config.update(provider="files", as_of=None)
+    paths = [main._index_offline_bars(synthetic_bars(years, seed)) for seed in range(SYNTHETIC_PATHS)]
+    for i, symbol in enumerate(symbols):
+        main._offline_bars[symbol] = paths[i % SYNTHETIC_PATHS]
+
+
+def recorded_symbols(args):
+    """Select the recorded data source and list the symbols it has."""
+    if args.fixture:
+        main.market_data_config.update(provider="replay", fixture=args.fixture)
+        return sorted(main._load_replay_fixture().get("bars") or {})
+    main.market_data_config.update(provider="files", directory=args.data_dir)
+    return sorted({os.path.splitext(name)[0].upper() for name in os.listdir(args.data_dir)
+                   if name.endswith((".csv", ".parquet"))})
+
+
+def use_temporary_state():
+    """Point the state backend at a fresh SQLite file and make HTTP fail instead of leaving the box."""
+    workdir = tempfile.mkdtemp(prefix="benchmarks-")
+    main.state_config.update(backend="sqlite", sqlite_path=os.path.join(workdir, "state.db"))
+    main.journal_config["directory"] = os.path.join(workdir, "journal")
+    main._db_client = None
+
+    def offline_request(session, method, url, **kwargs):
+        raise RuntimeError(f"Benchmark made a network request: {method} {url}")
+    requests.Session.request = offline_request
+
+
+def synthetic_positions(symbols):
+    return {
+        symbol: {"qty": 10.0 + i, "market_value": (10.0 + i) * 50, "current_price": 50.0, "avg_entry_price": 45.0}
+        for i, symbol in enumerate(symbols)
+    }
+
+
+# Kernels: name -> (sizes, setup). setup(symbols, years) returns (run, units): run() is timed,
+# units is the throughput numerator per call. sizes: "symbols+years", "symbols" or "fixed".
+def _sma(symbols, years):
+    def run():
+        main._market_data_docs.clear()
+        for symbol in symbols:
+            main.update_market_data(symbol)
+    return run, len(symbols)
+
+
+def _multi_period_momentum(symbols, years):
+    def run():
+        for symbol in symbols:
+            main.calculate_multi_period_momentum(API, symbol)
+    return run, len(symbols)
+
+
+def _rank_sectors(symbols, years):
+    main.sector_momentum_config.update(universe="static", sector_etfs=list(symbols), history_days=int(years * 365) + 10)
+    main._bars_cache.clear()
+
+    def run():
+        main.clear_price_table()
+        main.rank_sectors_by_momentum(API)
+    return run, len(symbols)
+
+
+def _allocations(function):
+    def setup(symbols, years):
+        # Both sleeves are held, so the sleeve ledger seeded by the first case covers the second
+        snapshot = synthetic_positions(main.get_sleeve_symbols("hfea") + main.get_sleeve_symbols("golden_hfea_lite"))
+
+        def run():
+            main._positions_cache[API["BASE_URL"]] = snapshot
+            function(API)
+        return run, 1
+    return setup
+
+
+def _monthly_investments(symbols, years):
+    margin_result = {"allowed": True, "target_margin": 0.1, "metrics": {"cash": -2500.0, "equity": 100000.0}}
+    main.save_balance("SPXL_SMA", 12000.0, "paper")
+
+    def run():
+        main._market_data_docs.clear()
+        main._balance_docs.clear()
+        main.calculate_monthly_investments(API, margin_result, "paper")
+    return run, 1
+
+
+def _rebalance_plan(symbols, years):
+    rng = np.random.RandomState(len(symbols))
+    sleeves = list(main.strategy_sleeves)
+    proposals = [
+        (sleeves[i % len(sleeves)], symbol, side, float(rng.uniform(0.1, 50)))
+        for i, symbol in enumerate(symbols)
+        for side in ("buy", "sell")
+    ] + [(sleeves[(i + 1) % len(sleeves)], symbol, "buy", 3.0) for i, symbol in enumerate(symbols)]
+
+    def run():
+        main.plan_orders(proposals, cross_sleeve=True)
+    return run, len(symbols)
+
+
+KERNELS = {
+    "sma": ("symbols", _sma),
+    "multi_period_momentum": ("symbols", _multi_period_momentum),
+    "rank_sectors": ("symbols+years", _rank_sectors),
+    "hfea_allocations": ("fixed", _allocations(main.get_hfea_allocations)),
+    "golden_hfea_lite_allocations": ("fixed", _allocations(main.get_golden_hfea_lite_allocations)),
+    "monthly_investments": ("fixed", _monthly_investments),
+    "rebalance_plan": ("symbols", _rebalance_plan),
+}
+
+
+def cases(kernels, symbol_sizes, year_sizes):
+    for name in kernels:
+        sizes = KERNELS[name][0]
+        if sizes == "fixed":
+            yield name, 1, DEFAULT_YEARS
+        elif sizes == "symbols":
+            for count in symbol_sizes:
+                yield name, count, DEFAULT_YEARS
+        else:
+            for count in symbol_sizes:
+                for years in year_sizes:
+                    yield name, count, years
+
+
+def case_key(name, count, years):
+    return f"{name}[symbols={count},years={years}]"
+
+
+def run_case(name, symbols, years, min_time, min_runs):
+    """
+    Time one case: one untimed warm-up call, then repeat until min_time and min_runs are reached.
+
+    Returns:
+        dict: {"seconds": best seconds per call, "throughput": units per second, "runs"}
+    """
+    setup = KERNELS[name][1]
+    with contextlib.redirect_stdout(io.StringIO()):
+        main.reset_run_caches()
+        run, units = setup(symbols, years)
+        run()
+        times = []
+        deadline = time.perf_counter() + min_time
+        while len(times) < min_runs or time.perf_counter() < deadline:
+            started = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - started)
+    best = min(times)
+    return {"seconds": best, "throughput": units / best, "runs": len(times)}
+
+
+def compare(results, baseline, threshold):
+    """Relative throughput change per case against the baseline, and the keys that regressed."""
+    changes = {}
+    regressions = []
+    for key, result in results.items():
+        reference = baseline.get(key)
+        if not reference or "throughput" not in result:
+            continue
+        change = result["throughput"] / reference["throughput"] - 1
+        changes[key] = change
+        if change < -threshold:
+            regressions.append(key)
+    return changes, regressions
+
+
+def print_report(results, changes, regressions, threshold):
+    print(f"\n{'case':58s} {'best ms':>10s} {'throughput/s':>13s} {'vs base':>8s}")
+    for key, result in results.items():
+        if "error" in result:
+            print(f"{key:58s} {'ERROR':>10s}  {result['error']}")
+            continue
+        change = f"{changes[key]:+.0%}" if key in changes else "new"
+        flag = "  REGRESSION" if key in regressions else ""
+        print(f"{key:58s} {result['seconds'] * 1000:10.3f} {result['throughput']:13.1f} {change:>8s}{flag}")
+    if regressions:
+        print(f"\n{len(regressions)} case(s) regressed by more than {threshold:.0%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--kernels", nargs="+", choices=list(KERNELS), default=list(KERNELS))
+    parser.add_argument("--symbols", nargs="+", type=int, help=f"Universe sizes (default {SYMBOL_SIZES})")
+    parser.add_argument("--years", nargs="+", type=int, help=f"Years of history (default {YEAR_SIZES})")
+    parser.add_argument("--quick", action="store_true", help=f"Smaller grid: {QUICK_SYMBOL_SIZES} symbols, {QUICK_YEAR_SIZES} years")
+    parser.add_argument("--data-dir", help="Recorded bars ({SYMBOL}.csv/.parquet) instead of synthetic data")
+    parser.add_argument("--fixture", help="Recorded market data fixture (MARKET_DATA_RECORD) instead of synthetic data")
+    parser.add_argument("--min-time", type=float, default=0.3, help="Seconds to repeat each case for")
+    parser.add_argument("--min-runs", type=int, default=3)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed throughput drop (0.25 = 25%%)")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    symbol_sizes = args.symbols or (QUICK_SYMBOL_SIZES if args.quick else SYMBOL_SIZES)
+    year_sizes = args.years or (QUICK_YEAR_SIZES if args.quick else YEAR_SIZES)
+    use_temporary_state()
+    main.trace_config["log_report"] = False
+
+    if args.data_dir or args.fixture:
+        universe = recorded_symbols(args)
+        source = args.fixture or args.data_dir
+    else:
+        universe = ["SPY"] + [f"S{i:03d}" for i in range(max(symbol_sizes))]
+        load_synthetic(universe, max(max(year_sizes), DEFAULT_YEARS))
+        source = "synthetic"
+    print(f"Benchmarking {len(args.kernels)} kernel(s) on {source} data ({len(universe)} symbols available)")
+
+    results = {}
+    for name, count, years in cases(args.kernels, symbol_sizes, year_sizes):
+        if count > len(universe):
+            continue
+        key = case_key(name, count, years)
+        try:
+            results[key] = run_case(name, universe[:count], years, args.min_time, args.min_runs)
+        except Exception as e:
+            results[key] = {"error": str(e)}
+        print(f"  {key}: " + (f"{results[key]['seconds'] * 1000:.3f} ms" if "error" not in results[key] else results[key]["error"]))
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f).get("results", {})
+    changes, regressions = compare(results, baseline, args.threshold)
+    print_report(results, changes, regressions, args.threshold)
+
+    report = {"created": datetime.datetime.utcnow().isoformat() + "Z", "source": source, "results": results}
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        report["results"] = {**baseline, **{key: result for key, result in results.items() if "error" not in result}}
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+    errors = [key for key, result in results.items() if "error" in result]
+    raise SystemExit(1 if regressions or errors else 0)
@@ -4,7 +4,15 @@ from google.cloud import secretmanager
 from dotenv import load_dotenv
 import requests
 import json
+import base64
+import hmac
 import time
+import bisect
+import functools
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+import numpy as np
 import pandas as pd
 import pandas_market_calendars as mcal
 import datetime
@@ -42,6 +50,12 @@ gld_allocation = 0.25
 alpaca_environment = "live"
 margin = 0.01  # band around the 200sma to avoid too many trades
 
+# Daily SMA trade fast path (see daily_trade_sma)
+daily_sma_config = {
+    "fast_path": True,
+    "reconcile_days": 7,  # Run the full path at least this often to pick up manual position changes
+}
+
 # 9-sig strategy configuration following Jason Kelly's methodology
 nine_sig_config = {
     "target_allocation": {"tqqq": 0.8, "agg": 0.2},  # 80/20 target allocation
@@ -61,6 +75,11 @@ margin_control_config = {
     "spread_above_35k": 0.01,       # +1.0% spread for accounts ≥$35k
     "portfolio_threshold": 35000,   # Threshold for spread calculation (in dollars)
     "min_investment": 1.00,         # Minimum investment amount (Alpaca requirement)
+    "input_timeouts": {             # Per-input timeouts (seconds) for the concurrent gate inputs
+        "market_trend": 20,
+        "account": 10,
+        "margin_rate": 15,
+    },
 }
 
 # Sector Momentum Strategy configuration
@@ -105,38 +124,787 @@ sector_momentum_config = {
         "12_month": 252    # 252 trading days
     },
     "top_sectors_count": 3,         # Select top 3 sectors
-    "target_allocation_per_sector": 0.3333,  # 33.33% each
+    "target_allocation_per_sector": None,  # None = equal weight, 1/top_sectors_count rounded down to 0.01% (33.33% for 3)
     "spy_sma_period": 200,         # SPY 200-day SMA for trend filter
+    # Universe provider for the momentum scan:
+    #   "static" - sector_etfs above
+    #   "file"   - one ticker per line in universe_file (optional ",Name" after the ticker; .json list/dict also accepted)
+    #   "screen" - screen_candidates (or the file/static list) filtered by price and liquidity from the same batched bars
+    "universe": "static",
+    "universe_file": None,
+    "screen_candidates": [],
+    "screen_min_price": 5.0,              # Minimum last close
+    "screen_min_dollar_volume": 1000000,  # Minimum 20-day average daily dollar volume (IEX volume)
+    "history_days": 400,                  # Calendar days of bars fetched for scoring (covers 252 trading days)
+    "max_fill_days": 5,                   # Carry a close forward over at most this many missing bars (thin IEX data)
+}
+
+# Strategy sleeves - tickers owned by each strategy in the shared Alpaca account
+# (keys match the strategy-balances document IDs)
+strategy_sleeves = {
+    "hfea": ["UPRO", "TMF", "KMLM"],
+    "golden_hfea_lite": ["SSO", "ZROZ", "GLD"],
+    "SPXL_SMA": ["SPXL"],
+    "nine_sig": ["TQQQ", "AGG"],
+    "dual_momentum": ["SPUU", "EFO", "BND"],
+    "sector_momentum": None,  # Resolved from sector_momentum_config (universe + bond ETF)
+}
+
+# Alpaca order statuses after which an order can no longer fill
+TERMINAL_ORDER_STATUSES = ("filled", "canceled", "expired", "rejected")
+
+# Order layer configuration
+order_config = {
+    "notional_buys": True,  # Submit buys as dollar amounts; Alpaca sizes the fractional quantity
+    "confirm_timeout": 10,  # Seconds to confirm an unwaited notional fill before estimating shares from a quote
+    "cross_sleeve_netting": False,  # Net opposite legs of different sleeves internally (see plan_orders)
+    "min_order_qty": 1e-6,  # Net quantities below this are not submitted
+}
+
+# Sleeve ledger configuration
+sleeve_ledger_config = {
+    "snapshot_every": 50,  # Write a compacted snapshot after this many logged fills
+    "settle_timeout": 120,  # Seconds to wait for unwaited sleeve orders at the end of a run
+    "final_settle_timeout": 10,  # Seconds entry_point waits for still-open sleeve orders before persisting them
+}
+
+# Hot-path tracing: spans around every outbound call (HTTP, Firestore, Secret Manager) and every
+# orchestrator stage, aggregated per invocation. entry_point prints the report as one JSON line.
+trace_config = {
+    "enabled": os.getenv("TRACE_DISABLED") is None,
+    "log_report": True,  # Print {"trace": report} when the invocation ends
 }
+TRACE_HOSTS = {
+    "api.alpaca.markets": "alpaca_trading",
+    "paper-api.alpaca.markets": "alpaca_trading",
+    "data.alpaca.markets": "alpaca_data",
+    "api.telegram.org": "telegram",
+    "api.stlouisfed.org": "fred",
+}
+_trace_lock = threading.Lock()
+_trace = {"invocation": None, "started": 0, "stage": None, "spans": {}, "caches": {}}
+
+
+class TraceSpan:
+    """
+    Time a block as a dependency call or an orchestrator stage.
+
+    Stages nest ("monthly/hfea"); dependency spans are attributed to the stage that is open
+    when they start, including calls made from worker threads. Spans are aggregated into
+    call counts, total time and errors, nothing is stored per span.
+    """
+    __slots__ = ("kind", "name", "stage", "parent", "start", "error")
+
+    def __init__(self, kind, name):
+        self.kind = kind  # "dependency" or "stage"
+        self.name = name
+        self.error = False
+
+    def __enter__(self):
+        if not trace_config["enabled"]:
+            self.start = None
+            return self
+        self.parent = _trace["stage"]
+        if self.kind == "stage":
+            self.stage = f"{self.parent}/{self.name}" if self.parent else self.name
+            _trace["stage"] = self.stage
+        else:
+            self.stage = self.parent
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.start is None:
+            return False
+        elapsed = time.perf_counter_ns() - self.start
+        key = (self.kind, self.name if self.kind == "dependency" else self.stage, self.parent)
+        with _trace_lock:
+            totals = _trace["spans"].get(key)
+            if totals is None:
+                totals = _trace["spans"][key] = [0, 0, 0]
+            totals[0] += 1
+            totals[1] += elapsed
+            totals[2] += exc_type is not None or self.error
+        if self.kind == "stage":
+            _trace["stage"] = self.parent
+        return False
+
+
+def traced(kind, name):
+    """Decorator form of TraceSpan."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with TraceSpan(kind, name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def trace_cache(name, hits=0, misses=0):
+    """Count lookups of a per-run cache for the trace report."""
+    if not trace_config["enabled"]:
+        return
+    with _trace_lock:
+        counts = _trace["caches"].get(name)
+        if counts is None:
+            counts = _trace["caches"][name] = [0, 0]
+        counts[0] += hits
+        counts[1] += misses
+
+
+def start_trace(invocation):
+    """Reset the aggregates for a new invocation (called by entry_point)."""
+    with _trace_lock:
+        _trace.update(invocation=invocation, started=time.perf_counter_ns(), stage=None, spans={}, caches={})
+
+
+def trace_report():
+    """
+    Summarize the current invocation.
+
+    Returns:
+        dict: {"invocation", "total_ms", "dependencies": {name: {"calls", "ms", "errors"}},
+               "stages": {path: {"calls", "ms", "errors", "dependencies": {name: {"calls", "ms"}}}},
+               "caches": {name: {"hits", "misses", "hit_rate"}}}
+    """
+    with _trace_lock:
+        spans = {key: list(totals) for key, totals in _trace["spans"].items()}
+        caches = {name: list(counts) for name, counts in _trace["caches"].items()}
+        started = _trace["started"]
+    dependencies = {}
+    stages = {}
+    for (kind, name, parent), (calls, elapsed, errors) in sorted(spans.items(), key=lambda item: item[0][1]):
+        if kind == "stage":
+            stage = stages.setdefault(name, {"calls": 0, "ms": 0.0, "errors": 0, "dependencies": {}})
+            stage.update(calls=stage["calls"] + calls, ms=stage["ms"] + elapsed / 1e6, errors=stage["errors"] + errors)
+            continue
+        total = dependencies.setdefault(name, {"calls": 0, "ms": 0.0, "errors": 0})
+        total.update(calls=total["calls"] + calls, ms=total["ms"] + elapsed / 1e6, errors=total["errors"] + errors)
+        if parent:
+            stage = stages.setdefault(parent, {"calls": 0, "ms": 0.0, "errors": 0, "dependencies": {}})
+            stage["dependencies"][name] = {"calls": calls, "ms": round(elapsed / 1e6, 3)}
+    for totals in list(dependencies.values()) + list(stages.values()):
+        totals["ms"] = round(totals["ms"], 3)
+    return {
+        "invocation": _trace["invocation"],
+        "total_ms": round((time.perf_counter_ns() - started) / 1e6, 3),
+        "dependencies": dependencies,
+        "stages": stages,
+        "caches": {
+            name: {"hits": hits, "misses": misses, "hit_rate": round(hits / (hits + misses), 3) if hits + misses else None}
+            for name, (hits, misses) in caches.items()
+        },
+    }
+
+
+def http_request(method, url, **kwargs):
+    """requests.request inside a dependency span named after the host (see TRACE_HOSTS)."""
+    host = url.split("/", 3)[2] if "://" in url else url
+    with TraceSpan("dependency", TRACE_HOSTS.get(host, host)) as span:
+        response = requests.request(method, url, **kwargs)
+        span.error = response.status_code >= 400
+        return response
+
+
+# Firestore calls that make a round trip (on a batch, only commit does)
+_STATE_CALLS = frozenset(("get", "get_all", "stream", "set", "create", "update", "delete", "add", "commit"))
+_STATE_REFS = frozenset(("collection", "document", "where", "order_by", "limit", "offset", "start_after", "select", "batch"))
+
+
+def _untraced(value):
+    if isinstance(value, TracedStateClient):
+        return value._target
+    if isinstance(value, list):
+        return [_untraced(item) for item in value]
+    return value
+
+
+class TracedStateClient:
+    """
+    Forward to a Firestore (or SQLite state) client, collection, document, query or batch,
+    timing every round trip as a "firestore" dependency span. Returned references are wrapped
+    in turn; stream() results are read inside the span and returned as a list.
+    """
+    __slots__ = ("_target", "_calls")
+
+    def __init__(self, target, calls=_STATE_CALLS):
+        self._target = target
+        self._calls = calls
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name in self._calls:
+            def call(*args, **kwargs):
+                args = [_untraced(arg) for arg in args]
+                with TraceSpan("dependency", "firestore"):
+                    result = attr(*args, **kwargs)
+                    return list(result) if name == "stream" else result
+            return call
+        if name in _STATE_REFS:
+            def reference(*args, **kwargs):
+                calls = frozenset(("commit",)) if name == "batch" else _STATE_CALLS
+                return TracedStateClient(attr(*[_untraced(arg) for arg in args], **kwargs), calls)
+            return reference
+        return attr
+
 
 # Firestore client - initialized lazily to respect .env file
 _db_client = None
 
+# State backend: "firestore" (default) or "sqlite" (local file with the same collection API),
+# selected with STATE_BACKEND. The SQLite store keeps one JSON document per row, in WAL mode.
+state_config = {
+    "backend": None,  # Defaults to $STATE_BACKEND or "firestore" (read after .env is loaded)
+    "sqlite_path": None,  # Defaults to $STATE_SQLITE_PATH or "state.db"
+}
+
+def state_backend():
+    """Configured state backend, "firestore" or "sqlite" (loads .env for local development)."""
+    if not is_running_in_cloud():
+        load_dotenv()
+    return state_config["backend"] or os.getenv("STATE_BACKEND", "firestore")
+
+
+def check_offline_market_data():
+    """
+    Refuse offline market data (files/replay provider or an as-of date) on the Firestore backend.
+    
+    Such a run would mix historical prices with the live state (index highs, alert states,
+    balances) and overwrite it, so it needs the local SQLite backend (STATE_BACKEND=sqlite).
+    
+    Raises:
+        ValueError: If offline market data is configured without the SQLite backend
+    """
+    if market_data_config["provider"] == "alpaca" and not market_data_config["as_of"]:
+        return
+    if state_backend() != "sqlite":
+        raise ValueError(
+            f"Market data provider '{market_data_config['provider']}' / MARKET_DATA_AS_OF="
+            f"{market_data_config['as_of']} needs STATE_BACKEND=sqlite (refusing to use the live Firestore state)"
+        )
+
+
 def get_firestore_client():
     """
     Get or initialize Firestore client with correct project ID.
     Lazy loading ensures .env file is loaded first in local development.
+    With STATE_BACKEND=sqlite a local SQLite store with the same interface is returned instead.
     """
     global _db_client
     if _db_client is None:
-        # Ensure .env is loaded for local development
-        if not is_running_in_cloud():
-            load_dotenv()
-        
-        project_id = os.getenv("GOOGLE_CLOUD_PROJECT_ID")
-        if not project_id:
-            # Fallback to GOOGLE_CLOUD_PROJECT (used in cloud environments)
-            project_id = os.getenv("GOOGLE_CLOUD_PROJECT")
-        
-        _db_client = firestore.Client(project=project_id)
+        backend = state_backend()
+        if backend == "sqlite":
+            _db_client = SqliteStateClient(state_config["sqlite_path"] or os.getenv("STATE_SQLITE_PATH", "state.db"))
+        else:
+            project_id = os.getenv("GOOGLE_CLOUD_PROJECT_ID")
+            if not project_id:
+                # Fallback to GOOGLE_CLOUD_PROJECT (used in cloud environments)
+                project_id = os.getenv("GOOGLE_CLOUD_PROJECT")
+            
+            _db_client = firestore.Client(project=project_id)
+    
+    # Calls through the returned client are timed as "firestore" spans (see TracedStateClient)
+    return TracedStateClient(_db_client) if trace_config["enabled"] else _db_client
+
+
+def _encode_state(value):
+    """JSON-safe copy of a document value (datetimes become "@dt:<isoformat>", bytes "@b64:<base64>")."""
+    if isinstance(value, datetime.datetime):
+        return "@dt:" + value.isoformat()
+    if isinstance(value, bytes):
+        return "@b64:" + base64.b64encode(value).decode("ascii")
+    if isinstance(value, dict):
+        return {key: _encode_state(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode_state(item) for item in value]
+    return value
+
+
+def _decode_state(value):
+    if isinstance(value, str) and value.startswith("@dt:"):
+        return datetime.datetime.fromisoformat(value[4:])
+    if isinstance(value, str) and value.startswith("@b64:"):
+        return base64.b64decode(value[5:])
+    if isinstance(value, dict):
+        return {key: _decode_state(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_decode_state(item) for item in value]
+    return value
+
+
+def _apply_state_transform(current, value):
+    """Resolve Firestore sentinels (ArrayUnion, ArrayRemove, Increment, SERVER_TIMESTAMP) against a stored value."""
+    kind = type(value).__name__
+    if kind == "ArrayUnion":
+        result = list(current) if isinstance(current, list) else []
+        return result + [item for item in value.values if item not in result]
+    if kind == "ArrayRemove":
+        return [item for item in (current if isinstance(current, list) else []) if item not in value.values]
+    if kind == "Increment":
+        return (current if isinstance(current, (int, float)) else 0) + value.value
+    if value is firestore.SERVER_TIMESTAMP:
+        return datetime.datetime.now(datetime.timezone.utc)
+    return value
+
+
+def _merge_state(current, data):
+    """Firestore set(merge=True): nested maps are merged, everything else is replaced."""
+    merged = dict(current)
+    for key, value in data.items():
+        if value is firestore.DELETE_FIELD:
+            merged.pop(key, None)
+        elif isinstance(value, dict):
+            merged[key] = _merge_state(merged[key] if isinstance(merged.get(key), dict) else {}, value)
+        else:
+            merged[key] = _apply_state_transform(merged.get(key), value)
+    return merged
+
+
+def _state_field(data, path):
+    """Value at a dotted field path, or KeyError."""
+    for part in path.split("."):
+        if not isinstance(data, dict) or part not in data:
+            raise KeyError(path)
+        data = data[part]
+    return data
+
+
+def _state_comparable(value):
+    # Firestore timestamps are UTC; naive datetimes are compared as UTC
+    if isinstance(value, datetime.datetime) and value.tzinfo is None:
+        return value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+_STATE_OPERATORS = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+    "in": lambda a, b: a in b,
+    "not-in": lambda a, b: a not in b,
+    "array-contains": lambda a, b: isinstance(a, list) and b in a,
+    "array-contains-any": lambda a, b: isinstance(a, list) and any(item in a for item in b),
+}
+_STATE_SQL_OPERATORS = {"==": "=", "<": "<", "<=": "<=", ">": ">", ">=": ">="}
+
+
+def _state_timestamp(value):
+    """Epoch seconds of a datetime "timestamp" field (the indexed column), else None."""
+    if isinstance(value, datetime.datetime):
+        return _state_comparable(value).timestamp()
+    return None
+
+
+class SqliteStateSnapshot:
+    """Read result mirroring google.cloud.firestore.DocumentSnapshot."""
+
+    __slots__ = ("reference", "_data")
+
+    def __init__(self, reference, data):
+        self.reference = reference
+        self._data = data
+
+    @property
+    def id(self):
+        return self.reference.id
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return None if self._data is None else _decode_state(self._data)
+
+    def get(self, field_path):
+        return _decode_state(_state_field(self._data or {}, field_path))
+
+
+class SqliteStateDocument:
+    """Document reference mirroring google.cloud.firestore.DocumentReference."""
+
+    __slots__ = ("_client", "_collection", "id")
+
+    def __init__(self, client, collection, document_id):
+        self._client = client
+        self._collection = collection
+        self.id = document_id
+
+    @property
+    def path(self):
+        return f"{self._collection}/{self.id}"
+
+    def get(self, field_paths=None):
+        data = self._client._read(self._collection, self.id)
+        if data is not None and field_paths:
+            projected = {}
+            for path in field_paths:
+                try:
+                    value = _state_field(data, path)
+                except KeyError:
+                    continue
+                target = projected
+                *parents, leaf = path.split(".")
+                for part in parents:
+                    target = target.setdefault(part, {})
+                target[leaf] = value
+            data = projected
+        return SqliteStateSnapshot(self, data)
+
+    def set(self, data, merge=False):
+        self._client._write([("set", self, data, merge)])
+
+    def update(self, data):
+        self._client._write([("update", self, data, False)])
+
+    def delete(self):
+        self._client._write([("delete", self, None, False)])
+
+
+class SqliteStateQuery:
+    """Collection reference and query mirroring the Firestore where/order_by/limit/stream API."""
+
+    def __init__(self, client, collection, filters=(), orders=(), limit_count=None):
+        self._client = client
+        self._collection = collection
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit_count
+
+    @property
+    def id(self):
+        return self._collection
+
+    def document(self, document_id=None):
+        return SqliteStateDocument(self._client, self._collection, document_id or os.urandom(10).hex())
+
+    def where(self, field_path, op_string, value):
+        if op_string not in _STATE_OPERATORS:
+            raise ValueError(f"Unsupported query operator: {op_string}")
+        if isinstance(value, SqliteStateDocument):
+            value = value.id
+        return SqliteStateQuery(self._client, self._collection, self._filters + ((field_path, op_string, value),),
+                                self._orders, self._limit)
+
+    def order_by(self, field_path, direction="ASCENDING"):
+        return SqliteStateQuery(self._client, self._collection, self._filters,
+                                self._orders + ((field_path, direction == "DESCENDING"),), self._limit)
+
+    def limit(self, count):
+        return SqliteStateQuery(self._client, self._collection, self._filters, self._orders, count)
+
+    def _sql_filter(self, field, op, value):
+        """(SQL condition, parameter) narrowing a filter in SQL, or None if it only runs in Python."""
+        if op not in _STATE_SQL_OPERATORS:
+            return None
+        sql_op = _STATE_SQL_OPERATORS[op]
+        if field == "__name__":
+            return f"id {sql_op} ?", value
+        if field == "timestamp" and isinstance(value, datetime.datetime):
+            return f"timestamp {sql_op} ?", _state_timestamp(value)
+        if isinstance(value, (int, float)) or (isinstance(value, str) and not value.startswith("@")):
+            path = "$." + ".".join(f'"{part}"' for part in field.split("."))
+            return f"json_extract(data, '{path}') {sql_op} ?", value
+        return None
+
+    def stream(self):
+        # Document-id, timestamp and scalar field filters, ordering by timestamp and the limit run
+        # in SQL (timestamp is an indexed column); all filters are checked again on decoded values
+        pushed = [self._sql_filter(*query_filter) for query_filter in self._filters]
+        conditions = [condition for condition in pushed if condition is not None]
+        sql_order = None
+        if not self._orders:
+            sql_order = "id"
+        elif all(field == "timestamp" for field, _ in self._orders) and self._client._timestamps_indexed(self._collection):
+            descending = self._orders[0][1]
+            conditions.append(("timestamp IS NOT NULL", None))
+            sql_order = f"timestamp {'DESC' if descending else 'ASC'}, id"
+        # Range filters on JSON fields may let through values Python rejects (mixed types): no SQL limit then
+        exact = all(condition is not None and (op == "==" or field in ("__name__", "timestamp"))
+                    for condition, (field, op, _) in zip(pushed, self._filters))
+        limit = self._limit if sql_order and exact else None
+        rows = self._client._scan(self._collection, conditions, sql_order, limit)
+        matched = []
+        for document_id, data in rows:
+            decoded = _decode_state(data)
+            try:
+                if all(_STATE_OPERATORS[op](_state_comparable(document_id if field == "__name__" else _state_field(decoded, field)),
+                                            _state_comparable(value))
+                       for field, op, value in self._filters):
+                    if all(field == "__name__" or _state_field(decoded, field) is not None for field, _ in self._orders):
+                        matched.append((document_id, data, decoded))
+            except (KeyError, TypeError):
+                continue  # Firestore skips documents missing a filtered or ordered field
+        for field, descending in reversed(self._orders if sql_order is None else ()):
+            matched.sort(key=lambda row: _state_comparable(row[0] if field == "__name__" else _state_field(row[2], field)),
+                         reverse=descending)
+        if self._limit is not None:
+            matched = matched[:self._limit]
+        for document_id, data, _ in matched:
+            yield SqliteStateSnapshot(self.document(document_id), data)
+
+    def get(self):
+        return list(self.stream())
+
+
+class SqliteStateBatch:
+    """Write batch committed in one SQLite transaction."""
+
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, reference, data, merge=False):
+        self._writes.append(("set", reference, data, merge))
+
+    def update(self, reference, data):
+        self._writes.append(("update", reference, data, False))
+
+    def delete(self, reference):
+        self._writes.append(("delete", reference, None, False))
+
+    def commit(self):
+        self._client._write(self._writes)
+        self._writes = []
+
+
+class SqliteStateClient:
+    """
+    Local stand-in for firestore.Client (STATE_BACKEND=sqlite).
     
-    return _db_client
+    Documents are JSON rows keyed by (collection, id) in a WAL-mode database, so collections,
+    document reads with field masks, merge writes, sentinels, batches, get_all and
+    where/order_by/limit queries behave as they do against Firestore, without network.
+    The top-level "timestamp" field is also kept in an indexed column, so ordering by it
+    and limits run in SQL; other fields are only filtered with json_extract (not indexed).
+    """
+
+    def __init__(self, path):
+        import sqlite3
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " collection TEXT NOT NULL, id TEXT NOT NULL, data TEXT NOT NULL, updated_at REAL NOT NULL,"
+            " timestamp REAL, PRIMARY KEY (collection, id)) WITHOUT ROWID"
+        )
+        if "timestamp" not in [row[1] for row in self._conn.execute("PRAGMA table_info(documents)")]:
+            # Databases created before the timestamp column: add and backfill it
+            self._conn.execute("ALTER TABLE documents ADD COLUMN timestamp REAL")
+            rows = self._conn.execute("SELECT collection, id, data FROM documents").fetchall()
+            self._conn.executemany(
+                "UPDATE documents SET timestamp = ? WHERE collection = ? AND id = ?",
+                [(_state_timestamp(_decode_state(json.loads(data)).get("timestamp")), collection, document_id)
+                 for collection, document_id, data in rows],
+            )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS documents_timestamp ON documents (collection, timestamp)")
+
+    def collection(self, name):
+        return SqliteStateQuery(self, name)
+
+    def batch(self):
+        return SqliteStateBatch(self)
+
+    def get_all(self, references, field_paths=None):
+        for reference in references:
+            yield reference.get(field_paths)
+
+    def _read(self, collection, document_id):
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM documents WHERE collection = ? AND id = ?",
+                                     (collection, document_id)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _timestamps_indexed(self, collection):
+        """Whether the timestamp column orders this collection: no document has a non-datetime timestamp."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM documents WHERE collection = ? AND timestamp IS NULL"
+                " AND json_type(data, '$.timestamp') NOT IN ('null') LIMIT 1", (collection,)
+            ).fetchone()
+        return row is None
+
+    def _scan(self, collection, conditions, order=None, limit=None):
+        sql = "SELECT id, data FROM documents WHERE collection = ?"
+        params = [collection]
+        for condition, value in conditions:
+            sql += f" AND {condition}"
+            if "?" in condition:
+                params.append(value)
+        if order:
+            sql += f" ORDER BY {order}"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [(document_id, json.loads(data)) for document_id, data in rows]
+
+    def _write(self, writes):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for kind, reference, data, merge in writes:
+                    key = (reference._collection, reference.id)
+                    if kind == "delete":
+                        self._conn.execute("DELETE FROM documents WHERE collection = ? AND id = ?", key)
+                        continue
+                    row = self._conn.execute("SELECT data FROM documents WHERE collection = ? AND id = ?", key).fetchone()
+                    current = _decode_state(json.loads(row[0])) if row else None
+                    if kind == "update":
+                        if current is None:
+                            raise KeyError(f"No document to update: {reference.path}")
+                        for path, value in data.items():
+                            *parents, leaf = path.split(".")
+                            target = current
+                            for part in parents:
+                                target = target.setdefault(part, {})
+                            if value is firestore.DELETE_FIELD:
+                                target.pop(leaf, None)
+                            else:
+                                target[leaf] = _apply_state_transform(target.get(leaf), value)
+                        document = current
+                    elif merge:
+                        document = _merge_state(current or {}, data)
+                    else:
+                        document = _merge_state({}, data)
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO documents (collection, id, data, updated_at, timestamp) VALUES (?, ?, ?, ?, ?)",
+                        key + (json.dumps(_encode_state(document)), time.time(), _state_timestamp(document.get("timestamp"))),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
 
 
 # Market data cache settings - Firestore-based for cross-function sharing
 CACHE_DURATION_MINUTES = 5  # Cache freshness window
 
 
+# SMA state machine store: market-data/{symbol}.sma_states[sma_state_key(period, band)]
+sma_state_config = {
+    "history_limit": 20,  # Transitions kept per (symbol, period, band)
+}
+_market_data_docs = {}  # symbol -> market-data document read or written this run (see reset_run_caches)
+
+
+def sma_state_key(sma_period, noise_threshold=1.0):
+    """Store key for a (period, band) pair, e.g. (200, 1.0) -> "sma200_b100" (band in basis points)."""
+    return f"sma{int(sma_period)}_b{int(round(noise_threshold * 100))}"
+
+
+def classify_sma_state(price_diff_percent, noise_threshold):
+    """Position of price relative to an SMA: "above"/"below" outside the noise band, else "neutral"."""
+    if price_diff_percent > noise_threshold:
+        return "above"
+    if price_diff_percent < -noise_threshold:
+        return "below"
+    return "neutral"
+
+
+def advance_sma_state(entry, price, sma_value, noise_threshold=1.0, now=None):
+    """
+    Feed a new price/SMA observation into a stored SMA state entry (pure, no I/O).
+    
+    The entry holds the current three-way state, the last non-neutral state ("trend",
+    the hysteresis signal that only flips when the price leaves the band on the other
+    side), the transition time and a capped "at|from|to|price" transition history.
+    Alert consumers keep their own "notified_state", which is carried over untouched.
+    
+    Args:
+        entry: Stored entry dict (or None for a new one)
+        price: Current price
+        sma_value: Current SMA value
+        noise_threshold: Band half-width in percent
+        now: Observation time (defaults to utcnow)
+    
+    Returns:
+        dict: New entry {"state", "trend", "since", "updated", "price", "sma", "history", ...}
+    """
+    now = (now or datetime.datetime.utcnow()).isoformat(timespec="seconds")
+    entry = dict(entry or {})
+    previous = entry.get("state")
+    state = classify_sma_state(((price - sma_value) / sma_value) * 100, noise_threshold)
+    history = list(entry.get("history", []))
+    if state != previous:
+        if previous is not None:
+            history.append(f"{now}|{previous}|{state}|{price:.2f}")
+            history = history[-sma_state_config["history_limit"]:]
+        entry["since"] = now
+    entry.update({
+        "state": state,
+        "trend": state if state != "neutral" else entry.get("trend"),
+        "updated": now,
+        "price": float(price),
+        "sma": float(sma_value),
+        "history": history,
+    })
+    return entry
+
+
+def _stored_sma_entry(sma_states, data, sma_period, noise_threshold=1.0):
+    """Entry for (period, band) from a store map; new entries inherit the legacy sma{period}_state as notified."""
+    entry = sma_states.get(sma_state_key(sma_period, noise_threshold))
+    if entry is None and data.get(f"sma{sma_period}_state") is not None:
+        entry = {"notified_state": data[f"sma{sma_period}_state"]}
+    return entry
+
+
+def sma_state_from_market_data(data, sma_period=200, noise_threshold=1.0):
+    """
+    The stored SMA state entry from a market-data document.
+    
+    Documents written before the store existed are classified from their price and
+    SMA fields (not persisted; update_market_data writes the entry on its next refresh).
+    
+    Args:
+        data: market-data document dict
+        sma_period: SMA period
+        noise_threshold: Band half-width in percent
+    
+    Returns:
+        dict: State entry, or None if the document has no such SMA
+    """
+    entry = (data.get("sma_states") or {}).get(sma_state_key(sma_period, noise_threshold))
+    if entry is not None:
+        return entry
+    if data.get(f"sma{sma_period}") is None or data.get("price") is None:
+        return None
+    entry = advance_sma_state(None, data["price"], data[f"sma{sma_period}"], noise_threshold)
+    entry["notified_state"] = data.get(f"sma{sma_period}_state")
+    return entry
+
+
+def get_sma_state(symbol, sma_period=200, noise_threshold=1.0):
+    """
+    Current SMA state for a symbol, read from the run's cached market-data document.
+    Every trend consumer (margin gate, SPXL, sector momentum, alerts) reads this, so
+    they all see the same classification.
+    
+    Args:
+        symbol: Stock symbol (e.g., "SPY")
+        sma_period: SMA period (200 and 255 are maintained by update_market_data)
+        noise_threshold: Band half-width in percent (1.0 = the 1% margin band)
+    
+    Returns:
+        dict: State entry {"state", "trend", "since", "price", "sma", "history", ...}
+    """
+    data = get_all_market_data(symbol)
+    if data is None:
+        data = update_market_data(symbol)
+    entry = sma_state_from_market_data(data, sma_period, noise_threshold)
+    if entry is None:
+        raise ValueError(f"No {sma_period}-day SMA stored for {symbol}")
+    return entry
+
+
 def get_cached_market_data(symbol, data_type):
     """
     Get cached market data from Firestore to avoid redundant Alpaca API calls.
@@ -182,7 +950,7 @@ def get_cached_market_data(symbol, data_type):
         return None
 
 
-def get_all_market_data(symbol):
+def get_all_market_data(symbol, allow_stale=False):
     """
     Get ALL market data for a symbol efficiently.
     Use this when you need multiple metrics (price, sma200, sma255, states).
@@ -190,6 +958,7 @@ def get_all_market_data(symbol):
     
     Args:
         symbol: Stock symbol (e.g., "SPY", "URTH")
+        allow_stale: Return the cached document regardless of its age (fallback use)
     
     Returns:
         dict with all market data: price, sma200, sma255, sma200_state, sma255_state, timestamp
@@ -203,20 +972,25 @@ def get_all_market_data(symbol):
         spy_sma = data["sma200"]
     """
     try:
-        # Normalize symbol for Firestore document ID
-        doc_id = symbol.replace("^", "").replace(".", "_")
-        
-        doc_ref = get_firestore_client().collection("market-data").document(doc_id)
-        doc = doc_ref.get()
-        
-        if not doc.exists:
-            return None
-        
-        data = doc.to_dict()
+        # One document read per symbol per run
+        data = _market_data_docs.get(symbol)
+        trace_cache("market_data", hits=data is not None, misses=data is None)
+        if data is None:
+            # Normalize symbol for Firestore document ID
+            doc_id = symbol.replace("^", "").replace(".", "_")
+            
+            doc_ref = get_firestore_client().collection("market-data").document(doc_id)
+            doc = doc_ref.get()
+            
+            if not doc.exists:
+                return None
+            
+            data = doc.to_dict()
+            _market_data_docs[symbol] = data
         
         # Check if cache is still fresh
         timestamp = data.get("timestamp")
-        if timestamp:
+        if timestamp and not allow_stale:
             # Convert both to naive UTC for comparison (handles timezone-aware Firestore timestamps)
             if hasattr(timestamp, 'tzinfo') and timestamp.tzinfo is not None:
                 timestamp = timestamp.replace(tzinfo=None)
@@ -262,6 +1036,7 @@ def set_cached_market_data(symbol, data_type, value):
         data["timestamp"] = datetime.datetime.utcnow()
         
         doc_ref.set(data)
+        _market_data_docs.pop(symbol, None)
         
     except Exception as e:
         print(f"Warning: Could not cache market data for {symbol}.{data_type}: {e}")
@@ -274,9 +1049,250 @@ def get_auth_headers(api):
     }
 
 
+# Market data providers - bars, latest trades and snapshots behind one interface.
+# "alpaca" is the live REST API (IEX feed), "files" serves a local directory of per-symbol
+# Parquet/CSV daily bars and "replay" serves a fixture recorded from the live API
+# (set MARKET_DATA_RECORD to a path to record one). Offline providers ignore the credentials.
+market_data_config = {
+    "provider": os.getenv("MARKET_DATA_PROVIDER", "alpaca"),
+    "base_url": "https://data.alpaca.markets",
+    "feed": "iex",  # IEX feed (included with Basic subscription)
+    "directory": os.getenv("MARKET_DATA_DIR", "market_data"),  # files: {SYMBOL}.parquet or {SYMBOL}.csv (t,o,h,l,c,v)
+    "fixture": os.getenv("MARKET_DATA_FIXTURE", "market_data_fixture.json"),  # replay
+    "record": os.getenv("MARKET_DATA_RECORD"),  # alpaca: also write responses to this fixture
+    "as_of": os.getenv("MARKET_DATA_AS_OF"),  # Treat this date (YYYY-MM-DD) as today: bar windows end here (files/replay also quote from it)
+}
+_offline_bars = {}  # symbol -> (dates, bars) loaded by the files/replay providers
+_replay_fixture = {}  # path -> {"bars", "trades", "snapshots"}
+
+
+def market_data_today():
+    """Now, or midnight of market_data_config["as_of"] when set. Bar windows are measured back from this."""
+    if market_data_config["as_of"]:
+        return datetime.datetime.strptime(market_data_config["as_of"], "%Y-%m-%d")
+    return datetime.datetime.now()
+
+
+def _alpaca_bars(api, symbols, start, end):
+    url = f"{market_data_config['base_url']}/v2/stocks/bars"
+    params = {
+        "symbols": ",".join(symbols),
+        "start": start,
+        "end": end,
+        "timeframe": "1Day",
+        "limit": 10000,
+        "adjustment": "split",
+        "feed": market_data_config["feed"],
+    }
+    fetched = {}
+    while True:
+        response = http_request("GET", url, headers=get_auth_headers(api), params=params)
+        response.raise_for_status()
+        data = response.json()
+        for symbol, bars in (data.get("bars") or {}).items():
+            fetched.setdefault(symbol, []).extend(bars)
+        page_token = data.get("next_page_token")
+        if not page_token:
+            return fetched
+        params["page_token"] = page_token
+
+
+def _alpaca_latest_trades(api, symbols):
+    url = f"{market_data_config['base_url']}/v2/stocks/trades/latest"
+    response = http_request("GET", url, headers=get_auth_headers(api), params={"symbols": ",".join(symbols)})
+    response.raise_for_status()
+    return {symbol: float(trade["p"]) for symbol, trade in (response.json().get("trades") or {}).items()}
+
+
+def _alpaca_snapshots(api, symbols):
+    url = f"{market_data_config['base_url']}/v2/stocks/snapshots"
+    response = http_request("GET", url, headers=get_auth_headers(api), params={"symbols": ",".join(symbols), "feed": market_data_config["feed"]})
+    response.raise_for_status()
+    payload = response.json()
+    return {symbol: snapshot for symbol, snapshot in (payload.get("snapshots", payload) or {}).items() if snapshot}
+
+
+def _index_offline_bars(bars):
+    """Sort bars by date and key them for bisect slicing."""
+    bars = sorted(bars, key=lambda bar: str(bar["t"]))
+    return [str(bar["t"])[:10] for bar in bars], bars
+
+
+def _load_file_bars(symbol):
+    """Read and index {directory}/{symbol}.parquet or .csv once per process."""
+    if symbol not in _offline_bars:
+        base = os.path.join(market_data_config["directory"], symbol)
+        if os.path.exists(base + ".parquet"):
+            frame = pd.read_parquet(base + ".parquet")  # Needs pyarrow or fastparquet
+        elif os.path.exists(base + ".csv"):
+            frame = pd.read_csv(base + ".csv")
+        else:
+            _offline_bars[symbol] = ([], [])
+            return _offline_bars[symbol]
+        frame = frame.rename(columns=str.lower)
+        frame["t"] = pd.to_datetime(frame["t"]).dt.strftime("%Y-%m-%d")
+        columns = {column: frame[column].tolist() for column in ("t", "o", "h", "l", "c", "v") if column in frame.columns}
+        # zip over plain lists is about twice as fast as DataFrame.to_dict("records")
+        _offline_bars[symbol] = _index_offline_bars([dict(zip(columns, row)) for row in zip(*columns.values())])
+    return _offline_bars[symbol]
+
+
+def _load_replay_fixture():
+    path = market_data_config["fixture"]
+    if path not in _replay_fixture:
+        with open(path) as f:
+            fixture = json.load(f)
+        _replay_fixture[path] = fixture
+        for symbol, bars in (fixture.get("bars") or {}).items():
+            _offline_bars[symbol] = _index_offline_bars(bars)
+    return _replay_fixture[path]
+
+
+def _slice_offline_bars(symbols, start, end, loader):
+    end = min(end, market_data_config["as_of"] or end)
+    result = {}
+    for symbol in symbols:
+        dates, bars = loader(symbol)
+        selected = bars[bisect.bisect_left(dates, start):bisect.bisect_right(dates, end)]
+        if selected:
+            result[symbol] = selected
+    return result
+
+
+def _offline_snapshot(symbol, loader):
+    """Build an Alpaca-shaped snapshot from the as-of (or last) daily bar."""
+    dates, bars = loader(symbol)
+    end = bisect.bisect_right(dates, market_data_config["as_of"]) if market_data_config["as_of"] else len(bars)
+    if end == 0:
+        return None
+    bar = bars[end - 1]
+    snapshot = {"latestTrade": {"p": bar["c"]}, "minuteBar": dict(bar), "dailyBar": dict(bar)}
+    if end > 1:
+        snapshot["prevDailyBar"] = dict(bars[end - 2])
+    return snapshot
+
+
+def _offline_latest_trades(symbols, loader):
+    """Latest trade = close of the as-of (or last) daily bar."""
+    snapshots = {symbol: _offline_snapshot(symbol, loader) for symbol in symbols}
+    return {symbol: float(snapshot["latestTrade"]["p"]) for symbol, snapshot in snapshots.items() if snapshot}
+
+
+def _files_bars(api, symbols, start, end):
+    return _slice_offline_bars(symbols, start, end, _load_file_bars)
+
+
+def _files_snapshots(api, symbols):
+    snapshots = {symbol: _offline_snapshot(symbol, _load_file_bars) for symbol in symbols}
+    return {symbol: snapshot for symbol, snapshot in snapshots.items() if snapshot}
+
+
+def _files_latest_trades(api, symbols):
+    return _offline_latest_trades(symbols, _load_file_bars)
+
+
+def _replay_loader(symbol):
+    _load_replay_fixture()
+    return _offline_bars.get(symbol, ([], []))
+
+
+def _replay_bars(api, symbols, start, end):
+    return _slice_offline_bars(symbols, start, end, _replay_loader)
+
+
+def _replay_latest_trades(api, symbols):
+    trades = _load_replay_fixture().get("trades") or {}
+    prices = {symbol: float(trades[symbol]) for symbol in symbols if symbol in trades}
+    missing = [symbol for symbol in symbols if symbol not in prices]
+    prices.update(_offline_latest_trades(missing, _replay_loader))
+    return prices
+
+
+def _replay_snapshots(api, symbols):
+    recorded = _load_replay_fixture().get("snapshots") or {}
+    snapshots = {symbol: recorded.get(symbol) or _offline_snapshot(symbol, _replay_loader) for symbol in symbols}
+    return {symbol: snapshot for symbol, snapshot in snapshots.items() if snapshot}
+
+
+market_data_providers = {
+    "alpaca": {"bars": _alpaca_bars, "latest_trades": _alpaca_latest_trades, "snapshots": _alpaca_snapshots},
+    "files": {"bars": _files_bars, "latest_trades": _files_latest_trades, "snapshots": _files_snapshots},
+    "replay": {"bars": _replay_bars, "latest_trades": _replay_latest_trades, "snapshots": _replay_snapshots},
+}
+
+
+def _record_fixture(kind, data):
+    """Merge live responses into the MARKET_DATA_RECORD fixture (alpaca provider only)."""
+    path = market_data_config["record"]
+    try:
+        fixture = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                fixture = json.load(f)
+        section = fixture.setdefault(kind, {})
+        for symbol, value in data.items():
+            if kind == "bars":
+                merged = {bar["t"]: bar for bar in section.get(symbol, []) + value}
+                section[symbol] = [merged[t] for t in sorted(merged)]
+            else:
+                section[symbol] = value
+        with open(path, "w") as f:
+            json.dump(fixture, f)
+    except Exception as e:
+        print(f"Warning: Could not record market data fixture {path}: {e}")
+
+
+def export_market_data(api, symbols=None, days=None, directory=None):
+    """
+    Write daily bars from the current provider to {directory}/{SYMBOL}.csv for the files provider.
+
+    Args:
+        api: Alpaca API credentials dict
+        symbols: Tickers to export (defaults to every sleeve ticker plus SPY, EFA and URTH)
+        days: Calendar days of history (defaults to INDEX_HIGHS_SEED_DAYS)
+        directory: Target directory (defaults to market_data_config["directory"])
+
+    Returns:
+        int: Number of symbols written
+    """
+    symbols = symbols or [symbol for sleeve in strategy_sleeves for symbol in get_sleeve_symbols(sleeve)] + ["SPY", "EFA", "URTH"]
+    directory = directory or market_data_config["directory"]
+    os.makedirs(directory, exist_ok=True)
+    bars = get_alpaca_bars_batch(api, symbols, days=days or INDEX_HIGHS_SEED_DAYS, refresh=True)
+    for symbol, symbol_bars in bars.items():
+        frame = pd.DataFrame(symbol_bars)
+        frame["t"] = frame["t"].str[:10]
+        frame[[column for column in ("t", "o", "h", "l", "c", "v") if column in frame.columns]].to_csv(
+            os.path.join(directory, f"{symbol}.csv"), index=False)
+    print(f"Exported daily bars for {len(bars)} symbols to {directory}")
+    return len(bars)
+
+
+def market_data_request(kind, api, symbols, *args):
+    """
+    Call the configured market data provider.
+
+    Args:
+        kind: "bars" (args: start, end as YYYY-MM-DD), "latest_trades" or "snapshots"
+        api: Alpaca API credentials dict (ignored by offline providers)
+        symbols: List of upper-case symbols (one request's worth, see MARKET_DATA_BATCH_SIZE)
+
+    Returns:
+        dict: symbol -> bars (list of {"t", "o", "h", "l", "c", "v"}), latest trade price or
+              Alpaca-shaped snapshot. Symbols without data are omitted.
+    """
+    provider = market_data_config["provider"]
+    if provider not in market_data_providers:
+        raise ValueError(f"Unknown market data provider: {provider} (expected one of {', '.join(market_data_providers)})")
+    data = market_data_providers[provider][kind](api, symbols, *args)
+    if provider == "alpaca" and market_data_config["record"]:
+        _record_fixture(kind, data)
+    return data
+
+
 def get_alpaca_historical_bars(api, symbol, days=400):
     """
-    Fetch historical daily bars from Alpaca using IEX feed.
+    Fetch historical daily bars from the market data provider (Alpaca IEX feed by default).
     Primary data source for all SMA calculations (no rate limiting).
     
     Args:
@@ -288,28 +1304,14 @@ def get_alpaca_historical_bars(api, symbol, days=400):
         List of closing prices (most recent last), or None on error
     """
     try:
-        from datetime import datetime, timedelta
-        
-        market_data_base_url = "https://data.alpaca.markets"
+        from datetime import timedelta
         
-        end_date = datetime.now()
+        end_date = market_data_today()
         start_date = end_date - timedelta(days=days)
         
-        url = f"{market_data_base_url}/v2/stocks/{symbol}/bars"
-        params = {
-            "start": start_date.strftime("%Y-%m-%d"),
-            "end": end_date.strftime("%Y-%m-%d"),
-            "timeframe": "1Day",
-            "limit": 10000,
-            "adjustment": "split",
-            "feed": "iex"  # Use IEX feed (included with Basic subscription)
-        }
-        
-        response = requests.get(url, headers=get_auth_headers(api), params=params)
-        response.raise_for_status()
-        
-        data = response.json()
-        bars = data.get("bars", [])
+        bars = market_data_request(
+            "bars", api, [symbol.upper()], start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")
+        ).get(symbol.upper(), [])
         
         if not bars:
             print(f"No Alpaca bars returned for {symbol}")
@@ -317,7 +1319,7 @@ def get_alpaca_historical_bars(api, symbol, days=400):
         
         # Extract closing prices
         closes = [bar['c'] for bar in bars]
-        print(f"Fetched {len(closes)} bars for {symbol} from Alpaca IEX feed")
+        print(f"Fetched {len(closes)} bars for {symbol} from {market_data_config['provider']} market data")
         return closes
         
     except Exception as e:
@@ -327,8 +1329,8 @@ def get_alpaca_historical_bars(api, symbol, days=400):
 
 def get_latest_trade(api, symbol):
     """
-    Get latest trade price from Alpaca.
-    No fallback - raises error if Alpaca data unavailable.
+    Get latest trade price from the snapshot price table or the market data provider.
+    No fallback - raises error if market data is unavailable.
     
     Args:
         api: Alpaca API credentials dict
@@ -338,12 +1340,204 @@ def get_latest_trade(api, symbol):
         Latest trade price
     """
     symbol = symbol.upper()
-    market_data_base_url = "https://data.alpaca.markets"
-    url = f"{market_data_base_url}/v2/stocks/{symbol}/trades/latest"
-    
-    response = requests.get(url, headers=get_auth_headers(api))
-    response.raise_for_status()
-    return response.json()["trade"]["p"]
+    cached = get_snapshot_price(symbol)
+    if cached is not None:
+        return cached
+    prices = market_data_request("latest_trades", api, [symbol])
+    if symbol not in prices:
+        raise ValueError(f"No latest trade for {symbol} from {market_data_config['provider']} market data")
+    return prices[symbol]
+
+
+# Per-run snapshot price table - one multi-symbol snapshots request shared by all strategies.
+# Rows are symbols (see _price_table["index"]), columns are SNAPSHOT_FIELDS.
+SNAPSHOT_FIELDS = ("trade", "bid", "ask", "minute_close", "open", "high", "low", "close", "volume", "prev_close")
+snapshot_config = {
+    "max_age_seconds": 300,  # Older rows fall back to a live request
+}
+_price_table = {"index": {}, "values": np.empty((0, len(SNAPSHOT_FIELDS))), "fetched_at": np.empty(0)}
+
+
+def _snapshot_row(snapshot):
+    """Flatten one Alpaca snapshot into a SNAPSHOT_FIELDS row (missing parts are NaN)."""
+    trade = snapshot.get("latestTrade") or {}
+    quote = snapshot.get("latestQuote") or {}
+    minute = snapshot.get("minuteBar") or {}
+    daily = snapshot.get("dailyBar") or {}
+    previous = snapshot.get("prevDailyBar") or {}
+    return [
+        trade.get("p", np.nan), quote.get("bp", np.nan), quote.get("ap", np.nan), minute.get("c", np.nan),
+        daily.get("o", np.nan), daily.get("h", np.nan), daily.get("l", np.nan), daily.get("c", np.nan),
+        daily.get("v", np.nan), previous.get("c", np.nan),
+    ]
+
+
+def prefetch_snapshots(api, symbols):
+    """
+    Load latest trade, quote, minute bar and daily bar for many symbols into the price table.
+    One request per MARKET_DATA_BATCH_SIZE symbols; get_latest_trade(s) then read from the table.
+
+    Args:
+        api: Alpaca API credentials dict
+        symbols: List of stock symbols
+
+    Returns:
+        int: Number of symbols loaded
+    """
+    symbols = list(dict.fromkeys(s.upper() for s in symbols))
+
+    rows = {}
+    for chunk in _chunked(symbols, MARKET_DATA_BATCH_SIZE):
+        for symbol, snapshot in market_data_request("snapshots", api, chunk).items():
+            rows[symbol] = _snapshot_row(snapshot)
+    if not rows:
+        return 0
+
+    index = _price_table["index"]
+    new_symbols = [symbol for symbol in rows if symbol not in index]
+    if new_symbols:
+        start = len(index)
+        index.update({symbol: start + i for i, symbol in enumerate(new_symbols)})
+        _price_table["values"] = np.vstack([_price_table["values"], np.full((len(new_symbols), len(SNAPSHOT_FIELDS)), np.nan)])
+        _price_table["fetched_at"] = np.concatenate([_price_table["fetched_at"], np.zeros(len(new_symbols))])
+    positions = [index[symbol] for symbol in rows]
+    _price_table["values"][positions] = np.array(list(rows.values()), dtype=float)
+    _price_table["fetched_at"][positions] = time.time()
+    print(f"Snapshot price table: loaded {len(rows)} symbols in {-(-len(symbols) // MARKET_DATA_BATCH_SIZE)} request(s)")
+    return len(rows)
+
+
+def get_snapshot(symbol, field="trade"):
+    """
+    Read one field of a symbol from the price table.
+
+    Returns:
+        float or None: The value, or None when the symbol is missing, stale or has no such data
+    """
+    row = _price_table["index"].get(symbol.upper())
+    if row is None or time.time() - _price_table["fetched_at"][row] > snapshot_config["max_age_seconds"]:
+        trace_cache("price_table", misses=1)
+        return None
+    value = _price_table["values"][row, SNAPSHOT_FIELDS.index(field)]
+    if np.isnan(value):
+        trace_cache("price_table", misses=1)
+        return None
+    trace_cache("price_table", hits=1)
+    return float(value)
+
+
+def get_snapshot_price(symbol):
+    """Latest trade price from the price table (None when not prefetched or stale)."""
+    return get_snapshot(symbol, "trade")
+
+
+def clear_price_table():
+    """Drop all snapshot rows (called by reset_run_caches)."""
+    _price_table["index"] = {}
+    _price_table["values"] = np.empty((0, len(SNAPSHOT_FIELDS)))
+    _price_table["fetched_at"] = np.empty(0)
+
+
+# Batched market data - one request per chunk of symbols instead of one per symbol
+MARKET_DATA_BATCH_SIZE = 200  # Symbols per multi-symbol request (keeps URLs well below limits)
+_bars_cache = {}  # (symbol, days, end_date) -> list of bar dicts, shared by all callers in this instance (earlier days are evicted by reset_run_caches)
+
+
+def _chunked(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def get_alpaca_bars_batch(api, symbols, days=400, refresh=False):
+    """
+    Fetch daily bars for many symbols with the multi-symbol bars endpoint.
+    Results are cached per (symbol, days, day), so repeated scans in the same
+    day only fetch symbols that are not cached yet.
+
+    Args:
+        api: Alpaca API credentials dict
+        symbols: List of stock symbols
+        days: Number of calendar days of history to fetch
+        refresh: Refetch even if cached (picks up today's partial bar intraday)
+
+    Returns:
+        dict: symbol -> list of bar dicts ({"t", "o", "h", "l", "c", "v"}), oldest first.
+              Symbols without data are omitted.
+    """
+    from datetime import timedelta
+
+    end_date = market_data_today()
+    start_date = end_date - timedelta(days=days)
+    end_key = end_date.strftime("%Y-%m-%d")
+
+    symbols = list(dict.fromkeys(s.upper() for s in symbols))
+    missing = symbols if refresh else [s for s in symbols if (s, days, end_key) not in _bars_cache]
+    trace_cache("bars", hits=len(symbols) - len(missing), misses=len(missing))
+
+    for chunk in _chunked(missing, MARKET_DATA_BATCH_SIZE):
+        fetched = {s: [] for s in chunk}
+        try:
+            fetched.update(market_data_request("bars", api, chunk, start_date.strftime("%Y-%m-%d"), end_key))
+        except Exception as e:
+            print(f"Alpaca batched bars fetch failed for {len(chunk)} symbols: {e}")
+            continue
+
+        for symbol, bars in fetched.items():
+            _bars_cache[(symbol, days, end_key)] = bars
+
+        print(f"Fetched daily bars for {len(chunk)} symbols from {market_data_config['provider']} market data (batched)")
+
+    return {
+        s: _bars_cache[(s, days, end_key)]
+        for s in symbols
+        if _bars_cache.get((s, days, end_key))
+    }
+
+
+def get_latest_trades(api, symbols):
+    """
+    Get latest trade prices for many symbols with the multi-symbol endpoint.
+
+    Args:
+        api: Alpaca API credentials dict
+        symbols: List of stock symbols
+
+    Returns:
+        dict: symbol -> latest trade price (symbols without a trade are omitted)
+    """
+    symbols = list(dict.fromkeys(s.upper() for s in symbols))
+
+    # Symbols already in the snapshot price table are not requested again
+    prices = {symbol: get_snapshot_price(symbol) for symbol in symbols}
+    prices = {symbol: price for symbol, price in prices.items() if price is not None}
+    symbols = [symbol for symbol in symbols if symbol not in prices]
+    for chunk in _chunked(symbols, MARKET_DATA_BATCH_SIZE):
+        prices.update(market_data_request("latest_trades", api, chunk))
+    return prices
+
+
+def get_close_matrix(api, symbols, days=400):
+    """
+    Aligned (dates x symbols) close matrix built from batched, cached daily bars.
+
+    A symbol missing a bar on a date other symbols traded keeps its previous close for up to
+    sector_momentum_config["max_fill_days"] rows, so a gap in thin IEX data does not turn its
+    lookback returns into NaN. Rows before a symbol's first bar stay NaN.
+
+    Args:
+        api: Alpaca API credentials dict
+        symbols: List of stock symbols
+        days: Number of calendar days of history
+
+    Returns:
+        pd.DataFrame: Closing prices indexed by bar date, one column per symbol
+    """
+    bars_by_symbol = get_alpaca_bars_batch(api, symbols, days=days)
+    columns = {
+        symbol: pd.Series({bar["t"][:10]: bar["c"] for bar in bars}, dtype=float)
+        for symbol, bars in bars_by_symbol.items()
+    }
+    return pd.DataFrame(columns).sort_index().ffill(limit=sector_momentum_config["max_fill_days"])
 
 
 def get_sma(api, symbol, period):
@@ -378,43 +1572,341 @@ def get_sma(api, symbol, period):
 
 def get_account_cash(api):
     url = f"{api['BASE_URL']}/v2/account"
-    response = requests.get(url, headers=get_auth_headers(api))
+    response = http_request("GET", url, headers=get_auth_headers(api))
     response.raise_for_status()
     return float(response.json()["cash"])
 
 def list_positions(api):
     url = f"{api['BASE_URL']}/v2/positions"
-    response = requests.get(url, headers=get_auth_headers(api))
+    response = http_request("GET", url, headers=get_auth_headers(api))
     response.raise_for_status()
     return response.json()
 
+
+# Per-run position snapshot - one positions call shared by all strategies
+_positions_cache = {}  # BASE_URL -> {symbol: position dict}
+
+
+def reset_run_caches():
+    """Clear per-run caches. Called at the start of every entry point (see entry_point)."""
+    _positions_cache.clear()
+    _sleeve_ledgers.clear()
+    _index_highs.clear()
+    _market_data_docs.clear()
+    _balance_docs.clear()
+    _sleeve_order_apis.clear()
+    clear_price_table()
+    # Bars cached on earlier days are never read again (the cache key includes the end date)
+    today = market_data_today().strftime("%Y-%m-%d")
+    for key in [key for key in _bars_cache if key[2] != today]:
+        del _bars_cache[key]
+
+
+def invalidate_positions_snapshot(api=None):
+    """Drop the cached positions (after orders are submitted) so the next read is fresh."""
+    if api is None:
+        _positions_cache.clear()
+    else:
+        _positions_cache.pop(api["BASE_URL"], None)
+
+
+def get_positions_snapshot(api, refresh=False):
+    """
+    Symbol-indexed view of all account positions, fetched once per run.
+    The snapshot is invalidated automatically when an order is submitted.
+
+    Args:
+        api: Alpaca API credentials dict
+        refresh: Force a fresh positions call
+
+    Returns:
+        dict: symbol -> {"qty", "market_value", "current_price", "avg_entry_price"} as floats
+    """
+    key = api["BASE_URL"]
+    _sleeve_order_apis[key] = api  # Trading path: entry_point settles this account's open sleeve orders
+    hit = not refresh and key in _positions_cache
+    trace_cache("positions", hits=hit, misses=not hit)
+    if not hit:
+        _positions_cache[key] = {
+            p["symbol"]: {
+                "qty": float(p.get("qty") or 0),
+                "market_value": float(p.get("market_value") or 0),
+                "current_price": float(p.get("current_price") or 0),
+                "avg_entry_price": float(p.get("avg_entry_price") or 0),
+            }
+            for p in list_positions(api)
+        }
+    return _positions_cache[key]
+
+
+def get_sleeve_symbols(sleeve):
+    """
+    Tickers belonging to a strategy sleeve.
+
+    Args:
+        sleeve: Key of strategy_sleeves (e.g., "hfea", "sector_momentum")
+
+    Returns:
+        list: Tickers owned by the sleeve
+    """
+    if sleeve == "sector_momentum":
+        symbols = list(sector_momentum_config["sector_etfs"])
+        symbols += sector_momentum_config.get("screen_candidates") or []
+        if sector_momentum_config.get("universe_file"):
+            try:
+                symbols += list(load_universe_file(sector_momentum_config["universe_file"]))
+            except Exception as e:
+                print(f"Warning: Could not read universe file for sleeve symbols: {e}")
+        symbols.append(sector_momentum_config["bond_etf"])
+        return list(dict.fromkeys(symbols))
+    return list(strategy_sleeves[sleeve])
+
+
+def get_sleeve_positions(api, sleeve, prices=None):
+    """
+    Positions of one sleeve, taken from the per-run snapshot.
+
+    Quantities come from the sleeve ledger, so a ticker held by several sleeves is split
+    between them (capped at the account quantity). Without a ledger the sleeve owns
+    the whole position of each of its tickers.
+
+    Args:
+        api: Alpaca API credentials dict
+        sleeve: Key of strategy_sleeves, or an explicit list of tickers
+        prices: Optional dict symbol -> price to value positions with (e.g. a batched quote
+                snapshot); defaults to the price reported with the positions
+
+    Returns:
+        dict: symbol -> {"qty", "price", "value"} for held tickers of the sleeve
+    """
+    snapshot = get_positions_snapshot(api)
+    holdings = get_sleeve_holdings(api, sleeve) if isinstance(sleeve, str) else None
+    if holdings is None:
+        symbols = get_sleeve_symbols(sleeve) if isinstance(sleeve, str) else sleeve
+        holdings = {symbol: snapshot[symbol]["qty"] for symbol in symbols if symbol in snapshot}
+
+    sleeve_positions = {}
+    for symbol, qty in holdings.items():
+        position = snapshot.get(symbol)
+        if not position or position["qty"] == 0:
+            continue
+        qty = min(qty, position["qty"]) if position["qty"] > 0 else position["qty"]
+        price = (prices or {}).get(symbol) or position["current_price"]
+        sleeve_positions[symbol] = {"qty": qty, "price": price, "value": qty * price}
+    return sleeve_positions
+
 def get_order(api, order_id):
     url = f"{api['BASE_URL']}/v2/orders/{order_id}"
-    response = requests.get(url, headers=get_auth_headers(api))
+    response = http_request("GET", url, headers=get_auth_headers(api))
     response.raise_for_status()
     return response.json()
 
-def submit_order(api, symbol, qty, side):
-    url = f"{api['BASE_URL']}/v2/orders"
-    data = {
-        "symbol": symbol,
-        "qty": round(qty, 6),
-        "side": side,
-        "type": "market",
-        "time_in_force": "day",
-    }
-    response = requests.post(url, headers=get_auth_headers(api), json=data)
+def submit_order(api, symbol, qty, side, sleeve=None, notional=None):
+    """
+    Submit a market day order.
+    
+    Args:
+        api: Alpaca API credentials
+        symbol: Ticker to trade
+        qty: Share quantity (fractional allowed); None when notional is given
+        side: "buy" or "sell"
+        sleeve: Key of strategy_sleeves to attribute the fill to in the sleeve ledger, or a dict
+            sleeve -> quantity for an aggregated order (the fill is split pro rata, see plan_orders)
+        notional: Dollar amount to trade instead of a quantity (Alpaca sizes the fractional shares)
+    
+    Returns:
+        dict: Alpaca order
+    """
+    url = f"{api['BASE_URL']}/v2/orders"
+    data = {
+        "symbol": symbol,
+        "side": side,
+        "type": "market",
+        "time_in_force": "day",
+    }
+    if notional is not None:
+        data["notional"] = f"{notional:.2f}"
+    else:
+        data["qty"] = round(qty, 6)
+    response = http_request("POST", url, headers=get_auth_headers(api), json=data)
+    
+    # Enhanced error handling to show Alpaca's actual error message
+    if not response.ok:
+        try:
+            error_detail = response.json()
+            print(f"Alpaca order error for {symbol}: {error_detail}")
+        except Exception:
+            print(f"Alpaca order error for {symbol}: {response.text}")
+    
+    response.raise_for_status()
+    invalidate_positions_snapshot(api)
+    order = response.json()
+    sleeve_label = "+".join(sleeve) if isinstance(sleeve, dict) else sleeve or ""
+    journal_event(get_api_env(api), "order", sleeve_label, symbol, side, qty or 0.0, amount=notional or 0.0, ref=order["id"])
+    if sleeve is not None:
+        _sleeve_orders[order["id"]] = {"sleeve": sleeve, "symbol": symbol, "side": side, "base_url": api["BASE_URL"]}
+        _sleeve_order_apis[api["BASE_URL"]] = api
+    return order
+
+
+def buy_amount(api, symbol, amount, sleeve=None, skip_order_wait=False):
+    """
+    Buy a dollar amount of a symbol.
+    
+    In notional mode (order_config["notional_buys"]) the amount is submitted as is and the
+    quantity and price come from the fill, so no quote is fetched before the order. When the
+    caller skips the order wait, the fill is confirmed for up to confirm_timeout seconds; only an
+    order still open after that is sized from a latest-trade estimate (its fill is recorded later
+    by settle_sleeve_orders). With notional_buys off, the quantity is sized from the latest trade.
+    
+    Args:
+        api: Alpaca API credentials
+        symbol: Ticker to buy
+        amount: Dollar amount to invest
+        sleeve: Key of strategy_sleeves to attribute the fill to
+        skip_order_wait: Do not wait for the full fill timeout
+    
+    Returns:
+        dict: {"order": Alpaca order, "qty": shares bought, "price": price per share, "filled": bool}
+              (qty and price are 0 when the order ended unfilled, see buy_canceled)
+    """
+    if not order_config["notional_buys"]:
+        price = float(get_latest_trade(api, symbol))
+        qty = amount / price
+        order = submit_order(api, symbol, qty, "buy", sleeve=sleeve)
+        filled = False
+        if not skip_order_wait:
+            filled = bool(wait_for_order_fill(api, order["id"]))
+        return {"order": order, "qty": qty, "price": price, "filled": filled}
+    
+    order = submit_order(api, symbol, None, "buy", sleeve=sleeve, notional=amount)
+    if skip_order_wait:
+        final = wait_for_order(api, order["id"], timeout=order_config["confirm_timeout"], poll_interval=1, notify_timeout=False)
+    else:
+        final = wait_for_order(api, order["id"])
+    filled_qty = float((final or {}).get("filled_qty") or 0)
+    if final and filled_qty > 0:
+        return {"order": final, "qty": filled_qty, "price": float(final["filled_avg_price"]), "filled": True}
+    if final and final["status"] in TERMINAL_ORDER_STATUSES:
+        return {"order": final, "qty": 0.0, "price": 0.0, "filled": False}
+    
+    # Still open: estimate the shares so the strategy state stays close until settlement
+    price = float(get_latest_trade(api, symbol))
+    return {"order": final or order, "qty": amount / price, "price": price, "filled": False}
+
+
+def buy_canceled(purchase):
+    """True when a buy_amount order ended without a fill (canceled, expired or rejected): nothing was bought."""
+    return not purchase["filled"] and purchase["qty"] == 0
+
+def plan_orders(proposals, cross_sleeve=None):
+    """
+    Aggregate proposed orders into the fewest orders to submit.
     
-    # Enhanced error handling to show Alpaca's actual error message
-    if not response.ok:
-        try:
-            error_detail = response.json()
-            print(f"Alpaca order error for {symbol}: {error_detail}")
-        except Exception:
-            print(f"Alpaca order error for {symbol}: {response.text}")
+    Legs of the same sleeve and symbol are netted (selling UPRO twice becomes one sell; a sell and
+    a buy of the same symbol by one sleeve cancel). Same-side legs of different sleeves are merged
+    into one order whose fill is split pro rata. With cross_sleeve netting, opposite legs of
+    different sleeves are netted as well: only the net quantity is submitted and the offsetting
+    quantities are returned as internal crosses.
     
-    response.raise_for_status()
-    return response.json()
+    Args:
+        proposals: list of (sleeve, symbol, side, qty)
+        cross_sleeve: Net opposite legs across sleeves (defaults to order_config["cross_sleeve_netting"])
+    
+    Returns:
+        tuple: (orders, crosses) - orders are dicts {"symbol", "side", "qty", "sleeves": sleeve -> qty},
+               crosses are (sleeve, symbol, side, qty) settled between sleeves without an order
+    """
+    if cross_sleeve is None:
+        cross_sleeve = order_config["cross_sleeve_netting"]
+    min_qty = order_config["min_order_qty"]
+    
+    net = {}  # symbol -> sleeve -> signed quantity
+    for sleeve, symbol, side, qty in proposals:
+        signed = qty if side == "buy" else -qty
+        net.setdefault(symbol, {})
+        net[symbol][sleeve] = net[symbol].get(sleeve, 0.0) + signed
+    
+    orders = []
+    crosses = []
+    for symbol, by_sleeve in net.items():
+        buys = {sleeve: qty for sleeve, qty in by_sleeve.items() if qty > min_qty}
+        sells = {sleeve: -qty for sleeve, qty in by_sleeve.items() if qty < -min_qty}
+        if cross_sleeve and buys and sells:
+            total_buy, total_sell = sum(buys.values()), sum(sells.values())
+            crossed = min(total_buy, total_sell)
+            for sleeve, qty in buys.items():
+                crosses.append((sleeve, symbol, "buy", qty * crossed / total_buy))
+            for sleeve, qty in sells.items():
+                crosses.append((sleeve, symbol, "sell", qty * crossed / total_sell))
+            # What is left over is submitted for the larger side, in proportion
+            buys = {sleeve: qty * (1 - crossed / total_buy) for sleeve, qty in buys.items()}
+            sells = {sleeve: qty * (1 - crossed / total_sell) for sleeve, qty in sells.items()}
+        for side, legs in (("sell", sells), ("buy", buys)):
+            qty = sum(legs.values())
+            if qty > min_qty:
+                orders.append({"symbol": symbol, "side": side, "qty": qty,
+                               "sleeves": {sleeve: leg for sleeve, leg in legs.items() if leg > 0}})
+    return orders, crosses
+
+
+def execute_order_plan(api, proposals, prices=None, skip_order_wait=False):
+    """
+    Submit proposed orders through plan_orders: all sells first, then all buys, each wave in parallel.
+    
+    Fills are attributed back to the proposing sleeves pro rata (see record_order_fill). Internal
+    crosses are recorded to the sleeve ledger at the fill price of the symbol's net order, or at
+    prices[symbol] when the legs cancel completely.
+    
+    Args:
+        api: Alpaca API credentials
+        proposals: list of (sleeve, symbol, side, qty)
+        prices: Optional dict symbol -> reference price for internal crosses
+        skip_order_wait: Submit without waiting for fills
+    
+    Returns:
+        list: One dict per submitted order {"symbol", "side", "qty", "sleeves", "order", "error"}
+    """
+    orders, crosses = plan_orders(proposals)
+    print(f"Order plan: {len(proposals)} proposed legs -> {len(orders)} orders, {len(crosses)} internal crosses")
+    
+    def place(planned):
+        sleeve = next(iter(planned["sleeves"])) if len(planned["sleeves"]) == 1 else planned["sleeves"]
+        order = submit_order(api, planned["symbol"], planned["qty"], planned["side"], sleeve=sleeve)
+        if not skip_order_wait:
+            order = wait_for_order(api, order["id"]) or order
+        return order
+    
+    results = []
+    for side in ("sell", "buy"):
+        wave = [planned for planned in orders if planned["side"] == side]
+        if not wave:
+            continue
+        if any(result["error"] for result in results):
+            # Entries are funded by the exits; do not buy when an exit failed
+            results.extend({**planned, "order": None, "error": "skipped after a failed sell"} for planned in wave)
+            continue
+        with ThreadPoolExecutor(max_workers=min(8, len(wave))) as pool:
+            futures = [(planned, pool.submit(place, planned)) for planned in wave]
+        for planned, future in futures:
+            try:
+                results.append({**planned, "order": future.result(), "error": None})
+            except Exception as e:
+                print(f"Failed to {side} {planned['symbol']}: {e}")
+                results.append({**planned, "order": None, "error": str(e)})
+    
+    fill_prices = {
+        result["symbol"]: float(result["order"]["filled_avg_price"])
+        for result in results
+        if result["order"] and result["order"].get("filled_avg_price")
+    }
+    for sleeve, symbol, side, qty in crosses:
+        price = fill_prices.get(symbol) or (prices or {}).get(symbol) or float(get_latest_trade(api, symbol))
+        with _sleeve_ledger_lock:
+            journal_event(get_api_env(api), "fill", sleeve, symbol, side, qty, price, qty * price, "cross")
+            record_sleeve_fill(api, sleeve, symbol, side, qty, price, "cross")
+    return results
+
 
 def is_running_in_cloud():
     return (
@@ -427,6 +1919,7 @@ def is_running_in_cloud():
 
 
 # Function to get secrets from Google Secret Manager
+@traced("dependency", "secret_manager")
 def get_secret(secret_name):
     # We're on Google Cloud
     print(os.getenv("GOOGLE_CLOUD_PROJECT"))
@@ -478,48 +1971,128 @@ def get_telegram_secrets():
     return telegram_key, chat_id
 
 
+# FRED rate series cache: change points of the series, persisted in Firestore ("fred-series/{id}")
+# and refreshed from FRED at most once per day with an incremental observation_start
+FRED_SERIES_ID = "DFEDTARU"  # Federal Funds Target Rate - Upper Limit
+_fred_series_cache = {}  # series_id -> {"dates", "values", "last_observation", "last_refresh"}
+
+
+def _get_fred_api_key():
+    # Get FRED API key from Secret Manager or env
+    if is_running_in_cloud():
+        return get_secret("FREDKEY")
+    load_dotenv()
+    return os.getenv("FREDKEY")
+
+
+def _fetch_fred_observations(series_id, observation_start=None):
+    """Fetch observations (ascending) from FRED, optionally starting at observation_start (YYYY-MM-DD)."""
+    fred_key = _get_fred_api_key()
+    if not fred_key:
+        raise RuntimeError("FRED API key not found")
+    
+    params = {"series_id": series_id, "api_key": fred_key, "file_type": "json", "sort_order": "asc"}
+    if observation_start:
+        params["observation_start"] = observation_start
+    response = http_request("GET", "https://api.stlouisfed.org/fred/series/observations", params=params, timeout=10)
+    response.raise_for_status()
+    return response.json().get("observations", [])
+
+
+def _merge_fred_observations(series, observations):
+    """Append observations to the series, keeping only the dates where the value changes."""
+    for observation in observations:
+        # Handle '.' (missing data) or other non-numeric values
+        if observation.get("value") in (".", None):
+            continue
+        # FRED returns percentages (e.g., 5.25) - store as decimal
+        value = float(observation["value"]) / 100.0
+        date = observation["date"]
+        if series["last_observation"] and date <= series["last_observation"]:
+            continue
+        if not series["values"] or series["values"][-1] != value:
+            series["dates"].append(date)
+            series["values"].append(value)
+        series["last_observation"] = date
+
+
+def load_fred_series(series_id=FRED_SERIES_ID, refresh=True):
+    """
+    Get a FRED series as change points, from memory, then Firestore, then FRED.
+    
+    The series is refreshed at most once per day; a refresh only requests observations
+    after the last stored one. If FRED is unreachable the cached series is served as-is.
+    
+    Args:
+        series_id: FRED series id
+        refresh: Allow the daily incremental refresh from FRED
+    
+    Returns:
+        dict: {"dates": [YYYY-MM-DD, ...], "values": [decimal, ...], "last_observation", "last_refresh"}
+              (empty lists if nothing could be loaded)
+    """
+    today = datetime.date.today().isoformat()
+    series = _fred_series_cache.get(series_id)
+    trace_cache("fred_series", hits=series is not None, misses=series is None)
+    doc_ref = None
+    
+    if series is None:
+        series = {"dates": [], "values": [], "last_observation": None, "last_refresh": None}
+        try:
+            doc_ref = get_firestore_client().collection("fred-series").document(series_id)
+            doc = doc_ref.get()
+            if doc.exists:
+                series.update(doc.to_dict())
+        except Exception as e:
+            print(f"Warning: Could not load FRED series {series_id} from Firestore (local testing?): {e}")
+        _fred_series_cache[series_id] = series
+    
+    if refresh and series["last_refresh"] != today:
+        try:
+            _merge_fred_observations(series, _fetch_fred_observations(series_id, series["last_observation"]))
+            series["last_refresh"] = today
+            try:
+                doc_ref = doc_ref or get_firestore_client().collection("fred-series").document(series_id)
+                doc_ref.set(series)
+            except Exception as e:
+                print(f"Warning: Could not save FRED series {series_id} to Firestore (local testing?): {e}")
+        except Exception as e:
+            print(f"Error refreshing FRED series {series_id}: {e}")
+    
+    return series
+
+
+def get_fred_rate_on(date, series_id=FRED_SERIES_ID):
+    """
+    Point-in-time lookup of the FRED rate in effect on a date (for backtests of the margin-rate gate).
+    
+    Args:
+        date: datetime.date, datetime or "YYYY-MM-DD"
+        series_id: FRED series id
+    
+    Returns:
+        float: Rate as a decimal, or None if the date precedes the series
+    """
+    series = load_fred_series(series_id)
+    day = date.isoformat()[:10] if hasattr(date, "isoformat") else str(date)[:10]
+    index = bisect.bisect_right(series["dates"], day) - 1
+    return series["values"][index] if index >= 0 else None
+
+
 def get_fred_rate():
     """
-    Fetch the current Federal Funds Target Rate (Upper Limit) from FRED API.
+    Current Federal Funds Target Rate (Upper Limit), served from the cached FRED series.
+    FRED is called at most once per day (incrementally); see load_fred_series.
     
     Returns:
         float: Current FRED rate as a decimal (e.g., 0.0525 for 5.25%), or None on error
     """
     try:
-        # Get FRED API key from Secret Manager or env
-        if is_running_in_cloud():
-            fred_key = get_secret("FREDKEY")
-        else:
-            load_dotenv()
-            fred_key = os.getenv("FREDKEY")
-        
-        if not fred_key:
-            print("FRED API key not found")
-            return None
-        
-        # Fetch DFEDTARU (Federal Funds Target Rate - Upper Limit)
-        url = f"https://api.stlouisfed.org/fred/series/observations?series_id=DFEDTARU&api_key={fred_key}&file_type=json&sort_order=desc&limit=1"
-        
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        
-        data = response.json()
-        
-        if "observations" in data and len(data["observations"]) > 0:
-            # Get the most recent observation value
-            rate_value = data["observations"][0]["value"]
-            
-            # Handle '.' (missing data) or other non-numeric values
-            if rate_value == "." or rate_value is None:
-                print("FRED API returned missing data")
-                return None
-            
-            # Convert to float and return as decimal (FRED returns percentage, e.g., 5.25)
-            return float(rate_value) / 100.0
-        else:
+        series = load_fred_series()
+        if not series["values"]:
             print("No FRED data available")
             return None
-            
+        return series["values"][-1]
     except Exception as e:
         print(f"Error fetching FRED rate: {e}")
         return None
@@ -538,7 +2111,7 @@ def get_account_info(api):
     """
     try:
         url = f"{api['BASE_URL']}/v2/account"
-        response = requests.get(url, headers=get_auth_headers(api))
+        response = http_request("GET", url, headers=get_auth_headers(api))
         response.raise_for_status()
         
         account_data = response.json()
@@ -555,6 +2128,80 @@ def get_account_info(api):
         return None
 
 
+# Last good value of each margin gate input, used when a live fetch fails or times out
+_margin_input_fallbacks = {}
+
+
+def _fetch_market_trend_input():
+    spy_data = get_all_market_data("SPY")
+    if spy_data is None:
+        spy_data = update_market_data("SPY")
+    return spy_data
+
+
+def fetch_margin_inputs(api):
+    """
+    Fetch the independent margin gate inputs (SPY trend data, account, FRED rate) concurrently.
+    
+    Each input has its own timeout (margin_control_config["input_timeouts"]). A failed or timed
+    out trend/rate input falls back to its last good value (the stale market-data cache for SPY);
+    account data has no fallback since leverage must reflect the live account.
+    
+    Args:
+        api: Alpaca API credentials dict
+    
+    Returns:
+        tuple: (inputs, timings, errors) - inputs maps "market_trend"/"account"/"margin_rate" to a
+               value or None, timings maps each input (and "total") to seconds, errors maps
+               failed inputs to a message
+    """
+    fetchers = {
+        "market_trend": _fetch_market_trend_input,
+        "account": lambda: get_account_info(api),
+        "margin_rate": get_fred_rate,
+    }
+    timeouts = margin_control_config["input_timeouts"]
+    timings = {}
+    
+    def timed(name):
+        start = time.perf_counter()
+        try:
+            return fetchers[name]()
+        finally:
+            timings[name] = time.perf_counter() - start
+    
+    started = time.perf_counter()
+    executor = ThreadPoolExecutor(max_workers=len(fetchers))
+    futures = {name: executor.submit(timed, name) for name in fetchers}
+    inputs, errors = {}, {}
+    for name, future in futures.items():
+        remaining = max(0.0, timeouts[name] - (time.perf_counter() - started))
+        try:
+            inputs[name] = future.result(timeout=remaining)
+        except FuturesTimeoutError:
+            timings[name] = time.perf_counter() - started
+            errors[name] = f"timed out after {timeouts[name]}s"
+            inputs[name] = None
+        except Exception as e:
+            errors[name] = str(e)
+            inputs[name] = None
+    executor.shutdown(wait=False)  # Never block on a hung input
+    timings["total"] = time.perf_counter() - started
+    
+    for name in ("market_trend", "margin_rate"):
+        if inputs[name] is not None:
+            _margin_input_fallbacks[name] = inputs[name]
+            continue
+        fallback = _margin_input_fallbacks.get(name)
+        if fallback is None and name == "market_trend":
+            fallback = get_all_market_data("SPY", allow_stale=True)
+        if fallback is not None:
+            print(f"Warning: Margin input {name} unavailable ({errors.get(name, 'no data')}), using last known value")
+            inputs[name] = fallback
+    
+    return inputs, dict(timings), errors
+
+
 def check_margin_conditions(api):
     """
     Evaluate all margin control gates to determine if leverage is allowed.
@@ -565,6 +2212,8 @@ def check_margin_conditions(api):
     3. Buffer: (equity/portfolio_value) - (maintenance_margin/portfolio_value) ≥ 5%
     4. Leverage: portfolio_value / equity < 1.14×
     
+    The trend, account and rate inputs are fetched concurrently (see fetch_margin_inputs).
+    
     Args:
         api: Alpaca API credentials dict
     
@@ -575,6 +2224,7 @@ def check_margin_conditions(api):
             "gate_results": dict - individual gate pass/fail status
             "metrics": dict - all calculated metrics
             "errors": list - any errors encountered
+            "timings": dict - seconds spent fetching each input, plus "total"
         }
     """
     result = {
@@ -588,28 +2238,30 @@ def check_margin_conditions(api):
         },
         "metrics": {},
         "errors": [],
+        "timings": {},
     }
     
     try:
+        inputs, result["timings"], input_errors = fetch_margin_inputs(api)
+        
         # Gate 1: Market Trend (SPY > 200-SMA as S&P 500 proxy)
         try:
-            # Get all SPY data at once (efficient single fetch/read)
-            spy_data = get_all_market_data("SPY")
+            spy_data = inputs["market_trend"]
             if spy_data is None:
-                spy_data = update_market_data("SPY")
+                raise RuntimeError(input_errors.get("market_trend", "no SPY market data"))
             
             spy_price = spy_data["price"]
             spy_sma = spy_data["sma200"]
             result["metrics"]["spx_price"] = spy_price  # Keep key name for compatibility
             result["metrics"]["spx_sma"] = spy_sma
-            # Use 1% margin band for consistent trend filtering with SPXL strategy
-            result["gate_results"]["market_trend"] = spy_price > spy_sma * (1 + margin)
+            # Same 1% band state as the SPXL strategy (SMA state store)
+            result["gate_results"]["market_trend"] = sma_state_from_market_data(spy_data, 200, margin * 100)["state"] == "above"
         except Exception as e:
             result["errors"].append(f"Market trend check failed: {e}")
             return result
         
-        # Get account information for remaining gates
-        account_info = get_account_info(api)
+        # Account information for remaining gates
+        account_info = inputs["account"]
         if not account_info:
             result["errors"].append("Failed to fetch account information")
             return result
@@ -626,7 +2278,7 @@ def check_margin_conditions(api):
         
         # Gate 2: Margin Rate (FRED + spread ≤ 8.0%)
         try:
-            fred_rate = get_fred_rate()
+            fred_rate = inputs["margin_rate"]
             if fred_rate is None:
                 result["errors"].append("Failed to fetch FRED rate")
                 return result
@@ -688,7 +2340,7 @@ def calculate_monthly_investments(api, margin_result, env="live"):
     
     Steps:
     1. Get total cash from account (can be negative if margin is already in use)
-    2. Load Firestore balances for all SMA strategies  
+    2. Load the Firestore balances of the SMA strategies  
     3. Check which strategies are currently below their SMA (bearish)
     4. Subtract reserved amounts only for bearish strategies
     5. Calculate available margin (equity × 10%), accounting for existing margin debt
@@ -717,7 +2369,6 @@ def calculate_monthly_investments(api, margin_result, env="live"):
     equity = metrics.get("equity", 0)
     
     # Step 2: Load Firestore reserved amounts
-    balances = load_balances(env)
     reserved_amounts = {}
     
     # Step 3 & 4: Check SMA status and subtract if bearish
@@ -730,19 +2381,12 @@ def calculate_monthly_investments(api, margin_result, env="live"):
         
         # Check if currently bearish (significantly below SMA with 1% margin band)
         try:
-            # Get all market data at once (efficient single fetch/read)
-            market_data = get_all_market_data(index_symbol)
-            if market_data is None:
-                market_data = update_market_data(index_symbol)
-            
-            sma_200 = market_data["sma200"]
-            latest_price = market_data["price"]
-            # Use 1% margin band for consistent trend filtering with SPXL strategy
-            is_bearish = latest_price < sma_200 * (1 - margin)
+            # Same 1% band state as the SPXL strategy (SMA state store)
+            is_bearish = get_sma_state(index_symbol, 200, margin * 100)["state"] == "below"
             
             if is_bearish:
                 # Subtract reserved amount
-                reserved = balances.get(firestore_key, {}).get("invested", 0)
+                reserved = get_balance(firestore_key, env, ["invested"]).get("invested", 0)
                 if reserved and reserved > 0:
                     reserved_amounts[firestore_key] = reserved
         except Exception as e:
@@ -779,76 +2423,727 @@ def calculate_monthly_investments(api, margin_result, env="live"):
     
     total_investing = available_cash + margin_approved
     
-    # Step 8: Split by strategy percentages
-    strategy_amounts = {
-        key: total_investing * allocation 
-        for key, allocation in strategy_allocations.items()
-    }
+    # Step 8: Split by strategy percentages
+    strategy_amounts = {
+        key: total_investing * allocation 
+        for key, allocation in strategy_allocations.items()
+    }
+    
+    return {
+        "total_cash": total_cash,
+        "total_reserved": total_reserved,
+        "total_available": available_cash,
+        "margin_approved": margin_approved,
+        "used_margin": used_margin,
+        "total_investing": total_investing,
+        "strategy_amounts": strategy_amounts,
+        "reserved_amounts": reserved_amounts
+    }
+
+
+# Pre-trade risk gates applied per strategy (in evaluation order)
+risk_gate_policies = {
+    "default": ("deleverage", "gates_failed", "buying_power", "min_investment", "leverage"),
+    "golden_hfea_lite": ("deleverage", "min_investment", "leverage"),
+    "dual_momentum": ("leverage",),
+    "sector_momentum": ("leverage",),
+}
+
+
+def evaluate_risk_gates(proposals, margin_result, investment_calc):
+    """
+    Evaluate the monthly buys of all strategies in one pass against a running projected account.
+    
+    Accepted buys raise the projected portfolio value and consume buying power, so later
+    proposals are checked against the account as it will be after the earlier ones
+    (equity is unchanged by a purchase, so projected leverage = projected portfolio / equity).
+    
+    Args:
+        proposals: List of (strategy, amount) in execution order; strategy keys match
+                   strategy_sleeves (policies come from risk_gate_policies)
+        margin_result: Dict from check_margin_conditions()
+        investment_calc: Dict from calculate_monthly_investments()
+    
+    Returns:
+        dict: strategy -> {"accepted": bool, "gate": failed gate or None, "reason": str or None,
+                           "projected_leverage": float or None}
+    """
+    target_margin = margin_result["target_margin"]
+    metrics = margin_result["metrics"]
+    leverage = metrics.get("leverage", 1.0)
+    equity = metrics.get("equity", 0)
+    projected_portfolio_value = metrics.get("portfolio_value", 0)
+    buying_power = investment_calc["total_available"] + investment_calc["margin_approved"]
+    max_leverage = margin_control_config["max_leverage"]
+    
+    decisions = {}
+    for strategy, amount in proposals:
+        gate, reason, projected_leverage = None, None, None
+        for check in risk_gate_policies.get(strategy, risk_gate_policies["default"]):
+            if check == "deleverage" and target_margin == 0 and leverage > 1.0:
+                reason = f"Skipped - Deleveraging required (leverage: {leverage:.2f}x)"
+            elif check == "gates_failed" and target_margin == 0:
+                reason = f"Skipped - Margin gates failed (cash-only mode, buying power: ${buying_power:.2f})"
+            elif check == "buying_power" and buying_power < amount:
+                reason = f"Skipped - Insufficient buying power (${buying_power:.2f} < ${amount:.2f})"
+            elif check == "min_investment" and amount < margin_control_config["min_investment"]:
+                reason = f"Skipped - Investment amount ${amount:.2f} below Alpaca minimum ($1.00)"
+            elif check == "leverage" and target_margin > 0 and projected_portfolio_value > 0 and equity > 0:
+                projected_leverage = (projected_portfolio_value + amount) / equity
+                if projected_leverage >= max_leverage:
+                    reason = f"Skipped - Projected leverage ({projected_leverage:.3f}x) would exceed limit ({max_leverage:.2f}x)"
+            if reason is not None:
+                gate = check
+                break
+        
+        if gate is None:
+            projected_portfolio_value += amount
+            buying_power -= amount
+            if projected_leverage is not None:
+                print(f"Risk gates ({strategy}): Leverage {leverage:.3f}x → Projected {projected_leverage:.3f}x (limit: {max_leverage:.2f}x)")
+        else:
+            print(f"Risk gates ({strategy}): {reason}")
+        decisions[strategy] = {
+            "accepted": gate is None,
+            "gate": gate,
+            "reason": reason,
+            "projected_leverage": projected_leverage,
+        }
+    return decisions
+
+
+def save_balance(strategy, data, env="live"):
+    """
+    Save strategy balance to Firestore with environment separation.
+    Handles Firestore unavailability gracefully for local testing.
+    
+    Args:
+        strategy: Strategy name (e.g., "dual_momentum")
+        data: Either a simple float (invested amount) or dict with multiple fields
+        env: Environment ("live" or "paper") - determines Firestore collection
+    """
+    try:
+        # Use environment-specific collection to separate paper/live data
+        collection_name = f"strategy-balances-{env}"
+        doc_ref = get_firestore_client().collection(collection_name).document(strategy)
+        
+        # Handle both simple float values and complex dictionaries
+        if not isinstance(data, dict):
+            data = {"invested": data}
+        doc_ref.set(data)
+        _balance_docs[(env, strategy)] = {"data": dict(data), "fields": None}
+            
+    except Exception as e:
+        print(f"Warning: Could not save balance to Firestore for {strategy} ({env}): {e}")
+
+
+_balance_docs = {}  # (env, strategy) -> {"data": dict, "fields": set of loaded fields or None (whole document)}
+
+
+def get_balance(strategy, env="live", fields=None):
+    """
+    Read one strategy balance document, memoized for the run.
+    
+    Only the requested document is read (with a field mask when fields are given); later
+    calls for the same document and fields, and documents written with save_balance, are
+    served from memory.
+    
+    Args:
+        strategy: Strategy document ID (e.g., "SPXL_SMA", "dual_momentum")
+        env: Environment ("live" or "paper") - determines Firestore collection
+        fields: Top-level fields to read (None = whole document)
+    
+    Returns:
+        dict: The balance (only the requested fields if given); empty if missing or unavailable
+    """
+    key = (env, strategy)
+    cached = _balance_docs.get(key)
+    miss = cached is None or (cached["fields"] is not None and (fields is None or not set(fields) <= cached["fields"]))
+    trace_cache("balances", hits=not miss, misses=miss)
+    if miss:
+        try:
+            doc_ref = get_firestore_client().collection(f"strategy-balances-{env}").document(strategy)
+            doc = doc_ref.get(field_paths=list(fields)) if fields else doc_ref.get()
+            data = (doc.to_dict() or {}) if doc.exists else {}
+        except Exception as e:
+            print(f"Warning: Could not load Firestore balance for {strategy} ({env}) (local testing?): {e}")
+            return {}
+        if fields and doc.exists:
+            loaded = set(fields) | (cached["fields"] if cached else set())
+            cached = {"data": {**(cached["data"] if cached else {}), **data}, "fields": loaded}
+        else:
+            cached = {"data": data, "fields": None}
+        _balance_docs[key] = cached
+    
+    data = cached["data"]
+    if fields:
+        return {field: data[field] for field in fields if field in data}
+    return dict(data)
+
+
+def load_balances(env="live"):
+    """
+    Load all strategy balances from Firestore with environment separation.
+    Prefer get_balance() when only some documents are needed.
+    Returns empty dict if Firestore is unavailable (local testing without proper config).
+    
+    Args:
+        env: Environment ("live" or "paper") - determines Firestore collection
+    
+    Returns:
+        dict: Strategy balances from the specified environment
+    """
+    balances = {}
+    try:
+        # Use environment-specific collection to separate paper/live data
+        collection_name = f"strategy-balances-{env}"
+        docs = get_firestore_client().collection(collection_name).stream()
+        for doc in docs:
+            balances[doc.id] = doc.to_dict()
+            _balance_docs[(env, doc.id)] = {"data": balances[doc.id], "fields": None}
+    except Exception as e:
+        print(f"Warning: Could not load Firestore balances ({env}) (local testing?): {e}")
+        # Return empty dict for local testing without Firestore
+    return balances
+
+
+# Sleeve Ledger - lot-level attribution of fills to strategy sleeves
+#
+# Firestore layout (collection "sleeve-ledger-{env}"):
+#   "snapshot"     -> {"seq", "month", "lots": {sleeve: {symbol: "qty:price:date;qty:price:date"}}}
+#   "log-YYYY-MM"  -> {"events": ["seq|date|sleeve|symbol|side|qty|price|order_id", ...]}
+# Events are appended with ArrayUnion; replaying the log on top of the latest snapshot
+# rebuilds the lots. A fresh snapshot is written every `snapshot_every` events.
+# Sleeve orders still open when a run ends are kept in "sleeve-orders-{env}/{order_id}"
+# ({"sleeve", "symbol", "side", "submitted"}) and settled by a later run.
+_sleeve_ledgers = {}  # env -> in-memory ledger state
+_sleeve_orders = {}  # order_id -> {"sleeve", "symbol", "side", "base_url", "stored"} awaiting a fill
+_sleeve_order_apis = {}  # BASE_URL -> credentials used this run (entry_point settles their open orders)
+_sleeve_ledger_lock = threading.RLock()
+
+
+def get_api_env(api):
+    """Environment ("live" or "paper") of an Alpaca credentials dict."""
+    return "paper" if "paper-api" in api["BASE_URL"] else "live"
+
+
+def _encode_lots(lots):
+    return ";".join(f"{qty:.6f}:{price:.4f}:{date}" for qty, price, date in lots)
+
+
+def _decode_lots(encoded):
+    lots = []
+    for lot in filter(None, encoded.split(";")):
+        qty, price, date = lot.split(":")
+        lots.append([float(qty), float(price), date])
+    return lots
+
+
+def _apply_ledger_event(ledger, sleeve, symbol, side, qty, price, date):
+    """Apply one fill to the FIFO lots of a sleeve (buys open lots, sells close the oldest first)."""
+    lots = ledger["lots"].setdefault(sleeve, {}).setdefault(symbol, [])
+    if side == "buy":
+        lots.append([qty, price, date])
+        return
+    remaining = qty
+    while lots and remaining > 1e-9:
+        if lots[0][0] <= remaining + 1e-9:
+            remaining -= lots.pop(0)[0]
+        else:
+            lots[0][0] -= remaining
+            remaining = 0
+    if remaining > 1e-6:
+        print(f"Warning: sleeve ledger sold {remaining:.6f} more {symbol} than {sleeve} holds")
+    if not lots:
+        del ledger["lots"][sleeve][symbol]
+
+
+def _write_ledger_snapshot(env, ledger):
+    collection = get_firestore_client().collection(f"sleeve-ledger-{env}")
+    collection.document("snapshot").set({
+        "seq": ledger["seq"],
+        "month": ledger["month"],
+        "lots": {
+            sleeve: {symbol: _encode_lots(lots) for symbol, lots in symbols.items()}
+            for sleeve, symbols in ledger["lots"].items()
+        },
+        "timestamp": datetime.datetime.utcnow()
+    })
+    ledger["since_snapshot"] = 0
+
+
+def _seed_sleeve_ledger(api, ledger):
+    """
+    Seed an empty ledger from the current account positions by ticker membership.
+    A ticker listed by several sleeves is attributed to the first one in strategy_sleeves.
+    """
+    snapshot = get_positions_snapshot(api)
+    today = datetime.date.today().isoformat()
+    seeded = set()
+    for sleeve in strategy_sleeves:
+        for symbol in get_sleeve_symbols(sleeve):
+            position = snapshot.get(symbol)
+            if symbol in seeded or not position or position["qty"] <= 0:
+                continue
+            _apply_ledger_event(ledger, sleeve, symbol, "buy", position["qty"], position["avg_entry_price"], today)
+            seeded.add(symbol)
+
+
+def load_sleeve_ledger(env="live", api=None):
+    """
+    Load the sleeve ledger (latest snapshot + log replay), cached for the run.
+    When no snapshot exists yet and credentials are given, the ledger is seeded from the account.
+    Returns an offline (empty, non-persisted) ledger if Firestore is unavailable.
+    
+    Args:
+        env: Environment ("live" or "paper") - determines Firestore collection
+        api: Optional Alpaca API credentials used to seed a new ledger
+    
+    Returns:
+        dict: {"seq", "month", "since_snapshot", "lots": {sleeve: {symbol: [[qty, price, date], ...]}}, "offline"}
+    """
+    if env in _sleeve_ledgers:
+        return _sleeve_ledgers[env]
+    
+    ledger = {"seq": 0, "month": datetime.date.today().strftime("%Y-%m"), "since_snapshot": 0, "lots": {}, "offline": False}
+    try:
+        collection = get_firestore_client().collection(f"sleeve-ledger-{env}")
+        snapshot = collection.document("snapshot").get()
+        if snapshot.exists:
+            data = snapshot.to_dict()
+            ledger["seq"] = data.get("seq", 0)
+            ledger["month"] = data.get("month", ledger["month"])
+            ledger["lots"] = {
+                sleeve: {symbol: _decode_lots(encoded) for symbol, encoded in symbols.items()}
+                for sleeve, symbols in data.get("lots", {}).items()
+            }
+            
+            # Replay events logged after the snapshot (log docs sort by month)
+            events = []
+            for doc in collection.where("__name__", ">=", collection.document(f"log-{ledger['month']}")).stream():
+                if doc.id.startswith("log-"):
+                    events.extend(doc.to_dict().get("events", []))
+            for event in sorted((e.split("|") for e in events), key=lambda e: int(e[0])):
+                seq, date, sleeve, symbol, side, qty, price = event[:7]
+                if int(seq) <= ledger["seq"]:
+                    continue
+                _apply_ledger_event(ledger, sleeve, symbol, side, float(qty), float(price), date)
+                ledger["seq"] = int(seq)
+                ledger["month"] = date[:7]
+                ledger["since_snapshot"] += 1
+        elif api is not None:
+            _seed_sleeve_ledger(api, ledger)
+            _write_ledger_snapshot(env, ledger)
+            print(f"Seeded sleeve ledger ({env}) from current positions")
+    except Exception as e:
+        print(f"Warning: Could not load sleeve ledger ({env}) (local testing?): {e}")
+        ledger["lots"] = {}
+        ledger["offline"] = True
+    
+    _sleeve_ledgers[env] = ledger
+    return ledger
+
+
+def record_sleeve_fill(api, sleeve, symbol, side, qty, price, order_id=""):
+    """
+    Record a fill to a sleeve: update the in-memory lots and append a compact event to the log.
+    
+    Args:
+        api: Alpaca API credentials (selects the environment)
+        sleeve: Key of strategy_sleeves owning the fill
+        symbol: Ticker filled
+        side: "buy" or "sell"
+        qty: Filled quantity
+        price: Average fill price
+        order_id: Alpaca order id (kept in the event for audits)
+    """
+    env = get_api_env(api)
+    ledger = load_sleeve_ledger(env, api)
+    today = datetime.date.today()
+    ledger["seq"] += 1
+    ledger["month"] = today.strftime("%Y-%m")
+    _apply_ledger_event(ledger, sleeve, symbol, side, qty, price, today.isoformat())
+    
+    if ledger["offline"]:
+        return
+    event = f"{ledger['seq']}|{today.isoformat()}|{sleeve}|{symbol}|{side}|{qty:.6f}|{price:.4f}|{order_id}"
+    try:
+        collection = get_firestore_client().collection(f"sleeve-ledger-{env}")
+        collection.document(f"log-{ledger['month']}").set({"events": firestore.ArrayUnion([event])}, merge=True)
+        ledger["since_snapshot"] += 1
+        if ledger["since_snapshot"] >= sleeve_ledger_config["snapshot_every"]:
+            _write_ledger_snapshot(env, ledger)
+    except Exception as e:
+        print(f"Warning: Could not record sleeve fill for {sleeve} {symbol} ({env}): {e}")
+
+
+def record_order_fill(api, order):
+    """Attribute a terminal order (filled, or partially filled then canceled) to the sleeve that placed it."""
+    tag = _sleeve_orders.pop(order["id"], None)
+    filled_qty = float(order.get("filled_qty") or 0)
+    if tag is None or filled_qty <= 0:
+        return
+    filled_price = float(order.get("filled_avg_price") or 0)
+    # Aggregated orders carry sleeve -> quantity; the fill is split in proportion
+    allocations = tag["sleeve"] if isinstance(tag["sleeve"], dict) else {tag["sleeve"]: 1.0}
+    total = sum(allocations.values())
+    # Fills may be recorded from order-wait threads (see execute_sector_rotation)
+    with _sleeve_ledger_lock:
+        for sleeve, share in allocations.items():
+            qty = filled_qty * share / total
+            journal_event(get_api_env(api), "fill", sleeve, tag["symbol"], tag["side"], qty, filled_price,
+                          qty * filled_price, order["id"])
+            record_sleeve_fill(api, sleeve, tag["symbol"], tag["side"], qty, filled_price, order["id"])
+
+
+def _load_stored_sleeve_orders(api):
+    """Add sleeve orders left open by earlier runs (sleeve-orders-{env}) to _sleeve_orders."""
+    try:
+        for doc in get_firestore_client().collection(f"sleeve-orders-{get_api_env(api)}").stream():
+            tag = doc.to_dict()
+            _sleeve_orders.setdefault(doc.id, {
+                "sleeve": tag["sleeve"], "symbol": tag["symbol"], "side": tag["side"],
+                "base_url": api["BASE_URL"], "stored": True,
+            })
+    except Exception as e:
+        print(f"Warning: Could not load open sleeve orders ({get_api_env(api)}) (local testing?): {e}")
+
+
+def _store_sleeve_orders(api, settled, pending):
+    """Delete settled orders from sleeve-orders-{env} and store the ones still open."""
+    try:
+        collection = get_firestore_client().collection(f"sleeve-orders-{get_api_env(api)}")
+        batch = get_firestore_client().batch()
+        for order_id in settled:
+            batch.delete(collection.document(order_id))
+        for order_id in pending:
+            tag = _sleeve_orders[order_id]
+            batch.set(collection.document(order_id), {
+                "sleeve": tag["sleeve"], "symbol": tag["symbol"], "side": tag["side"],
+                "submitted": datetime.datetime.utcnow(),
+            })
+            tag["stored"] = True
+        if settled or pending:
+            batch.commit()
+    except Exception as e:
+        print(f"Warning: Could not store open sleeve orders ({get_api_env(api)}): {e}")
+
+
+def settle_sleeve_orders(api, timeout=None, poll_interval=5):
+    """
+    Poll sleeve-tagged orders that were submitted without waiting (skip_order_wait), or that an
+    earlier run left open, and record their fills. Orders still open after the timeout are stored
+    in sleeve-orders-{env} so the next settlement (in any instance) picks them up.
+    """
+    timeout = sleeve_ledger_config["settle_timeout"] if timeout is None else timeout
+    _load_stored_sleeve_orders(api)
+    pending = [order_id for order_id, tag in _sleeve_orders.items() if tag["base_url"] == api["BASE_URL"]]
+    stored = {order_id for order_id in pending if _sleeve_orders[order_id].get("stored")}
+    settled = []
+    elapsed_time = 0
+    while pending:
+        for order_id in list(pending):
+            try:
+                order = get_order(api, order_id)
+            except Exception as e:
+                print(f"Warning: Could not fetch order {order_id} for settlement: {e}")
+                continue
+            if order["status"] in TERMINAL_ORDER_STATUSES:
+                record_order_fill(api, order)
+                pending.remove(order_id)
+                settled.append(order_id)
+        if not pending or elapsed_time >= timeout:
+            break
+        time.sleep(poll_interval)
+        elapsed_time += poll_interval
+    _store_sleeve_orders(
+        api,
+        [order_id for order_id in settled if order_id in stored],
+        [order_id for order_id in pending if order_id not in stored],
+    )
+    if pending:
+        print(f"Warning: {len(pending)} sleeve orders still open after {timeout}s; stored for the next settlement")
+
+
+def settle_open_sleeve_orders():
+    """Short settlement of every account that traded this run (called by entry_point)."""
+    for api in list(_sleeve_order_apis.values()):
+        try:
+            settle_sleeve_orders(api, timeout=sleeve_ledger_config["final_settle_timeout"])
+        except Exception as e:
+            print(f"Warning: Could not settle sleeve orders: {e}")
+
+
+def get_sleeve_holdings(api, sleeve):
+    """
+    Quantities a sleeve owns according to the ledger.
+    
+    Args:
+        api: Alpaca API credentials (selects the environment)
+        sleeve: Key of strategy_sleeves
     
+    Returns:
+        dict or None: symbol -> qty, or None when the ledger is unavailable
+    """
+    ledger = load_sleeve_ledger(get_api_env(api), api)
+    if ledger["offline"] and not ledger["lots"]:
+        return None
     return {
-        "total_cash": total_cash,
-        "total_reserved": total_reserved,
-        "total_available": available_cash,
-        "margin_approved": margin_approved,
-        "used_margin": used_margin,
-        "total_investing": total_investing,
-        "strategy_amounts": strategy_amounts,
-        "reserved_amounts": reserved_amounts
+        symbol: sum(lot[0] for lot in lots)
+        for symbol, lots in ledger["lots"].get(sleeve, {}).items()
+        if sum(lot[0] for lot in lots) > 1e-9
     }
 
 
-def save_balance(strategy, data, env="live"):
+# Trade & Decision Journal - append-only, compact binary rows in daily segments
+#
+# Each flush appends one chunk per day: a 4-byte header length, a JSON header with the
+# chunk's string table ({"strings": [...], "rows": n}) and n fixed-width rows of
+# JOURNAL_ROW_DTYPE (strategy/symbol/ref are indexes into the string table).
+# Chunks are stored in Firestore ("trade-journal-{env}/YYYY-MM-DD", field "chunks")
+# and mirrored to local segment files (journal_config["directory"]/{env}/YYYY-MM-DD.seg)
+# with an index.json listing the strategies, symbols and kinds present per day.
+JOURNAL_KINDS = ("decision", "order", "fill")
+JOURNAL_ROW_DTYPE = np.dtype([
+    ("ts", "<i8"),  # Epoch milliseconds (UTC)
+    ("kind", "u1"),  # Index into JOURNAL_KINDS
+    ("side", "i1"),  # 1 buy, -1 sell, 0 none
+    ("strategy", "<u2"),
+    ("symbol", "<u2"),
+    ("qty", "<f8"),
+    ("price", "<f8"),
+    ("amount", "<f8"),
+    ("ref", "<u4"),  # Order id for orders/fills, action note for decisions
+])
+
+journal_config = {
+    "directory": os.getenv("JOURNAL_DIR", "journal"),  # Local segment store (ignored in the cloud)
+}
+
+_journal_buffer = {}  # env -> list of pending event tuples
+
+
+def journal_event(env, kind, strategy, symbol="", side=None, qty=0.0, price=0.0, amount=0.0, ref=""):
     """
-    Save strategy balance to Firestore with environment separation.
-    Handles Firestore unavailability gracefully for local testing.
+    Buffer one journal event; buffered events are written by flush_journal().
     
     Args:
-        strategy: Strategy name (e.g., "dual_momentum")
-        data: Either a simple float (invested amount) or dict with multiple fields
-        env: Environment ("live" or "paper") - determines Firestore collection
+        env: Environment ("live" or "paper")
+        kind: "decision", "order" or "fill"
+        strategy: Sleeve / strategy name
+        symbol: Ticker ("" for portfolio-level decisions)
+        side: "buy", "sell" or None
+        qty: Share quantity
+        price: Price per share
+        amount: Dollar amount
+        ref: Order id, or a short action note for decisions
     """
-    try:
-        # Use environment-specific collection to separate paper/live data
-        collection_name = f"strategy-balances-{env}"
-        doc_ref = get_firestore_client().collection(collection_name).document(strategy)
-        
-        # Handle both simple float values and complex dictionaries
-        if isinstance(data, dict):
-            doc_ref.set(data)
-        else:
-            doc_ref.set({"invested": data})
-            
-    except Exception as e:
-        print(f"Warning: Could not save balance to Firestore for {strategy} ({env}): {e}")
+    ts = int(datetime.datetime.now(datetime.timezone.utc).timestamp() * 1000)
+    side_code = {"buy": 1, "sell": -1}.get(side, 0)
+    _journal_buffer.setdefault(env, []).append(
+        (ts, JOURNAL_KINDS.index(kind), side_code, strategy, symbol or "", float(qty or 0), float(price or 0), float(amount or 0), ref or "")
+    )
 
 
-def load_balances(env="live"):
+def journal_decision(env, strategy, action, symbol="", amount=0.0, price=0.0):
+    """Journal a strategy decision (action is a short note such as "Bought 3 shares of SPXL")."""
+    journal_event(env, "decision", strategy, symbol, amount=amount, price=price, ref=action)
+
+
+def encode_journal_chunk(events):
+    """Encode event tuples into one binary chunk (header + fixed-width rows)."""
+    strings = {}
+    rows = np.zeros(len(events), dtype=JOURNAL_ROW_DTYPE)
+    for i, (ts, kind, side, strategy, symbol, qty, price, amount, ref) in enumerate(events):
+        rows[i] = (
+            ts, kind, side,
+            strings.setdefault(strategy, len(strings)),
+            strings.setdefault(symbol, len(strings)),
+            qty, price, amount,
+            strings.setdefault(ref, len(strings)),
+        )
+    header = json.dumps({"strings": list(strings), "rows": len(events)}).encode()
+    return len(header).to_bytes(4, "little") + header + rows.tobytes()
+
+
+def decode_journal_chunks(data):
+    """Decode concatenated chunks into (string_table, rows) pairs."""
+    chunks = []
+    offset = 0
+    while offset < len(data):
+        header_length = int.from_bytes(data[offset:offset + 4], "little")
+        header = json.loads(data[offset + 4:offset + 4 + header_length])
+        offset += 4 + header_length
+        rows = np.frombuffer(data, dtype=JOURNAL_ROW_DTYPE, count=header["rows"], offset=offset)
+        offset += header["rows"] * JOURNAL_ROW_DTYPE.itemsize
+        chunks.append((header["strings"], rows))
+    return chunks
+
+
+def _journal_directory(env):
+    path = os.path.join(journal_config["directory"], env)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _load_journal_index(env):
+    index_path = os.path.join(_journal_directory(env), "index.json")
+    if not os.path.exists(index_path):
+        return {}
+    with open(index_path) as f:
+        return json.load(f)
+
+
+def _save_journal_index(env, index):
+    with open(os.path.join(_journal_directory(env), "index.json"), "w") as f:
+        json.dump(index, f, sort_keys=True)
+
+
+def _update_journal_index(env, day, chunk):
+    """Merge one chunk's strategies/symbols/kinds into the local index.json."""
+    index = _load_journal_index(env)
+    entry = index.setdefault(day, {"strategies": [], "symbols": [], "kinds": [], "rows": 0})
+    for strings, rows in decode_journal_chunks(chunk):
+        entry["strategies"] = sorted(set(entry["strategies"]) | {strings[i] for i in np.unique(rows["strategy"])})
+        entry["symbols"] = sorted(set(entry["symbols"]) | {strings[i] for i in np.unique(rows["symbol"])} - {""})
+        entry["kinds"] = sorted(set(entry["kinds"]) | {JOURNAL_KINDS[i] for i in np.unique(rows["kind"])})
+        entry["rows"] += len(rows)
+    _save_journal_index(env, index)
+
+
+def _drop_local_segment(env, day):
+    segment_path = os.path.join(_journal_directory(env), f"{day}.seg")
+    if os.path.exists(segment_path):
+        os.remove(segment_path)
+    index = _load_journal_index(env)
+    if index.pop(day, None) is not None:
+        _save_journal_index(env, index)
+
+
+def _append_local_segment(env, day, chunk):
+    with open(os.path.join(_journal_directory(env), f"{day}.seg"), "ab") as f:
+        f.write(chunk)
+    _update_journal_index(env, day, chunk)
+
+
+def flush_journal():
     """
-    Load strategy balances from Firestore with environment separation.
-    Returns empty dict if Firestore is unavailable (local testing without proper config).
+    Write buffered journal events as one chunk per environment and day.
+    Firestore and local failures are reported but never interrupt trading.
+    """
+    for env, events in list(_journal_buffer.items()):
+        by_day = {}
+        for event in events:
+            day = datetime.datetime.fromtimestamp(event[0] / 1000, datetime.timezone.utc).date().isoformat()
+            by_day.setdefault(day, []).append(event)
+        for day, day_events in by_day.items():
+            chunk = encode_journal_chunk(day_events)
+            try:
+                get_firestore_client().collection(f"trade-journal-{env}").document(day).set(
+                    {"chunks": firestore.ArrayUnion([chunk])}, merge=True
+                )
+            except Exception as e:
+                print(f"Warning: Could not write trade journal to Firestore ({env}): {e}")
+            if not is_running_in_cloud():
+                try:
+                    _append_local_segment(env, day, chunk)
+                except OSError as e:
+                    print(f"Warning: Could not write local trade journal ({env}): {e}")
+        _journal_buffer.pop(env, None)
+
+
+def sync_journal(env="live", start=None, end=None):
+    """
+    Rebuild local segments for [start, end] from Firestore so queries run locally.
     
     Args:
-        env: Environment ("live" or "paper") - determines Firestore collection
+        env: Environment ("live" or "paper")
+        start: First day (date or "YYYY-MM-DD"), default: all
+        end: Last day (inclusive), default: all
     
     Returns:
-        dict: Strategy balances from the specified environment
+        int: Number of days synced
     """
-    balances = {}
-    try:
-        # Use environment-specific collection to separate paper/live data
-        collection_name = f"strategy-balances-{env}"
-        docs = get_firestore_client().collection(collection_name).stream()
-        for doc in docs:
-            balances[doc.id] = doc.to_dict()
-    except Exception as e:
-        print(f"Warning: Could not load Firestore balances ({env}) (local testing?): {e}")
-        # Return empty dict for local testing without Firestore
-    return balances
+    collection = get_firestore_client().collection(f"trade-journal-{env}")
+    query = collection
+    if start is not None:
+        query = query.where("__name__", ">=", collection.document(str(start)))
+    if end is not None:
+        query = query.where("__name__", "<=", collection.document(str(end)))
+    
+    days = 0
+    for doc in query.stream():
+        _drop_local_segment(env, doc.id)
+        for chunk in doc.to_dict().get("chunks", []):
+            _append_local_segment(env, doc.id, chunk)
+        days += 1
+    return days
+
+
+def query_journal(env="live", start=None, end=None, strategy=None, symbol=None, kind=None):
+    """
+    Query the local journal. The index prunes days first; rows are then filtered vectorized.
+    
+    Args:
+        env: Environment ("live" or "paper")
+        start: First day (date or "YYYY-MM-DD"), default: all
+        end: Last day (inclusive), default: all
+        strategy: Strategy name filter
+        symbol: Ticker filter
+        kind: "decision", "order" or "fill"
+    
+    Returns:
+        pd.DataFrame: Columns ts, kind, side, strategy, symbol, qty, price, amount, ref
+    """
+    columns = ["ts", "kind", "side", "strategy", "symbol", "qty", "price", "amount", "ref"]
+    directory = _journal_directory(env)
+    index = _load_journal_index(env)
+    
+    days = [
+        day for day, entry in sorted(index.items())
+        if (start is None or day >= str(start)) and (end is None or day <= str(end))
+        and (strategy is None or strategy in entry["strategies"])
+        and (symbol is None or symbol in entry["symbols"])
+        and (kind is None or kind in entry["kinds"])
+    ]
+    
+    frames = []
+    for day in days:
+        with open(os.path.join(directory, f"{day}.seg"), "rb") as f:
+            data = f.read()
+        for strings, rows in decode_journal_chunks(data):
+            mask = np.ones(len(rows), dtype=bool)
+            for field, value in (("strategy", strategy), ("symbol", symbol)):
+                if value is not None:
+                    mask &= (rows[field] == strings.index(value)) if value in strings else False
+            if kind is not None:
+                mask &= rows["kind"] == JOURNAL_KINDS.index(kind)
+            selected = rows[mask]
+            if not len(selected):
+                continue
+            table = np.array(strings, dtype=object)
+            frames.append(pd.DataFrame({
+                "ts": pd.to_datetime(selected["ts"], unit="ms", utc=True),
+                "kind": np.array(JOURNAL_KINDS, dtype=object)[selected["kind"]],
+                "side": np.where(selected["side"] > 0, "buy", np.where(selected["side"] < 0, "sell", "")),
+                "strategy": table[selected["strategy"]],
+                "symbol": table[selected["symbol"]],
+                "qty": selected["qty"],
+                "price": selected["price"],
+                "amount": selected["amount"],
+                "ref": table[selected["ref"]],
+            }))
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
 
 
 # 9-Sig Strategy Data Management Functions
-def save_nine_sig_quarterly_data(quarter_id, tqqq_balance, agg_balance, signal_line, action, quarterly_contributions):
-    """Save quarterly data following 3Sig methodology for next quarter's calculations"""
+def save_nine_sig_quarterly_data(quarter_id, tqqq_balance, agg_balance, signal_line, action, quarterly_contributions, nine_sig_state=None):
+    """
+    Save quarterly data following 3Sig methodology for next quarter's calculations.
+    Also closes the quarter in the 9-Sig aggregate (see load_nine_sig_state).
+    """
     doc_ref = get_firestore_client().collection("nine-sig-quarters").document(quarter_id)
     doc_ref.set({
         "quarter_id": quarter_id,
@@ -861,6 +3156,67 @@ def save_nine_sig_quarterly_data(quarter_id, tqqq_balance, agg_balance, signal_l
         "total_portfolio": tqqq_balance + agg_balance,
         "timestamp": datetime.datetime.utcnow()
     })
+    
+    state = nine_sig_state or load_nine_sig_state()
+    state["previous_tqqq_balance"] = tqqq_balance
+    state["last_quarter_id"] = quarter_id
+    state["last_action"] = action
+    state["last_signal_line"] = signal_line
+    state["quarters_closed"] = state.get("quarters_closed", 0) + 1
+    if action == "SELL_IGNORED":
+        state["ignored_sell_signals"] = state.get("ignored_sell_signals", 0) + 1
+    save_nine_sig_state(state)
+
+
+def _nine_sig_quarter_id(when=None):
+    when = when or datetime.datetime.now()
+    return f"{when.year}-Q{(when.month - 1) // 3 + 1}"
+
+
+def load_nine_sig_state():
+    """
+    Load the 9-Sig aggregate: one document (nine-sig-state/aggregate) with everything the
+    quarterly signal needs, maintained incrementally by track_nine_sig_monthly_contribution
+    and save_nine_sig_quarterly_data.
+    
+    On first use the aggregate is bootstrapped from the nine-sig-quarters and
+    nine-sig-monthly-contributions history and saved.
+    
+    Returns:
+        dict: {"previous_tqqq_balance", "quarter_id", "quarter_contributions" (month -> amount
+               for quarter_id), "ignored_sell_signals", "quarters_closed", "last_quarter_id",
+               "last_action", "last_signal_line", "updated"}
+    """
+    db = get_firestore_client()
+    doc = db.collection("nine-sig-state").document("aggregate").get()
+    if doc.exists:
+        return doc.to_dict()
+    
+    print("9-Sig: Bootstrapping the aggregate from quarter and contribution history")
+    today = datetime.datetime.now()
+    quarter_start = datetime.datetime(today.year, ((today.month - 1) // 3) * 3 + 1, 1)
+    months = {}
+    for month_doc in db.collection("nine-sig-monthly-contributions").where("timestamp", ">=", quarter_start).stream():
+        data = month_doc.to_dict()
+        months[data.get("month", month_doc.id)] = data.get("amount", 0)
+    state = {
+        "previous_tqqq_balance": get_previous_quarter_tqqq_balance(),
+        "quarter_id": _nine_sig_quarter_id(today),
+        "quarter_contributions": months,
+        "ignored_sell_signals": count_ignored_sell_signals(),
+        "quarters_closed": len(list(db.collection("nine-sig-quarters").stream())),
+        "last_quarter_id": None,
+        "last_action": None,
+        "last_signal_line": None,
+    }
+    save_nine_sig_state(state)
+    return state
+
+
+def save_nine_sig_state(state):
+    """Write the 9-Sig aggregate document."""
+    state["updated"] = datetime.datetime.utcnow()
+    get_firestore_client().collection("nine-sig-state").document("aggregate").set(state)
 
 
 def get_previous_quarter_tqqq_balance():
@@ -885,29 +3241,29 @@ def track_nine_sig_monthly_contribution(amount):
             "amount": amount,
             "timestamp": datetime.datetime.utcnow()
         })
+        
+        # Keep the aggregate's running quarter contributions in step
+        state = load_nine_sig_state()
+        quarter_id = _nine_sig_quarter_id()
+        if state.get("quarter_id") != quarter_id:
+            state["quarter_id"] = quarter_id
+            state["quarter_contributions"] = {}
+        state["quarter_contributions"][current_month] = amount
+        save_nine_sig_state(state)
     except Exception as e:
         print(f"Warning: Could not track 9-Sig contribution to Firestore: {e}")
 
 
-def get_quarterly_nine_sig_contributions():
+def get_quarterly_nine_sig_contributions(nine_sig_state=None):
     """
-    Get sum of actual 9-Sig contributions made in the current quarter.
+    Get sum of actual 9-Sig contributions made in the current quarter (from the aggregate).
     Returns 0 if Firestore is unavailable (local testing).
     """
     try:
-        today = datetime.datetime.now()
-        
-        # Determine current quarter's start month
-        quarter_start_month = ((today.month - 1) // 3) * 3 + 1
-        quarter_start = datetime.datetime(today.year, quarter_start_month, 1)
-        
-        # Get all monthly contributions from this quarter
-        docs = get_firestore_client().collection("nine-sig-monthly-contributions").where(
-            "timestamp", ">=", quarter_start
-        ).stream()
-        
-        total_contributions = sum(doc.to_dict().get("amount", 0) for doc in docs)
-        return total_contributions
+        state = nine_sig_state or load_nine_sig_state()
+        if state.get("quarter_id") != _nine_sig_quarter_id():
+            return 0
+        return sum(state.get("quarter_contributions", {}).values())
     except Exception as e:
         print(f"Warning: Could not load 9-Sig quarterly contributions from Firestore: {e}")
         return 0  # Return 0 for local testing without Firestore
@@ -915,48 +3271,17 @@ def get_quarterly_nine_sig_contributions():
 
 def check_spy_30_down_rule():
     """
-    Check if SPY has dropped 30% from all-time high using Alpaca data.
-    Uses 2-year period to capture recent all-time highs and crashes.
+    Check if SPY has dropped 30% from its high using the running-high index.
+    Uses a 2-year window to capture recent highs and crashes.
     """
     try:
-        # Get API credentials
-        api = set_alpaca_environment(env=alpaca_environment)
-        
-        # Fetch 2 years of SPY data from Alpaca
-        from datetime import datetime, timedelta
-        
-        market_data_base_url = "https://data.alpaca.markets"
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=730)  # 2 years
-        
-        url = f"{market_data_base_url}/v2/stocks/SPY/bars"
-        params = {
-            "start": start_date.strftime("%Y-%m-%d"),
-            "end": end_date.strftime("%Y-%m-%d"),
-            "timeframe": "1Day",
-            "limit": 10000,
-            "adjustment": "split",
-            "feed": "iex"
-        }
-        
-        response = requests.get(url, headers=get_auth_headers(api), params=params)
-        response.raise_for_status()
-        
-        data = response.json()
-        bars = data.get("bars", [])
-        
-        if len(bars) < 10:  # Need sufficient data
-            print(f"Insufficient SPY data for 30-down rule: {len(bars)} bars")
+        drawdown = get_index_drawdown("SPY", window_days=730)
+        if drawdown is None:
+            print("Insufficient SPY data for 30-down rule")
             return False
         
-        # Get all-time high and current close from bars
-        all_time_high = max(bar['h'] for bar in bars)
-        current_close = bars[-1]['c']
-        
-        # Check if current is 30% below the all-time high
-        drop_percentage = (all_time_high - current_close) / all_time_high
-        
-        return drop_percentage >= 0.30
+        # Check if current is 30% below the 2-year high
+        return drawdown["drawdown"] >= 0.30
         
     except Exception as e:
         print(f"Error checking SPY 30 down rule: {e}")
@@ -974,7 +3299,7 @@ def count_ignored_sell_signals():
         return 0
 
 
-def make_monthly_nine_sig_contributions(api, force_execute=False, investment_calc=None, margin_result=None, skip_order_wait=False, env="live"):
+def make_monthly_nine_sig_contributions(api, force_execute=False, investment_calc=None, margin_result=None, skip_order_wait=False, env="live", risk_decision=None):
     """
     Monthly contributions go ONLY to AGG (bonds) - Following 3Sig Rule.
     Now includes margin-aware logic with dynamic investment amounts and All-or-Nothing approach.
@@ -984,6 +3309,7 @@ def make_monthly_nine_sig_contributions(api, force_execute=False, investment_cal
         force_execute: Bypass trading day check for testing
         investment_calc: Pre-calculated investment amounts (from orchestrator) - optional
         margin_result: Pre-calculated margin conditions (from orchestrator) - optional
+        risk_decision: Pre-evaluated risk gate decision (from orchestrator) - optional
     """
     if not force_execute and not check_trading_day(mode="monthly"):
         print("Not first trading day of the month")
@@ -1002,67 +3328,18 @@ def make_monthly_nine_sig_contributions(api, force_execute=False, investment_cal
     
     investment_amount = investment_calc["strategy_amounts"]["nine_sig_allo"]
     
-    target_margin = margin_result["target_margin"]
-    metrics = margin_result["metrics"]
-    leverage = metrics.get("leverage", 1.0)
-    
-    # Determine available buying power (already calculated in investment_calc)
-    buying_power = investment_calc["total_available"] + investment_calc["margin_approved"]
-    
-    # Check if we should skip investment
-    if target_margin == 0:
-        # Cash-only mode triggered
-        if leverage > 1.0:
-            # Still leveraged - must skip to deleverage
-            action_taken = f"Skipped - Deleveraging required (leverage: {leverage:.2f}x)"
-            send_margin_summary_message(margin_result, "9-Sig", action_taken, investment_calc)
-            print(action_taken)
-            return action_taken
-        # Equity-only but gates failed - skip without Firestore addition
-        action_taken = f"Skipped - Margin gates failed (cash-only mode, buying power: ${buying_power:.2f})"
-        send_margin_summary_message(margin_result, "9-Sig", action_taken, investment_calc)
-        print(action_taken)
-        return action_taken
-    
-    # Check if we have sufficient buying power for full investment (All-or-Nothing)
-    if buying_power < investment_amount:
-        action_taken = f"Skipped - Insufficient buying power (${buying_power:.2f} < ${investment_amount:.2f})"
-        send_margin_summary_message(margin_result, "9-Sig", action_taken, investment_calc)
+    # Pre-trade risk gates (evaluated jointly by the orchestrator, or for this strategy alone)
+    if risk_decision is None:
+        risk_decision = evaluate_risk_gates([("nine_sig", investment_amount)], margin_result, investment_calc)["nine_sig"]
+    if not risk_decision["accepted"]:
+        action_taken = risk_decision["reason"]
+        send_margin_summary_message(margin_result, "9-Sig", action_taken, investment_calc, env)
         print(action_taken)
         return action_taken
     
-    # Check minimum investment amount (Alpaca requirement)
-    if investment_amount < margin_control_config["min_investment"]:
-        action_taken = f"Skipped - Investment amount ${investment_amount:.2f} below Alpaca minimum ($1.00)"
-        send_margin_summary_message(margin_result, "9-Sig", action_taken, investment_calc)
-        print(action_taken)
-        return action_taken
-    
-    # Check projected leverage after investment to ensure we don't exceed 1.14x
-    if target_margin > 0:  # Only check if margin is enabled
-        portfolio_value = metrics.get("portfolio_value", 0)
-        current_equity = metrics.get("equity", 0)
-        
-        if portfolio_value > 0 and current_equity > 0:
-            projected_portfolio_value = portfolio_value + investment_amount
-            projected_equity = current_equity
-            
-            if projected_equity > 0:
-                projected_leverage = projected_portfolio_value / projected_equity
-                
-                if projected_leverage >= margin_control_config["max_leverage"]:
-                    action_taken = f"Skipped - Projected leverage ({projected_leverage:.3f}x) would exceed limit ({margin_control_config['max_leverage']:.2f}x)"
-                    send_margin_summary_message(margin_result, "9-Sig", action_taken, investment_calc)
-                    print(f"Current leverage: {leverage:.3f}x, Projected leverage: {projected_leverage:.3f}x")
-                    print(action_taken)
-                    return action_taken
-                else:
-                    print(f"9-Sig: Leverage check - Current {leverage:.3f}x → Projected {projected_leverage:.3f}x (limit: {margin_control_config['max_leverage']:.2f}x)")
-    
     # ALL monthly contributions go to AGG only (core 3Sig rule)
     # Load current strategy state from Firestore
-    balances = load_balances(env)
-    nine_sig_data = balances.get("nine_sig", {})
+    nine_sig_data = get_balance("nine_sig", env)
     total_invested = nine_sig_data.get("total_invested", 0)
     current_agg_shares = nine_sig_data.get("current_agg_shares", 0)
     
@@ -1071,13 +3348,15 @@ def make_monthly_nine_sig_contributions(api, force_execute=False, investment_cal
     print(f"Total invested: ${total_invested:.2f}")
     
     try:
-        agg_price = float(get_latest_trade(api, "AGG"))
-        agg_shares_to_buy = investment_amount / agg_price
-        
-        if agg_shares_to_buy > 0:
-            order = submit_order(api, "AGG", agg_shares_to_buy, "buy")
-            if not skip_order_wait:
-                wait_for_order_fill(api, order["id"])
+        if investment_amount > 0:
+            purchase = buy_amount(api, "AGG", investment_amount, sleeve="nine_sig", skip_order_wait=skip_order_wait)
+            if buy_canceled(purchase):
+                action_taken = f"AGG order for ${investment_amount:.2f} was {purchase['order']['status']} - nothing invested"
+                print(f"9-Sig: {action_taken}")
+                send_margin_summary_message(margin_result, "9-Sig", action_taken, investment_calc, env)
+                return f"9-Sig monthly contribution: {action_taken}"
+            agg_price = purchase["price"]
+            agg_shares_to_buy = purchase["qty"]
             
             # Calculate new totals
             new_total_agg_shares = current_agg_shares + agg_shares_to_buy
@@ -1122,7 +3401,7 @@ def make_monthly_nine_sig_contributions(api, force_execute=False, investment_cal
             
             # Create action summary
             action_taken = f"Invested ${investment_amount:.2f} in AGG - {agg_shares_to_buy:.4f} shares"
-            send_margin_summary_message(margin_result, "9-Sig", action_taken, investment_calc)
+            send_margin_summary_message(margin_result, "9-Sig", action_taken, investment_calc, env)
         
         return f"9-Sig monthly contribution: ${investment_amount:.2f} invested in AGG"
     
@@ -1133,7 +3412,7 @@ def make_monthly_nine_sig_contributions(api, force_execute=False, investment_cal
         return error_msg
 
 
-def make_monthly_buys_golden_hfea_lite(api, force_execute=False, investment_calc=None, margin_result=None, skip_order_wait=False, env="live"):
+def make_monthly_buys_golden_hfea_lite(api, force_execute=False, investment_calc=None, margin_result=None, skip_order_wait=False, env="live", risk_decision=None):
     """
     Make monthly Golden HFEA Lite purchases with margin-aware logic and dynamic investment amounts.
     Uses All-or-Nothing approach: invest full amount or skip entirely.
@@ -1143,6 +3422,7 @@ def make_monthly_buys_golden_hfea_lite(api, force_execute=False, investment_calc
         force_execute: Bypass trading day check for testing
         investment_calc: Pre-calculated investment amounts (from orchestrator) - optional
         margin_result: Pre-calculated margin conditions (from orchestrator) - optional
+        risk_decision: Pre-evaluated risk gate decision (from orchestrator) - optional
     """
     if not force_execute and not check_trading_day(mode="monthly"):
         print("Not first trading day of the month")
@@ -1161,44 +3441,24 @@ def make_monthly_buys_golden_hfea_lite(api, force_execute=False, investment_calc
     
     investment_amount = investment_calc["strategy_amounts"]["golden_hfea_lite_allo"]
     
-    target_margin = margin_result["target_margin"]
-    metrics = margin_result["metrics"]
-    leverage = metrics.get("leverage", 1.0)
-    
-    # Determine available buying power (already calculated in investment_calc)
-    # buying_power = investment_calc["total_available"] + investment_calc["margin_approved"]
-    
-    # Check if we should skip investment
-    if not target_margin and leverage > 1.0:
+    # Pre-trade risk gates (evaluated jointly by the orchestrator, or for this strategy alone)
+    if risk_decision is None:
+        risk_decision = evaluate_risk_gates([("golden_hfea_lite", investment_amount)], margin_result, investment_calc)["golden_hfea_lite"]
+    if risk_decision["gate"] == "deleverage":
         print("Golden HFEA Lite: Skipping investment - margin disabled and still leveraged")
         send_telegram_message("Golden HFEA Lite: Skipping investment - margin disabled and still leveraged")
         return "Golden HFEA Lite: Skipping investment - margin disabled and still leveraged"
     
-    if investment_amount < margin_control_config["min_investment"]:
+    if risk_decision["gate"] == "min_investment":
         print(f"Golden HFEA Lite: Skipping investment - amount ${investment_amount:.2f} below minimum")
         send_telegram_message(f"Golden HFEA Lite: Skipping investment - amount ${investment_amount:.2f} below minimum")
         return "Golden HFEA Lite: Skipping investment - amount below minimum"
     
-    # Check projected leverage after investment to ensure we don't exceed 1.14x
-    if target_margin > 0:  # Only check if margin is enabled
-        portfolio_value = metrics.get("portfolio_value", 0)
-        current_equity = metrics.get("equity", 0)
-        
-        if portfolio_value > 0 and current_equity > 0:
-            projected_portfolio_value = portfolio_value + investment_amount
-            projected_equity = current_equity
-            
-            if projected_equity > 0:
-                projected_leverage = projected_portfolio_value / projected_equity
-                
-                if projected_leverage >= margin_control_config["max_leverage"]:
-                    action_taken = f"Skipped - Projected leverage ({projected_leverage:.3f}x) would exceed limit ({margin_control_config['max_leverage']:.2f}x)"
-                    send_telegram_message(f"Golden HFEA Lite: {action_taken}")
-                    print(f"Current leverage: {leverage:.3f}x, Projected leverage: {projected_leverage:.3f}x")
-                    print(f"Golden HFEA Lite: {action_taken}")
-                    return action_taken
-                else:
-                    print(f"Golden HFEA Lite: Leverage check - Current {leverage:.3f}x → Projected {projected_leverage:.3f}x (limit: {margin_control_config['max_leverage']:.2f}x)")
+    if not risk_decision["accepted"]:
+        action_taken = risk_decision["reason"]
+        send_telegram_message(f"Golden HFEA Lite: {action_taken}")
+        print(f"Golden HFEA Lite: {action_taken}")
+        return action_taken
     
     # Get current Golden HFEA Lite allocations
     (
@@ -1234,19 +3494,8 @@ def make_monthly_buys_golden_hfea_lite(api, force_execute=False, investment_calc
         zroz_amount = (zroz_underweight / total_underweight) * investment_amount
         gld_amount = (gld_underweight / total_underweight) * investment_amount
 
-    # Get current prices for SSO, ZROZ, and GLD
-    sso_price = float(get_latest_trade(api, "SSO"))
-    zroz_price = float(get_latest_trade(api, "ZROZ"))
-    gld_price = float(get_latest_trade(api, "GLD"))
-
-    # Calculate number of shares to buy
-    sso_shares_to_buy = sso_amount / sso_price
-    zroz_shares_to_buy = zroz_amount / zroz_price
-    gld_shares_to_buy = gld_amount / gld_price
-
     # Load current strategy state from Firestore
-    balances = load_balances(env)
-    golden_hfea_lite_data = balances.get("golden_hfea_lite", {})
+    golden_hfea_lite_data = get_balance("golden_hfea_lite", env)
     total_invested = golden_hfea_lite_data.get("total_invested", 0)
     current_positions = golden_hfea_lite_data.get("current_positions", {})
     
@@ -1257,15 +3506,22 @@ def make_monthly_buys_golden_hfea_lite(api, force_execute=False, investment_calc
     # Execute market orders with enhanced tracking
     shares_bought = []
     trades_executed = []
+    amount_invested = 0
     
-    for symbol, qty, amount in [("SSO", sso_shares_to_buy, sso_amount), ("ZROZ", zroz_shares_to_buy, zroz_amount), ("GLD", gld_shares_to_buy, gld_amount)]:
-        if qty > 0:
+    for symbol, amount in [("SSO", sso_amount), ("ZROZ", zroz_amount), ("GLD", gld_amount)]:
+        if amount > 0:
             try:
-                order = submit_order(api, symbol, qty, "buy")
-                if not skip_order_wait:
-                    wait_for_order_fill(api, order["id"])
+                # Dollar amount order: shares come from the fill (see buy_amount)
+                purchase = buy_amount(api, symbol, amount, sleeve="golden_hfea_lite", skip_order_wait=skip_order_wait)
+                if buy_canceled(purchase):
+                    message = f"Golden HFEA Lite: {symbol} order for ${amount:.2f} was {purchase['order']['status']} - nothing bought"
+                    print(message)
+                    send_telegram_message(message)
+                    continue
+                qty = purchase["qty"]
                 
-                shares_bought.append(qty)
+                amount_invested += amount
+                shares_bought.append((symbol, qty))
                 trades_executed.append(f"Bought {qty:.6f} shares of {symbol} for ${amount:.2f}")
                 print(f"Bought {qty:.6f} shares of {symbol} for ${amount:.2f}")
                 send_telegram_message(f"Golden HFEA Lite: Bought {qty:.6f} shares of {symbol} for ${amount:.2f}")
@@ -1278,12 +3534,9 @@ def make_monthly_buys_golden_hfea_lite(api, force_execute=False, investment_calc
     
     if trades_executed:
         # Update Firestore with new positions
-        total_invested += investment_amount
-        current_positions.update({
-            "SSO": current_positions.get("SSO", 0) + sso_shares_to_buy,
-            "ZROZ": current_positions.get("ZROZ", 0) + zroz_shares_to_buy,
-            "GLD": current_positions.get("GLD", 0) + gld_shares_to_buy
-        })
+        total_invested += amount_invested
+        for symbol, qty in shares_bought:
+            current_positions[symbol] = current_positions.get(symbol, 0) + qty
         
         save_balance("golden_hfea_lite", {
             "total_invested": total_invested,
@@ -1301,13 +3554,13 @@ def make_monthly_buys_golden_hfea_lite(api, force_execute=False, investment_calc
         send_telegram_message(summary_msg)
     
     # Send margin summary
-    action_taken = f"Invested ${investment_amount:.2f}" if trades_executed else "Skipped investment"
-    send_margin_summary_message(margin_result, "Golden HFEA Lite", action_taken, investment_calc)
+    action_taken = f"Invested ${amount_invested:.2f}" if trades_executed else "Skipped investment"
+    send_margin_summary_message(margin_result, "Golden HFEA Lite", action_taken, investment_calc, env)
     
     return "Monthly investment executed."
 
 
-def make_monthly_buys(api, force_execute=False, investment_calc=None, margin_result=None, skip_order_wait=False, env="live"):
+def make_monthly_buys(api, force_execute=False, investment_calc=None, margin_result=None, skip_order_wait=False, env="live", risk_decision=None):
     """
     Make monthly HFEA purchases with margin-aware logic and dynamic investment amounts.
     Uses All-or-Nothing approach: invest full amount or skip entirely.
@@ -1317,6 +3570,7 @@ def make_monthly_buys(api, force_execute=False, investment_calc=None, margin_res
         force_execute: Bypass trading day check for testing
         investment_calc: Pre-calculated investment amounts (from orchestrator) - optional
         margin_result: Pre-calculated margin conditions (from orchestrator) - optional
+        risk_decision: Pre-evaluated risk gate decision (from orchestrator) - optional
     """
     if not force_execute and not check_trading_day(mode="monthly"):
         print("Not first trading day of the month")
@@ -1335,90 +3589,15 @@ def make_monthly_buys(api, force_execute=False, investment_calc=None, margin_res
     
     investment_amount = investment_calc["strategy_amounts"]["hfea_allo"]
     
-    target_margin = margin_result["target_margin"]
-    metrics = margin_result["metrics"]
-    leverage = metrics.get("leverage", 1.0)
-    
-    # Determine available buying power (already calculated in investment_calc)
-    buying_power = investment_calc["total_available"] + investment_calc["margin_approved"]
-    
-    # Check if we should skip investment
-    if target_margin == 0:
-        # Cash-only mode triggered
-        if leverage > 1.0:
-            # Still leveraged - must skip to deleverage
-            action_taken = f"Skipped - Deleveraging required (leverage: {leverage:.2f}x)"
-            send_margin_summary_message(margin_result, "HFEA", action_taken, investment_calc)
-            print(action_taken)
-            return action_taken
-        # Equity-only but gates failed - skip without Firestore addition
-        action_taken = f"Skipped - Margin gates failed (cash-only mode, buying power: ${buying_power:.2f})"
-        send_margin_summary_message(margin_result, "HFEA", action_taken, investment_calc)
-        print(action_taken)
-        return action_taken
-    
-    # Check if we have sufficient buying power for full investment (All-or-Nothing)
-    if buying_power < investment_amount:
-        action_taken = f"Skipped - Insufficient buying power (${buying_power:.2f} < ${investment_amount:.2f})"
-        send_margin_summary_message(margin_result, "HFEA", action_taken, investment_calc)
-        print(action_taken)
-        return action_taken
-    
-    # Check minimum investment amount (Alpaca requirement)
-    if investment_amount < margin_control_config["min_investment"]:
-        action_taken = f"Skipped - Investment amount ${investment_amount:.2f} below Alpaca minimum ($1.00)"
-        send_margin_summary_message(margin_result, "HFEA", action_taken, investment_calc)
+    # Pre-trade risk gates (evaluated jointly by the orchestrator, or for this strategy alone)
+    if risk_decision is None:
+        risk_decision = evaluate_risk_gates([("hfea", investment_amount)], margin_result, investment_calc)["hfea"]
+    if not risk_decision["accepted"]:
+        action_taken = risk_decision["reason"]
+        send_margin_summary_message(margin_result, "HFEA", action_taken, investment_calc, env)
         print(action_taken)
         return action_taken
     
-    # Check projected leverage after investment to ensure we don't exceed 1.14x
-    if target_margin > 0:  # Only check if margin is enabled
-        portfolio_value = metrics.get("portfolio_value", 0)
-        current_equity = metrics.get("equity", 0)
-        current_cash = metrics.get("cash", 0)
-        
-        if portfolio_value > 0 and current_equity > 0:
-            # Calculate projected values after investment
-            # When investing, regardless of cash/margin:
-            # - Portfolio value increases by investment amount (new positions purchased)
-            # - Cash decreases by investment amount (may become more negative if using margin)
-            # - Equity remains unchanged immediately after purchase
-            #   (Equity = Portfolio Value + Cash; both change by same amount: +investment -investment = 0)
-            
-            # IMPORTANT: Reserved cash (from bearish strategies) is still physically in Alpaca
-            # - Alpaca's portfolio_value and equity include ALL cash (reserved + available)
-            # - Reserved cash reduces available_cash for investment calculation, but is still part of account
-            # - This leverage calculation correctly uses actual portfolio_value from Alpaca
-            # - The investment_amount already accounts for reserved cash (via available_cash)
-            
-            projected_portfolio_value = portfolio_value + investment_amount
-            projected_equity = current_equity  # Unchanged immediately after purchase
-            
-            # Calculate projected leverage: Portfolio Value / Equity
-            if projected_equity > 0:
-                projected_leverage = projected_portfolio_value / projected_equity
-                
-                # Get reserved cash info for debug output
-                total_reserved = investment_calc.get("total_reserved", 0)
-                
-                # Debug output showing actual values used
-                print(f"Leverage projection details:")
-                print(f"  Portfolio Value: ${portfolio_value:.2f}, Equity: ${current_equity:.2f}, Cash: ${current_cash:.2f}")
-                if total_reserved > 0:
-                    print(f"  Reserved Cash (Firestore): ${total_reserved:.2f} (still in Alpaca account)")
-                print(f"  Investment Amount: ${investment_amount:.2f} (from available cash + margin)")
-                print(f"  Projected Portfolio Value: ${projected_portfolio_value:.2f}")
-                print(f"  Projected Leverage: {projected_leverage:.3f}x")
-                
-                if projected_leverage >= margin_control_config["max_leverage"]:
-                    action_taken = f"Skipped - Projected leverage ({projected_leverage:.3f}x) would exceed limit ({margin_control_config['max_leverage']:.2f}x)"
-                    send_margin_summary_message(margin_result, "HFEA", action_taken, investment_calc)
-                    print(f"Current leverage: {leverage:.3f}x, Projected leverage: {projected_leverage:.3f}x")
-                    print(action_taken)
-                    return action_taken
-                else:
-                    print(f"Leverage check: Current {leverage:.3f}x → Projected {projected_leverage:.3f}x (limit: {margin_control_config['max_leverage']:.2f}x)")
-    
     # Proceed with investment - we have sufficient funds
     # Get current portfolio allocations and values from get_hfea_allocations
     (
@@ -1454,19 +3633,8 @@ def make_monthly_buys(api, force_execute=False, investment_calc=None, margin_res
         tmf_amount = (tmf_underweight / total_underweight) * investment_amount
         kmlm_amount = (kmlm_underweight / total_underweight) * investment_amount
 
-    # Get current prices for UPRO, TMF, and KMLM
-    upro_price = float(get_latest_trade(api, "UPRO"))
-    tmf_price = float(get_latest_trade(api, "TMF"))
-    kmlm_price = float(get_latest_trade(api, "KMLM"))
-
-    # Calculate number of shares to buy
-    upro_shares_to_buy = upro_amount / upro_price
-    tmf_shares_to_buy = tmf_amount / tmf_price
-    kmlm_shares_to_buy = kmlm_amount / kmlm_price
-
     # Load current strategy state from Firestore
-    balances = load_balances(env)
-    hfea_data = balances.get("hfea", {})
+    hfea_data = get_balance("hfea", env)
     total_invested = hfea_data.get("total_invested", 0)
     current_positions = hfea_data.get("current_positions", {})
     
@@ -1478,37 +3646,44 @@ def make_monthly_buys(api, force_execute=False, investment_calc=None, margin_res
     shares_bought = []
     trades_executed = []
     
-    for symbol, qty, amount in [
-        ("UPRO", upro_shares_to_buy, upro_amount),
-        ("TMF", tmf_shares_to_buy, tmf_amount),
-        ("KMLM", kmlm_shares_to_buy, kmlm_amount),
+    # Dollar amount orders: shares and prices come from the fills (see buy_amount)
+    fills = {symbol: {"qty": 0.0, "price": 0.0} for symbol in ("UPRO", "TMF", "KMLM")}
+    amount_invested = 0
+    for symbol, amount in [
+        ("UPRO", upro_amount),
+        ("TMF", tmf_amount),
+        ("KMLM", kmlm_amount),
     ]:
-        if qty > 0:
-            submit_order(api, symbol, qty, "buy")
-            if not skip_order_wait:
-                # Note: HFEA doesn't have individual order IDs, so we can't wait for specific fills
-                pass
+        if amount > 0:
+            purchase = buy_amount(api, symbol, amount, sleeve="hfea", skip_order_wait=skip_order_wait)
+            if buy_canceled(purchase):
+                print(f"{symbol} order for ${amount:.2f} was {purchase['order']['status']}.")
+                trades_executed.append(f"{symbol} order {purchase['order']['status']} - nothing bought (${amount:.2f})")
+                continue
+            fills[symbol] = purchase
+            qty = fills[symbol]["qty"]
+            amount_invested += amount
             print(f"Bought {qty:.6f} shares of {symbol}.")
             shares_bought.append(f"{symbol}: {qty:.4f} shares")
             trades_executed.append(f"Bought {qty:.4f} shares of {symbol} (${amount:.2f})")
         else:
             print(f"No shares of {symbol} bought due to small amount.")
     
-    # Calculate new total invested
-    new_total_invested = total_invested + investment_amount
+    # Calculate new total invested (canceled orders invested nothing)
+    new_total_invested = total_invested + amount_invested
     
     # Update current positions (add to existing)
     new_positions = current_positions.copy()
-    for symbol, qty in [("UPRO", upro_shares_to_buy), ("TMF", tmf_shares_to_buy), ("KMLM", kmlm_shares_to_buy)]:
-        if qty > 0:
-            new_positions[symbol] = new_positions.get(symbol, 0) + qty
+    for symbol, fill in fills.items():
+        if fill["qty"] > 0:
+            new_positions[symbol] = new_positions.get(symbol, 0) + fill["qty"]
     
     # Enhanced Telegram message with detailed decision rationale
     telegram_msg = f"🎯 HFEA Strategy Decision\n\n"
     telegram_msg += f"📊 Allocation Analysis:\n"
-    telegram_msg += f"• UPRO (45%): ${upro_amount:.2f} → {upro_shares_to_buy:.4f} shares @ ${upro_price:.2f}\n"
-    telegram_msg += f"• TMF (25%): ${tmf_amount:.2f} → {tmf_shares_to_buy:.4f} shares @ ${tmf_price:.2f}\n"
-    telegram_msg += f"• KMLM (30%): ${kmlm_amount:.2f} → {kmlm_shares_to_buy:.4f} shares @ ${kmlm_price:.2f}\n\n"
+    telegram_msg += f"• UPRO (45%): ${upro_amount:.2f} → {fills['UPRO']['qty']:.4f} shares @ ${fills['UPRO']['price']:.2f}\n"
+    telegram_msg += f"• TMF (25%): ${tmf_amount:.2f} → {fills['TMF']['qty']:.4f} shares @ ${fills['TMF']['price']:.2f}\n"
+    telegram_msg += f"• KMLM (30%): ${kmlm_amount:.2f} → {fills['KMLM']['qty']:.4f} shares @ ${fills['KMLM']['price']:.2f}\n\n"
     telegram_msg += f"🎯 Strategy Logic:\n"
     telegram_msg += f"• Three-asset leveraged portfolio (UPRO/TMF/KMLM)\n"
     telegram_msg += f"• Enhanced diversification through managed futures (KMLM)\n"
@@ -1518,7 +3693,7 @@ def make_monthly_buys(api, force_execute=False, investment_calc=None, margin_res
     for trade in trades_executed:
         telegram_msg += f"  • {trade}\n"
     telegram_msg += f"\n💰 Portfolio Summary:\n"
-    telegram_msg += f"• Investment amount: ${investment_amount:.2f}\n"
+    telegram_msg += f"• Investment amount: ${amount_invested:.2f}\n"
     telegram_msg += f"• Total invested: ${new_total_invested:.2f}\n"
     telegram_msg += f"• Current positions: {len([k for k, v in new_positions.items() if v > 0])} assets"
     
@@ -1533,22 +3708,22 @@ def make_monthly_buys(api, force_execute=False, investment_calc=None, margin_res
             "upro_amount": upro_amount,
             "tmf_amount": tmf_amount,
             "kmlm_amount": kmlm_amount,
-            "upro_price": upro_price,
-            "tmf_price": tmf_price,
-            "kmlm_price": kmlm_price
+            "upro_price": fills["UPRO"]["price"],
+            "tmf_price": fills["TMF"]["price"],
+            "kmlm_price": fills["KMLM"]["price"]
         },
         "trades_executed": trades_executed
     }, env)
     
     # Create action summary for margin message
-    action_taken = f"Invested ${investment_amount:.2f} - " + ", ".join(shares_bought)
-    send_margin_summary_message(margin_result, "HFEA", action_taken, investment_calc)
+    action_taken = f"Invested ${amount_invested:.2f} - " + ", ".join(shares_bought)
+    send_margin_summary_message(margin_result, "HFEA", action_taken, investment_calc, env)
     
     return "Monthly investment executed."
 
 
 def get_hfea_allocations(api):
-    positions = {p["symbol"]: float(p["market_value"]) for p in list_positions(api)}
+    positions = {symbol: p["value"] for symbol, p in get_sleeve_positions(api, "hfea").items()}
     upro_value = positions.get("UPRO", 0)
     tmf_value = positions.get("TMF", 0)
     kmlm_value = positions.get("KMLM", 0)
@@ -1586,7 +3761,7 @@ def get_golden_hfea_lite_allocations(api):
     Get Golden HFEA Lite allocations (SSO/ZROZ/GLD at 50/25/25).
     Returns current values, percentages, target values, and deviations.
     """
-    positions = {p["symbol"]: float(p["market_value"]) for p in list_positions(api)}
+    positions = {symbol: p["value"] for symbol, p in get_sleeve_positions(api, "golden_hfea_lite").items()}
     sso_value = positions.get("SSO", 0)
     zroz_value = positions.get("ZROZ", 0)
     gld_value = positions.get("GLD", 0)
@@ -1657,27 +3832,30 @@ def rebalance_golden_hfea_lite_portfolio(api):
         send_telegram_message("No holdings to rebalance for Golden HFEA Lite Strategy.")
         return "No holdings to rebalance for Golden HFEA Lite Strategy."
 
+    # One batched quote for all legs
+    prices = get_latest_trades(api, ["SSO", "ZROZ", "GLD"])
+
     # Define trade parameters for each ETF
     rebalance_actions = []
 
     # If SSO is over-allocated, adjust ZROZ or GLD if under-allocated
     if sso_diff > 0:
         if zroz_diff < 0:
-            sso_shares_to_sell = min(sso_diff, abs(zroz_diff)) / float(get_latest_trade(api, "SSO"))
+            sso_shares_to_sell = min(sso_diff, abs(zroz_diff)) / prices["SSO"]
             zroz_shares_to_buy = (
                 sso_shares_to_sell
-                * float(get_latest_trade(api, "SSO"))
-                / float(get_latest_trade(api, "ZROZ"))
+                * prices["SSO"]
+                / prices["ZROZ"]
             ) * fee_margin
             rebalance_actions.append(("SSO", sso_shares_to_sell, "sell"))
             rebalance_actions.append(("ZROZ", zroz_shares_to_buy, "buy"))
 
         if gld_diff < 0:
-            sso_shares_to_sell = min(sso_diff, abs(gld_diff)) / float(get_latest_trade(api, "SSO"))
+            sso_shares_to_sell = min(sso_diff, abs(gld_diff)) / prices["SSO"]
             gld_shares_to_buy = (
                 sso_shares_to_sell
-                * float(get_latest_trade(api, "SSO"))
-                / float(get_latest_trade(api, "GLD"))
+                * prices["SSO"]
+                / prices["GLD"]
             ) * fee_margin
             rebalance_actions.append(("SSO", sso_shares_to_sell, "sell"))
             rebalance_actions.append(("GLD", gld_shares_to_buy, "buy"))
@@ -1685,21 +3863,21 @@ def rebalance_golden_hfea_lite_portfolio(api):
     # If ZROZ is over-allocated, adjust SSO or GLD if under-allocated
     if zroz_diff > 0:
         if sso_diff < 0:
-            zroz_shares_to_sell = min(zroz_diff, abs(sso_diff)) / float(get_latest_trade(api, "ZROZ"))
+            zroz_shares_to_sell = min(zroz_diff, abs(sso_diff)) / prices["ZROZ"]
             sso_shares_to_buy = (
                 zroz_shares_to_sell
-                * float(get_latest_trade(api, "ZROZ"))
-                / float(get_latest_trade(api, "SSO"))
+                * prices["ZROZ"]
+                / prices["SSO"]
             ) * fee_margin
             rebalance_actions.append(("ZROZ", zroz_shares_to_sell, "sell"))
             rebalance_actions.append(("SSO", sso_shares_to_buy, "buy"))
 
         if gld_diff < 0:
-            zroz_shares_to_sell = min(zroz_diff, abs(gld_diff)) / float(get_latest_trade(api, "ZROZ"))
+            zroz_shares_to_sell = min(zroz_diff, abs(gld_diff)) / prices["ZROZ"]
             gld_shares_to_buy = (
                 zroz_shares_to_sell
-                * float(get_latest_trade(api, "ZROZ"))
-                / float(get_latest_trade(api, "GLD"))
+                * prices["ZROZ"]
+                / prices["GLD"]
             ) * fee_margin
             rebalance_actions.append(("ZROZ", zroz_shares_to_sell, "sell"))
             rebalance_actions.append(("GLD", gld_shares_to_buy, "buy"))
@@ -1707,35 +3885,37 @@ def rebalance_golden_hfea_lite_portfolio(api):
     # If GLD is over-allocated, adjust SSO or ZROZ if under-allocated
     if gld_diff > 0:
         if sso_diff < 0:
-            gld_shares_to_sell = min(gld_diff, abs(sso_diff)) / float(get_latest_trade(api, "GLD"))
+            gld_shares_to_sell = min(gld_diff, abs(sso_diff)) / prices["GLD"]
             sso_shares_to_buy = (
                 gld_shares_to_sell
-                * float(get_latest_trade(api, "GLD"))
-                / float(get_latest_trade(api, "SSO"))
+                * prices["GLD"]
+                / prices["SSO"]
             ) * fee_margin
             rebalance_actions.append(("GLD", gld_shares_to_sell, "sell"))
             rebalance_actions.append(("SSO", sso_shares_to_buy, "buy"))
 
         if zroz_diff < 0:
-            gld_shares_to_sell = min(gld_diff, abs(zroz_diff)) / float(get_latest_trade(api, "GLD"))
+            gld_shares_to_sell = min(gld_diff, abs(zroz_diff)) / prices["GLD"]
             zroz_shares_to_buy = (
                 gld_shares_to_sell
-                * float(get_latest_trade(api, "GLD"))
-                / float(get_latest_trade(api, "ZROZ"))
+                * prices["GLD"]
+                / prices["ZROZ"]
             ) * fee_margin
             rebalance_actions.append(("GLD", gld_shares_to_sell, "sell"))
             rebalance_actions.append(("ZROZ", zroz_shares_to_buy, "buy"))
 
-    # Execute rebalancing actions
-    for symbol, qty, action in rebalance_actions:
-        if qty > 0:
-            order = submit_order(api, symbol, qty, action)
-            action_verb = "Bought" if action == "buy" else "Sold"
-            wait_for_order_fill(api, order["id"])
-            print(f"Golden HFEA Lite: {action_verb} {qty:.6f} shares of {symbol} to rebalance.")
-            send_telegram_message(
-                f"Golden HFEA Lite: {action_verb} {qty:.6f} shares of {symbol} to rebalance."
-            )
+    # Execute rebalancing actions: legs of the same ETF are merged into one order, sells go first
+    journal_decision(get_api_env(api), "golden_hfea_lite", f"Rebalance: {len(rebalance_actions)} legs")
+    proposals = [("golden_hfea_lite", symbol, action, qty) for symbol, qty, action in rebalance_actions if qty > 0]
+    for result in execute_order_plan(api, proposals, prices):
+        if result["error"]:
+            send_telegram_message(f"Golden HFEA Lite: Failed to {result['side']} {result['symbol']}: {result['error']}")
+            continue
+        action_verb = "Bought" if result["side"] == "buy" else "Sold"
+        print(f"Golden HFEA Lite: {action_verb} {result['qty']:.6f} shares of {result['symbol']} to rebalance.")
+        send_telegram_message(
+            f"Golden HFEA Lite: {action_verb} {result['qty']:.6f} shares of {result['symbol']} to rebalance."
+        )
 
     # Report completion of rebalancing check
     print("Golden HFEA Lite rebalance check completed.")
@@ -1772,27 +3952,30 @@ def rebalance_portfolio(api):
         send_telegram_message("No holdings to rebalance for HFEA Strategy.")
         return "No holdings to rebalance for HFEA Strategy."
 
+    # One batched quote for all legs
+    prices = get_latest_trades(api, ["UPRO", "TMF", "KMLM"])
+
     # Define trade parameters for each ETF
     rebalance_actions = []
 
     # If UPRO is over-allocated, adjust TMF or KMLM if under-allocated
     if upro_diff > 0:
         if tmf_diff < 0:
-            upro_shares_to_sell = min(upro_diff, abs(tmf_diff)) / float(get_latest_trade(api, "UPRO"))
+            upro_shares_to_sell = min(upro_diff, abs(tmf_diff)) / prices["UPRO"]
             tmf_shares_to_buy = (
                 upro_shares_to_sell
-                * float(get_latest_trade(api, "UPRO"))
-                / float(get_latest_trade(api, "TMF"))
+                * prices["UPRO"]
+                / prices["TMF"]
             ) * fee_margin
             rebalance_actions.append(("UPRO", upro_shares_to_sell, "sell"))
             rebalance_actions.append(("TMF", tmf_shares_to_buy, "buy"))
 
         if kmlm_diff < 0:
-            upro_shares_to_sell = min(upro_diff, abs(kmlm_diff)) / float(get_latest_trade(api, "UPRO"))
+            upro_shares_to_sell = min(upro_diff, abs(kmlm_diff)) / prices["UPRO"]
             kmlm_shares_to_buy = (
                 upro_shares_to_sell
-                * float(get_latest_trade(api, "UPRO"))
-                / float(get_latest_trade(api, "KMLM"))
+                * prices["UPRO"]
+                / prices["KMLM"]
             ) * fee_margin
             rebalance_actions.append(("UPRO", upro_shares_to_sell, "sell"))
             rebalance_actions.append(("KMLM", kmlm_shares_to_buy, "buy"))
@@ -1800,21 +3983,21 @@ def rebalance_portfolio(api):
     # If TMF is over-allocated, adjust UPRO or KMLM if under-allocated
     if tmf_diff > 0:
         if upro_diff < 0:
-            tmf_shares_to_sell = min(tmf_diff, abs(upro_diff)) / float(get_latest_trade(api, "TMF"))
+            tmf_shares_to_sell = min(tmf_diff, abs(upro_diff)) / prices["TMF"]
             upro_shares_to_buy = (
                 tmf_shares_to_sell
-                * float(get_latest_trade(api, "TMF"))
-                / float(get_latest_trade(api, "UPRO"))
+                * prices["TMF"]
+                / prices["UPRO"]
             ) * fee_margin
             rebalance_actions.append(("TMF", tmf_shares_to_sell, "sell"))
             rebalance_actions.append(("UPRO", upro_shares_to_buy, "buy"))
 
         if kmlm_diff < 0:
-            tmf_shares_to_sell = min(tmf_diff, abs(kmlm_diff)) / float(get_latest_trade(api, "TMF"))
+            tmf_shares_to_sell = min(tmf_diff, abs(kmlm_diff)) / prices["TMF"]
             kmlm_shares_to_buy = (
                 tmf_shares_to_sell
-                * float(get_latest_trade(api, "TMF"))
-                / float(get_latest_trade(api, "KMLM"))
+                * prices["TMF"]
+                / prices["KMLM"]
             ) * fee_margin
             rebalance_actions.append(("TMF", tmf_shares_to_sell, "sell"))
             rebalance_actions.append(("KMLM", kmlm_shares_to_buy, "buy"))
@@ -1822,35 +4005,37 @@ def rebalance_portfolio(api):
     # If KMLM is over-allocated, adjust UPRO or TMF if under-allocated
     if kmlm_diff > 0:
         if upro_diff < 0:
-            kmlm_shares_to_sell = min(kmlm_diff, abs(upro_diff)) / float(get_latest_trade(api, "KMLM"))
+            kmlm_shares_to_sell = min(kmlm_diff, abs(upro_diff)) / prices["KMLM"]
             upro_shares_to_buy = (
                 kmlm_shares_to_sell
-                * float(get_latest_trade(api, "KMLM"))
-                / float(get_latest_trade(api, "UPRO"))
+                * prices["KMLM"]
+                / prices["UPRO"]
             ) * fee_margin
             rebalance_actions.append(("KMLM", kmlm_shares_to_sell, "sell"))
             rebalance_actions.append(("UPRO", upro_shares_to_buy, "buy"))
 
         if tmf_diff < 0:
-            kmlm_shares_to_sell = min(kmlm_diff, abs(tmf_diff)) / float(get_latest_trade(api, "KMLM"))
+            kmlm_shares_to_sell = min(kmlm_diff, abs(tmf_diff)) / prices["KMLM"]
             tmf_shares_to_buy = (
                 kmlm_shares_to_sell
-                * float(get_latest_trade(api, "KMLM"))
-                / float(get_latest_trade(api, "TMF"))
+                * prices["KMLM"]
+                / prices["TMF"]
             ) * fee_margin
             rebalance_actions.append(("KMLM", kmlm_shares_to_sell, "sell"))
             rebalance_actions.append(("TMF", tmf_shares_to_buy, "buy"))
 
-    # Execute rebalancing actions
-    for symbol, qty, action in rebalance_actions:
-        if qty > 0:
-            order = submit_order(api, symbol, qty, action)
-            action_verb = "Bought" if action == "buy" else "Sold"
-            wait_for_order_fill(api, order["id"])
-            print(f"{action_verb} {qty:.6f} shares of {symbol} to rebalance.")
-            send_telegram_message(
-                f"{action_verb} {qty:.6f} shares of {symbol} to rebalance."
-            )
+    # Execute rebalancing actions: legs of the same ETF are merged into one order, sells go first
+    journal_decision(get_api_env(api), "hfea", f"Rebalance: {len(rebalance_actions)} legs")
+    proposals = [("hfea", symbol, action, qty) for symbol, qty, action in rebalance_actions if qty > 0]
+    for result in execute_order_plan(api, proposals, prices):
+        if result["error"]:
+            send_telegram_message(f"Failed to {result['side']} {result['symbol']}: {result['error']}")
+            continue
+        action_verb = "Bought" if result["side"] == "buy" else "Sold"
+        print(f"{action_verb} {result['qty']:.6f} shares of {result['symbol']} to rebalance.")
+        send_telegram_message(
+            f"{action_verb} {result['qty']:.6f} shares of {result['symbol']} to rebalance."
+        )
 
     # Report completion of rebalancing check
     print("Rebalance check completed.")
@@ -1868,17 +4053,19 @@ def execute_quarterly_nine_sig_signal(api, force_execute=False):
         send_telegram_message("9-Sig: Force execution enabled for testing - bypassing trading day check")
     
     try:
-        # Step 1: Get current positions
-        positions = {p["symbol"]: float(p["market_value"]) for p in list_positions(api)}
+        # Step 1: Get current positions, valued with one batched price snapshot
+        prices = get_latest_trades(api, ["TQQQ", "AGG"])
+        positions = {symbol: p["value"] for symbol, p in get_sleeve_positions(api, "nine_sig", prices).items()}
         current_tqqq_balance = positions.get("TQQQ", 0)
         current_agg_balance = positions.get("AGG", 0)
         total_portfolio = current_tqqq_balance + current_agg_balance
         
-        # Step 1: Determine the Quarter's Signal Line
-        previous_tqqq_balance = get_previous_quarter_tqqq_balance()
+        # Step 1: Determine the Quarter's Signal Line (one read of the 9-Sig aggregate)
+        nine_sig_state = load_nine_sig_state()
+        previous_tqqq_balance = nine_sig_state.get("previous_tqqq_balance", 0)
         
         # Get actual contributions made during this quarter (dynamic amounts)
-        quarterly_contributions = get_quarterly_nine_sig_contributions()
+        quarterly_contributions = get_quarterly_nine_sig_contributions(nine_sig_state)
         half_quarterly_contributions = quarterly_contributions * 0.5
         
         # Signal Line = Previous TQQQ Balance × 1.09 + (Half of Quarterly Contributions)
@@ -1892,6 +4079,7 @@ def execute_quarterly_nine_sig_signal(api, force_execute=False):
         # Step 2: Determine Action (Buy, Sell, or Hold)
         difference = current_tqqq_balance - signal_line
         tolerance = nine_sig_config["tolerance_amount"]
+        traded_to_tqqq = 0  # Net dollars moved from AGG to TQQQ, for the final allocation report
         
         # Step 3: Execute the Trade
         if abs(difference) < tolerance:
@@ -1914,20 +4102,22 @@ def execute_quarterly_nine_sig_signal(api, force_execute=False):
             
             if current_agg_balance >= amount_to_buy:
                 # Execute buy trade
-                tqqq_price = float(get_latest_trade(api, "TQQQ"))
-                agg_price = float(get_latest_trade(api, "AGG"))
+                tqqq_price = prices["TQQQ"]
+                agg_price = prices["AGG"]
                 
                 agg_shares_to_sell = amount_to_buy / agg_price
-                tqqq_shares_to_buy = amount_to_buy / tqqq_price
                 
                 # Sell AGG first, then buy TQQQ
-                sell_order = submit_order(api, "AGG", agg_shares_to_sell, "sell")
+                sell_order = submit_order(api, "AGG", agg_shares_to_sell, "sell", sleeve="nine_sig")
                 wait_for_order_fill(api, sell_order["id"])
                 
-                buy_order = submit_order(api, "TQQQ", tqqq_shares_to_buy, "buy")
-                wait_for_order_fill(api, buy_order["id"])
-                
-                send_telegram_message(f"9-Sig: BUY signal executed - Bought ${amount_to_buy:.2f} TQQQ (sold AGG)")
+                purchase = buy_amount(api, "TQQQ", amount_to_buy, sleeve="nine_sig")
+                if buy_canceled(purchase):
+                    send_telegram_message(f"9-Sig: BUY signal - TQQQ order for ${amount_to_buy:.2f} was {purchase['order']['status']}, AGG proceeds left in cash")
+                    action = "BUY_CANCELED"
+                else:
+                    traded_to_tqqq = purchase["qty"] * purchase["price"] if purchase["filled"] else amount_to_buy
+                    send_telegram_message(f"9-Sig: BUY signal executed - Bought ${amount_to_buy:.2f} TQQQ (sold AGG)")
             else:
                 # Insufficient AGG funds
                 send_telegram_message(f"9-Sig: BUY signal but insufficient AGG (${current_agg_balance:.2f} < ${amount_to_buy:.2f}) - HOLDING existing positions")
@@ -1940,7 +4130,7 @@ def execute_quarterly_nine_sig_signal(api, force_execute=False):
             
             # Step 5: Check for "30 Down, Stick Around" rule
             if check_spy_30_down_rule():
-                ignored_count = count_ignored_sell_signals()
+                ignored_count = nine_sig_state.get("ignored_sell_signals", 0)
                 
                 if ignored_count < 4:
                     action = "SELL_IGNORED"
@@ -1950,20 +4140,22 @@ def execute_quarterly_nine_sig_signal(api, force_execute=False):
             
             if action == "SELL":
                 # Execute sell trade
-                tqqq_price = float(get_latest_trade(api, "TQQQ"))
-                agg_price = float(get_latest_trade(api, "AGG"))
+                tqqq_price = prices["TQQQ"]
+                agg_price = prices["AGG"]
                 
                 tqqq_shares_to_sell = amount_to_sell / tqqq_price
-                agg_shares_to_buy = amount_to_sell / agg_price
-                
-                # Sell TQQQ first, then buy AGG
-                sell_order = submit_order(api, "TQQQ", tqqq_shares_to_sell, "sell")
-                wait_for_order_fill(api, sell_order["id"])
                 
-                buy_order = submit_order(api, "AGG", agg_shares_to_buy, "buy")
-                wait_for_order_fill(api, buy_order["id"])
+                # Sell TQQQ first, then buy AGG with the proceeds
+                sell_order = submit_order(api, "TQQQ", tqqq_shares_to_sell, "sell", sleeve="nine_sig")
+                traded_to_tqqq = -(wait_for_order_fill(api, sell_order["id"]) or amount_to_sell)
                 
-                send_telegram_message(f"9-Sig: SELL signal executed - Sold ${amount_to_sell:.2f} TQQQ (bought AGG)")
+                purchase = buy_amount(api, "AGG", -traded_to_tqqq, sleeve="nine_sig")
+                if buy_canceled(purchase):
+                    send_telegram_message(f"9-Sig: SELL signal - Sold ${amount_to_sell:.2f} TQQQ but the AGG order was {purchase['order']['status']}, proceeds left in cash")
+                else:
+                    send_telegram_message(f"9-Sig: SELL signal executed - Sold ${amount_to_sell:.2f} TQQQ (bought AGG)")
+        
+        journal_decision(get_api_env(api), "nine_sig", f"Quarterly signal: {action}", "TQQQ", signal_line)
         
         # Save quarterly data for next calculation
         current_quarter = f"{datetime.datetime.now().year}-Q{((datetime.datetime.now().month-1)//3+1)}"
@@ -1973,15 +4165,14 @@ def execute_quarterly_nine_sig_signal(api, force_execute=False):
             current_agg_balance, 
             signal_line,
             action,
-            quarterly_contributions
+            quarterly_contributions,
+            nine_sig_state
         )
         
-        # Report final allocations
-        updated_positions = {p["symbol"]: float(p["market_value"]) for p in list_positions(api)}
-        updated_total = updated_positions.get("TQQQ", 0) + updated_positions.get("AGG", 0)
-        if updated_total > 0:
-            tqqq_pct = updated_positions.get("TQQQ", 0) / updated_total
-            agg_pct = updated_positions.get("AGG", 0) / updated_total
+        # Report final allocations (pre-trade balances plus the filled trade amounts)
+        if total_portfolio > 0:
+            tqqq_pct = (current_tqqq_balance + traded_to_tqqq) / total_portfolio
+            agg_pct = 1 - tqqq_pct
             send_telegram_message(f"9-Sig allocation: TQQQ {tqqq_pct:.1%}, AGG {agg_pct:.1%} (Target: 80/20)")
         
         return f"9-Sig quarterly signal: {action}"
@@ -1997,14 +4188,15 @@ def execute_quarterly_nine_sig_signal(api, force_execute=False):
 def update_market_data(symbol):
     """
     Fetch fresh market data from Alpaca and calculate ALL metrics in one operation.
-    ALWAYS calculates and saves: price, sma200, sma255, sma200_state, sma255_state.
+    ALWAYS calculates and saves: price, sma200, sma255, sma200_state, sma255_state, and
+    advances the 200/255-day entries of the SMA state store (see advance_sma_state).
     This ensures complete consistency across all symbols and makes the system extensible.
     
     Args:
         symbol: Stock symbol (e.g., "SPY", "URTH")
     
     Returns:
-        dict with keys: price, sma200, sma255, sma200_state, sma255_state, timestamp
+        dict with keys: price, sma200, sma255, sma200_state, sma255_state, sma_states, timestamp
     """
     print(f"Fetching fresh market data for {symbol} from Alpaca IEX feed")
     
@@ -2025,27 +4217,22 @@ def update_market_data(symbol):
     sma_200 = df['close'].rolling(window=200).mean().iloc[-1]
     sma_255 = df['close'].rolling(window=255).mean().iloc[-1]
     
-    # Calculate states for both SMA periods
-    # Using 1% noise threshold (matches default in alert system)
-    noise_threshold_pct = 1.0  # 1% threshold to avoid noise (as percentage)
+    # Save everything to Firestore at once
+    doc_id = symbol.replace("^", "").replace(".", "_")
+    doc_ref = get_firestore_client().collection("market-data").document(doc_id)
     
-    # 200-day state
-    diff_200_pct = ((current_price - sma_200) / sma_200) * 100
-    if diff_200_pct > noise_threshold_pct:
-        sma200_state = "above"
-    elif diff_200_pct < -noise_threshold_pct:
-        sma200_state = "below"
-    else:
-        sma200_state = "neutral"
-    
-    # 255-day state
-    diff_255_pct = ((current_price - sma_255) / sma_255) * 100
-    if diff_255_pct > noise_threshold_pct:
-        sma255_state = "above"
-    elif diff_255_pct < -noise_threshold_pct:
-        sma255_state = "below"
-    else:
-        sma255_state = "neutral"
+    # Get existing data (to preserve alert tracking fields and the SMA state store)
+    doc = doc_ref.get()
+    existing_data = doc.to_dict() if doc.exists else {}
+    
+    # Advance both SMA state machines with the 1% noise band (matches default in alert system)
+    now = datetime.datetime.utcnow()
+    sma_states = dict(existing_data.get("sma_states") or {})
+    for period, sma_value in ((200, sma_200), (255, sma_255)):
+        entry = _stored_sma_entry(sma_states, existing_data, period)
+        sma_states[sma_state_key(period, 1.0)] = advance_sma_state(entry, current_price, sma_value, 1.0, now)
+    sma200_state = sma_states[sma_state_key(200, 1.0)]["state"]
+    sma255_state = sma_states[sma_state_key(255, 1.0)]["state"]
     
     # Prepare complete market data
     market_data = {
@@ -2055,24 +4242,18 @@ def update_market_data(symbol):
         "sma255": float(sma_255),
         "sma200_state": sma200_state,
         "sma255_state": sma255_state,
-        "timestamp": datetime.datetime.utcnow()
+        "sma_states": sma_states,
+        "timestamp": now
     }
     
-    # Save everything to Firestore at once
-    doc_id = symbol.replace("^", "").replace(".", "_")
-    doc_ref = get_firestore_client().collection("market-data").document(doc_id)
-    
-    # Get existing data (to preserve alert tracking fields)
-    doc = doc_ref.get()
-    if doc.exists:
-        existing_data = doc.to_dict()
-        # Preserve alert date fields if they exist
-        for field in ['sma200_last_hour_alert_date', 'sma255_last_hour_alert_date']:
-            if field in existing_data:
-                market_data[field] = existing_data[field]
+    # Preserve alert date fields and signal positions if they exist
+    for field in ['sma200_last_hour_alert_date', 'sma255_last_hour_alert_date', 'signal_positions']:
+        if field in existing_data:
+            market_data[field] = existing_data[field]
     
     # Write complete data
     doc_ref.set(market_data)
+    _market_data_docs[symbol] = market_data
     
     print(f"Updated {symbol}: Price=${market_data['price']:.2f}, SMA200=${market_data['sma200']:.2f} ({sma200_state}), SMA255=${market_data['sma255']:.2f} ({sma255_state})")
     
@@ -2126,7 +4307,7 @@ def check_trading_day(mode="daily"):
     raise ValueError("Invalid mode. Use 'daily', 'monthly', or 'quarterly'.")
 
 
-def monthly_buying_sma(api, symbol, force_execute=False, investment_calc=None, margin_result=None, skip_order_wait=False, env="live"):
+def monthly_buying_sma(api, symbol, force_execute=False, investment_calc=None, margin_result=None, skip_order_wait=False, env="live", risk_decision=None):
     """
     Monthly SMA-based investment with margin-aware logic and dynamic investment amounts.
     Uses All-or-Nothing approach: invest full amount or skip entirely.
@@ -2138,6 +4319,7 @@ def monthly_buying_sma(api, symbol, force_execute=False, investment_calc=None, m
         force_execute: Bypass trading day check for testing
         investment_calc: Pre-calculated investment amounts (from orchestrator) - optional
         margin_result: Pre-calculated margin conditions (from orchestrator) - optional
+        risk_decision: Pre-evaluated risk gate decision (from orchestrator) - optional
     """
     if not force_execute and not check_trading_day(mode="monthly"):
         return "Not first trading day of the month"
@@ -2148,13 +4330,10 @@ def monthly_buying_sma(api, symbol, force_execute=False, investment_calc=None, m
 
     # Get symbol-specific parameters (use SPY as S&P 500 proxy for SPXL decisions)
     if symbol == "SPXL":
-        # Get all SPY market data at once (efficient single fetch/read)
-        spy_data = get_all_market_data("SPY")
-        if spy_data is None:
-            spy_data = update_market_data("SPY")
-        
-        sma_200 = spy_data["sma200"]
-        latest_price = spy_data["price"]
+        # SPY 200-SMA state with the 1% margin band (SMA state store)
+        spy_state = get_sma_state("SPY", 200, margin * 100)
+        sma_200 = spy_state["sma"]
+        latest_price = spy_state["price"]
     else:
         return f"Unknown symbol: {symbol}"
 
@@ -2167,16 +4346,10 @@ def monthly_buying_sma(api, symbol, force_execute=False, investment_calc=None, m
     
     investment_amount = investment_calc["strategy_amounts"]["spxl_allo"]
     
-    target_margin = margin_result["target_margin"]
-    metrics = margin_result["metrics"]
-    leverage = metrics.get("leverage", 1.0)
-    
-    # Determine available buying power (already calculated in investment_calc)
-    buying_power = investment_calc["total_available"] + investment_calc["margin_approved"]
+    leverage = margin_result["metrics"].get("leverage", 1.0)
 
     # Load current strategy state from Firestore
-    balances = load_balances(env)
-    spxl_data = balances.get(f"{symbol}_SMA", {})
+    spxl_data = get_balance(f"{symbol}_SMA", env)
     total_invested = spxl_data.get("total_invested", 0)
     current_shares = spxl_data.get("current_shares", 0)
     
@@ -2184,68 +4357,30 @@ def monthly_buying_sma(api, symbol, force_execute=False, investment_calc=None, m
     print(f"Current shares: {current_shares:.4f}, Total invested: ${total_invested:.2f}")
     
     # Check SMA trend
-    if latest_price > sma_200 * (1 + margin):
+    if spy_state["state"] == "above":
         # Bullish trend - attempt to buy
         
-        # Check if we should skip investment
-        if target_margin == 0:
-            # Cash-only mode triggered
-            if leverage > 1.0:
-                # Still leveraged - must skip to deleverage
-                action_taken = f"Skipped - Deleveraging required (leverage: {leverage:.2f}x)"
-                send_margin_summary_message(margin_result, f"{symbol} SMA", action_taken, investment_calc)
-                print(action_taken)
-                return action_taken
-            # Equity-only but gates failed - skip without Firestore addition
-            action_taken = f"Skipped - Margin gates failed (cash-only mode, buying power: ${buying_power:.2f})"
-            send_margin_summary_message(margin_result, f"{symbol} SMA", action_taken, investment_calc)
-            print(action_taken)
-            return action_taken
-        
-        # Check if we have sufficient buying power for full investment (All-or-Nothing)
-        if buying_power < investment_amount:
-            action_taken = f"Skipped - Insufficient buying power (${buying_power:.2f} < ${investment_amount:.2f})"
-            send_margin_summary_message(margin_result, f"{symbol} SMA", action_taken, investment_calc)
-            print(action_taken)
-            return action_taken
-        
-        # Check minimum investment amount (Alpaca requirement)
-        if investment_amount < margin_control_config["min_investment"]:
-            action_taken = f"Skipped - Investment amount ${investment_amount:.2f} below Alpaca minimum ($1.00)"
-            send_margin_summary_message(margin_result, f"{symbol} SMA", action_taken, investment_calc)
+        # Pre-trade risk gates (evaluated jointly by the orchestrator, or for this strategy alone)
+        if risk_decision is None:
+            risk_decision = evaluate_risk_gates([("SPXL_SMA", investment_amount)], margin_result, investment_calc)["SPXL_SMA"]
+        if not risk_decision["accepted"]:
+            action_taken = risk_decision["reason"]
+            send_margin_summary_message(margin_result, f"{symbol} SMA", action_taken, investment_calc, env)
             print(action_taken)
             return action_taken
         
-        # Check projected leverage after investment to ensure we don't exceed 1.14x
-        if target_margin > 0:  # Only check if margin is enabled
-            portfolio_value = metrics.get("portfolio_value", 0)
-            current_equity = metrics.get("equity", 0)
-            
-            if portfolio_value > 0 and current_equity > 0:
-                projected_portfolio_value = portfolio_value + investment_amount
-                projected_equity = current_equity
-                
-                if projected_equity > 0:
-                    projected_leverage = projected_portfolio_value / projected_equity
-                    
-                    if projected_leverage >= margin_control_config["max_leverage"]:
-                        action_taken = f"Skipped - Projected leverage ({projected_leverage:.3f}x) would exceed limit ({margin_control_config['max_leverage']:.2f}x)"
-                        send_margin_summary_message(margin_result, f"{symbol} SMA", action_taken, investment_calc)
-                        print(f"Current leverage: {leverage:.3f}x, Projected leverage: {projected_leverage:.3f}x")
-                        print(action_taken)
-                        return action_taken
-                    else:
-                        print(f"Leverage check: Current {leverage:.3f}x → Projected {projected_leverage:.3f}x (limit: {margin_control_config['max_leverage']:.2f}x)")
-        
         # Execute purchase
-        price = get_latest_trade(api, symbol)
-        print(f"Executing buy: price={price}")
-        shares_to_buy = investment_amount / price
-
-        if shares_to_buy > 0:
-            order = submit_order(api, symbol, shares_to_buy, "buy")
-            if not skip_order_wait:
-                wait_for_order_fill(api, order["id"])
+        print(f"Executing buy: amount=${investment_amount:.2f}")
+
+        if investment_amount > 0:
+            purchase = buy_amount(api, symbol, investment_amount, sleeve=f"{symbol}_SMA", skip_order_wait=skip_order_wait)
+            if buy_canceled(purchase):
+                action_taken = f"{symbol} order for ${investment_amount:.2f} was {purchase['order']['status']} - nothing bought"
+                print(action_taken)
+                send_margin_summary_message(margin_result, f"{symbol} SMA", action_taken, investment_calc, env)
+                return action_taken
+            price = purchase["price"]
+            shares_to_buy = purchase["qty"]
             
             # Calculate new totals
             new_total_shares = current_shares + shares_to_buy
@@ -2292,59 +4427,145 @@ def monthly_buying_sma(api, symbol, force_execute=False, investment_calc=None, m
             }, env)
             
             action_taken = f"Bought {shares_to_buy:.4f} shares of {symbol} (${investment_amount:.2f})"
-            send_margin_summary_message(margin_result, f"{symbol} SMA", action_taken, investment_calc)
+            send_margin_summary_message(margin_result, f"{symbol} SMA", action_taken, investment_calc, env)
             return f"Bought {shares_to_buy:.6f} shares of {symbol}."
         else:
             action_taken = f"Amount too small to buy {symbol} shares"
-            send_margin_summary_message(margin_result, f"{symbol} SMA", action_taken, investment_calc)
+            send_margin_summary_message(margin_result, f"{symbol} SMA", action_taken, investment_calc, env)
             return f"Amount too small to buy {symbol} shares."
     else:
         # Bearish trend (below SMA) - skip buying
         # Only add to Firestore if account is equity-only (leverage <= 1.0)
         if leverage <= 1.0:
             # Equity-only account - can add skipped amount to Firestore
-            invested_amount = load_balances().get(f"{symbol}_SMA", {}).get("invested", 0)
+            invested_amount = get_balance(f"{symbol}_SMA", fields=["invested"]).get("invested", 0)
             if invested_amount is None:
                 invested_amount = 0
             updated_balance = investment_amount + invested_amount
             save_balance(symbol + "_SMA", {"invested": updated_balance})
             
             action_taken = f"Skipped (SMA bearish) - Added ${investment_amount:.2f} to Firestore. Total reserved: ${updated_balance:.2f}"
-            send_margin_summary_message(margin_result, f"{symbol} SMA", action_taken, investment_calc)
+            send_margin_summary_message(margin_result, f"{symbol} SMA", action_taken, investment_calc, env)
             return f"Index is significantly below 200-SMA and no monthly invest was done into {symbol} but ${updated_balance:.2f} of the cash is allocated to this strategy"
         else:
             # Still leveraged - skip without Firestore addition (deleveraging priority)
             action_taken = "Skipped (SMA bearish + leveraged) - No Firestore addition during deleverage"
-            send_margin_summary_message(margin_result, f"{symbol} SMA", action_taken, investment_calc)
+            send_margin_summary_message(margin_result, f"{symbol} SMA", action_taken, investment_calc, env)
             return f"Index is significantly below 200-SMA. Skipping {symbol} investment (account leveraged: {leverage:.2f}x)"
 
 
-def daily_trade_sma(api, symbol):
+def save_signal_position(index_symbol, symbol, state, holding, can_buy=None):
+    """
+    Record the trend state and position last acted on for a signal-traded symbol.
+    Stored in the index's market-data document (signal_positions) so the daily fast path
+    needs no other read.
+    
+    Args:
+        index_symbol: Signal index (e.g., "SPY")
+        symbol: Traded symbol (e.g., "SPXL")
+        state: SMA state acted on ("above", "below" or "neutral")
+        holding: Whether a position is held after acting
+        can_buy: Whether the cash covered a re-entry (only recorded when not holding)
+    """
+    signal = {"state": state, "holding": holding, "reconciled": datetime.date.today().isoformat()}
+    if can_buy is not None:
+        signal["can_buy"] = can_buy
+    try:
+        doc_id = index_symbol.replace("^", "").replace(".", "_")
+        get_firestore_client().collection("market-data").document(doc_id).set(
+            {"signal_positions": {symbol: signal}}, merge=True
+        )
+        cached = _market_data_docs.get(index_symbol)
+        if cached is not None:
+            cached.setdefault("signal_positions", {})[symbol] = signal
+    except Exception as e:
+        print(f"Warning: Could not save signal position for {symbol}: {e}")
+
+
+def _sma_state_session(entry, data):
+    """New York session date ("YYYY-MM-DD") a stored SMA state was last observed in, or None."""
+    observed = entry.get("updated") or data.get("timestamp")
+    if not observed:
+        return None
+    return _trade_session(observed if isinstance(observed, str) else pd.Timestamp(observed))[1]
+
+
+def daily_trade_sma(api, symbol, fast_path=None):
+    """
+    Daily trend trade: sell everything below the index 200-SMA band, re-enter above it.
+    
+    On the fast path the decision comes from the SMA state store and the signal position
+    cached with it (see save_signal_position). The stored state is used whenever it was
+    observed in the current session; market data is only refreshed when it is missing or
+    older. If the state has not changed and calls for no action given the last known
+    position, it returns after one market-data read: no bars or quotes, no positions
+    listing, no balance reads or writes, no message. Above the band
+    without a position is only actionable if the cash covered the re-entry on the last
+    full run. The full path runs on state transitions, actionable states and at least
+    every reconcile_days days.
+    
+    Args:
+        api: Alpaca API credentials
+        symbol: Traded symbol ("SPXL", traded on SPY's 200-SMA)
+        fast_path: Allow the fast path (defaults to daily_sma_config["fast_path"])
+    
+    Returns:
+        str: Outcome message
+    """
     if not check_trading_day(mode="daily"):
         send_telegram_message(f"Market closed today. Skipping 200SMA. for {symbol}")
         return "Market closed today."
 
     # Use SPY as S&P 500 proxy for SPXL trading decisions
-    if symbol == "SPXL":
-        # Get all SPY market data at once (efficient single fetch/read)
-        spy_data = get_all_market_data("SPY")
-        if spy_data is None:
-            spy_data = update_market_data("SPY")
-        
-        sma_200 = spy_data["sma200"]
-        latest_price = spy_data["price"]
-    else:
+    if symbol != "SPXL":
         return f"Unknown symbol: {symbol}"
+    
+    # SPY 200-SMA state with the 1% margin band (SMA state store). A state observed in the
+    # current session (by the alerts, the monitor or an earlier refresh) is used as is.
+    spy_data = get_all_market_data("SPY", allow_stale=True)
+    spy_state = sma_state_from_market_data(spy_data, 200, margin * 100) if spy_data else None
+    if spy_state is None or _sma_state_session(spy_state, spy_data) != _trade_session(None)[1]:
+        spy_data = update_market_data("SPY")
+        spy_state = sma_state_from_market_data(spy_data, 200, margin * 100)
+    signal = (spy_data.get("signal_positions") or {}).get(symbol)
+    
+    if fast_path is None:
+        fast_path = daily_sma_config["fast_path"]
+    if fast_path and signal and signal["state"] == spy_state["state"]:
+        actionable = (spy_state["state"] == "below" and signal["holding"]) or (
+            spy_state["state"] == "above" and not signal["holding"] and signal.get("can_buy", True)
+        )
+        age_days = (datetime.date.today() - datetime.date.fromisoformat(signal["reconciled"])).days
+        if not actionable and age_days < daily_sma_config["reconcile_days"]:
+            message = f"Index is still {spy_state['state']} 200-SMA with {symbol} {'held' if signal['holding'] else 'not held'}. No action needed."
+            print(message)
+            return message
+    
+    result = _trade_sma_on_state(api, symbol, spy_state, notify=signal is None or signal["state"] != spy_state["state"])
+    holding = bool(get_positions_snapshot(api).get(symbol))
+    can_buy = None
+    if spy_state["state"] == "above" and not holding:
+        # Cache whether a re-entry is affordable so a cash-starved sleeve stays on the fast path
+        invested_amount = get_balance(f"{symbol}_SMA", fields=["invested"]).get("invested") or 0
+        can_buy = get_account_cash(api) > invested_amount
+    save_signal_position("SPY", symbol, spy_state["state"], holding, can_buy=can_buy)
+    return result
 
-    if latest_price < sma_200 * (1 - margin):
-        positions = list_positions(api)
-        position = next((p for p in positions if p["symbol"] == symbol), None)
+
+def _trade_sma_on_state(api, symbol, spy_state, notify=True):
+    """Full daily SMA trade for one state (see daily_trade_sma). notify=False skips the no-action messages."""
+    sma_200 = spy_state["sma"]
+    latest_price = spy_state["price"]
+
+    if spy_state["state"] == "below":
+        position = get_positions_snapshot(api).get(symbol)
 
         if position:
             shares_to_sell = float(position["qty"])
             invested = float(position["market_value"])
+            journal_decision(get_api_env(api), f"{symbol}_SMA", "Sell all: index below 200-SMA", symbol, amount=invested)
             # Sell all SPXL shares
-            sell_order = submit_order(api, symbol, shares_to_sell, "sell")
+            sell_order = submit_order(api, symbol, shares_to_sell, "sell", sleeve=f"{symbol}_SMA")
             send_telegram_message(
                 f"Sold all {shares_to_sell:.6f} shares of {symbol} because Index is significantly below 200-SMA."
             )
@@ -2352,7 +4573,7 @@ def daily_trade_sma(api, symbol):
             wait_for_order_fill(api, sell_order["id"])
             
             # Update Firestore with comprehensive tracking (preserve rich structure)
-            existing_data = load_balances().get(f"{symbol}_SMA", {})
+            existing_data = get_balance(f"{symbol}_SMA")
             save_balance(symbol + "_SMA", {
                 "total_invested": invested,
                 "current_shares": 0,  # Sold all shares
@@ -2371,23 +4592,26 @@ def daily_trade_sma(api, symbol):
                 }
             })
         else:
-            send_telegram_message(
-                f"Index is significantly below 200-SMA and no {symbol} position to sell."
-            )
+            if notify:
+                send_telegram_message(
+                    f"Index is significantly below 200-SMA and no {symbol} position to sell."
+                )
             return f"Index is significantly below 200-SMA and no {symbol} position to sell."
-    elif latest_price > sma_200 * (1 + margin):
+    elif spy_state["state"] == "above":
         # adjustment to read balance needed here
         available_cash = get_account_cash(api)
-        invested_amount = load_balances().get(f"{symbol}_SMA", {}).get("invested", None)
-        positions = list_positions(api)
-        position = next((p for p in positions if p["symbol"] == symbol), None)
+        invested_amount = get_balance(f"{symbol}_SMA", fields=["invested"]).get("invested", None)
+        position = get_positions_snapshot(api).get(symbol)
         if not position and available_cash > invested_amount:
-            price = get_latest_trade(api, symbol)
-            shares_to_buy = invested_amount / price
-            buy_order = submit_order(api, symbol, shares_to_buy, "buy")
-            wait_for_order_fill(api, buy_order["id"])
-            positions = list_positions(api)
-            position = next((p for p in positions if p["symbol"] == symbol), None)
+            journal_decision(get_api_env(api), f"{symbol}_SMA", "Re-enter: index above 200-SMA", symbol, invested_amount)
+            purchase = buy_amount(api, symbol, invested_amount, sleeve=f"{symbol}_SMA")
+            if buy_canceled(purchase):
+                message = f"Index is above 200-SMA but the {symbol} order was {purchase['order']['status']}. No shares bought."
+                send_telegram_message(message)
+                return message
+            price = purchase["price"]
+            shares_to_buy = purchase["qty"]
+            position = get_positions_snapshot(api).get(symbol)
             invested = float(position["market_value"])
             current_shares = float(position["qty"]) if position else 0
             
@@ -2420,7 +4644,7 @@ def daily_trade_sma(api, symbol):
             current_shares = float(position["qty"]) if position else 0
             
             # Load existing data to preserve other fields
-            existing_data = load_balances().get(f"{symbol}_SMA", {})
+            existing_data = get_balance(f"{symbol}_SMA")
             save_balance(symbol + "_SMA", {
                 "total_invested": invested,
                 "current_shares": current_shares,
@@ -2435,14 +4659,13 @@ def daily_trade_sma(api, symbol):
             })
             return f"Index is above 200-SMA. No {symbol} shares bought because of no cash but {invested} is already invested"
     else:
-        positions = list_positions(api)
-        position = next((p for p in positions if p["symbol"] == symbol), None)
+        position = get_positions_snapshot(api).get(symbol)
         if position:
             invested = float(position["market_value"])
             current_shares = float(position["qty"])
             
             # Load existing data to preserve other fields
-            existing_data = load_balances().get(f"{symbol}_SMA", {})
+            existing_data = get_balance(f"{symbol}_SMA")
             save_balance(symbol + "_SMA", {
                 "total_invested": invested,
                 "current_shares": current_shares,
@@ -2455,9 +4678,10 @@ def daily_trade_sma(api, symbol):
                     "margin_band": margin
                 }
             })
-        send_telegram_message(
-            f"Index is not significantly below or above 200-SMA. No {symbol} shares sold or bought"
-        )
+        if notify:
+            send_telegram_message(
+                f"Index is not significantly below or above 200-SMA. No {symbol} shares sold or bought"
+            )
         return f"Index is not significantly below or above 200-SMA. No {symbol} shares sold or bought"
 
 # Function to send a message via Telegram
@@ -2465,20 +4689,26 @@ def send_telegram_message(message):
     telegram_key, chat_id = get_telegram_secrets()
     url = f"https://api.telegram.org/bot{telegram_key}/sendMessage"
     data = {"chat_id": chat_id, "text": message}
-    response = requests.post(url, data=data)
+    response = http_request("POST", url, data=data)
     return response.status_code
 
 
-def send_margin_summary_message(margin_result, strategy_name, action_taken, investment_calc=None):
+def send_margin_summary_message(margin_result, strategy_name, action_taken, investment_calc=None, env="live"):
     """
-    Send consolidated monthly margin summary to Telegram.
+    Send consolidated monthly margin summary to Telegram and journal the decision.
     
     Args:
         margin_result: Dict from check_margin_conditions() with gate results and metrics
         strategy_name: Name of the strategy (e.g., "HFEA", "SPXL SMA", "9-Sig")
         action_taken: Description of action taken (e.g., "Bought X shares", "Skipped - insufficient funds")
         investment_calc: Optional dict from calculate_monthly_investments() with investment breakdown
+        env: Environment ("live" or "paper") - selects the journal
     """
+    sleeve = {"HFEA": "hfea", "Golden HFEA Lite": "golden_hfea_lite", "9-Sig": "nine_sig"}.get(
+        strategy_name, strategy_name.replace(" ", "_")
+    )
+    journal_decision(env, sleeve, action_taken)
+    
     metrics = margin_result.get("metrics", {})
     gate_results = margin_result.get("gate_results", {})
     errors = margin_result.get("errors", [])
@@ -2570,7 +4800,7 @@ def send_margin_summary_message(margin_result, strategy_name, action_taken, inve
 def get_chat_title():
     telegram_key, chat_id = get_telegram_secrets()
     url = f"https://api.telegram.org/bot{telegram_key}/getChat?chat_id={chat_id}"
-    response = requests.get(url)
+    response = http_request("GET", url)
     chat_info = response.json()
 
     if chat_info["ok"]:
@@ -2579,10 +4809,165 @@ def get_chat_title():
         return None
 
 
+INDEX_HIGHS_SEED_DAYS = 1825  # 5 years (maximum available with Basic plan)
+INDEX_HIGHS_SPLIT_TOLERANCE = 0.25  # Refetched close of the last stored bar off by more than this = split, reseed
+_index_highs = {}  # symbol -> running-high state, loaded once per run (see reset_run_caches)
+
+
+def _push_index_bar(state, date, high, close):
+    """
+    Fold one daily bar into a running-high state.
+    
+    peak_dates/peak_highs hold the suffix maxima: every bar whose high is not exceeded
+    by any later bar, oldest first with strictly decreasing highs. The first entry is
+    the all-time high; the first entry on or after a date is the peak since that date.
+    A bar for the last stored date (today's partial bar) replaces it.
+    """
+    dates, highs = state["peak_dates"], state["peak_highs"]
+    if state["last_bar_date"] and date < state["last_bar_date"]:
+        return
+    if dates and dates[-1] == date:
+        high = max(high, highs[-1])
+        dates.pop()
+        highs.pop()
+    while highs and highs[-1] <= high:
+        dates.pop()
+        highs.pop()
+    dates.append(date)
+    highs.append(float(high))
+    state["last_bar_date"] = date
+    state["last_close"] = float(close)
+    state["ath"] = highs[0]
+    state["ath_date"] = dates[0]
+
+
+def update_index_highs(symbols, api=None):
+    """
+    Bring the running-high index up to date for several symbols.
+    
+    States are read from Firestore (index-highs/{symbol}) once per run. A symbol seen
+    for the first time is seeded from 5 years of bars; afterwards only bars since the
+    last stored bar date are fetched, so a daily check is a single-bar fetch. All
+    symbols share one batched bars request per group (seeds vs. incremental).
+    
+    Bars are split-adjusted, so after a split the refetched last stored bar no longer
+    matches the stored close; such a symbol is reseeded from 5 years of bars (the
+    stored highs are in pre-split units). Otherwise the all-time high is kept even when
+    it is older than the seed window.
+    
+    Args:
+        symbols: List of stock symbols
+        api: Alpaca API credentials (defaults to the configured environment)
+    
+    Returns:
+        dict: symbol -> {"ath", "ath_date", "last_close", "last_bar_date", "peak_dates", "peak_highs"}
+              (symbols without any data are omitted)
+    """
+    symbols = list(dict.fromkeys(s.upper() for s in symbols))
+    pending = [s for s in symbols if s not in _index_highs]
+    trace_cache("index_highs", hits=len(symbols) - len(pending), misses=len(pending))
+    refs = {}
+    
+    if pending:
+        try:
+            db = get_firestore_client()
+            refs = {s: db.collection("index-highs").document(s.replace("^", "").replace(".", "_")) for s in pending}
+            doc_ids = {ref.id: s for s, ref in refs.items()}
+            for snapshot in db.get_all(list(refs.values())):
+                if snapshot.exists:
+                    _index_highs[doc_ids[snapshot.id]] = snapshot.to_dict()
+        except Exception as e:
+            print(f"Warning: Could not load index highs from Firestore (local testing?): {e}")
+        
+        today = market_data_today().date()
+        for s in pending:
+            # A state stored by a run with a later as-of date holds highs from after today: reseed
+            if s in _index_highs and _index_highs[s]["last_bar_date"] > today.isoformat():
+                _index_highs.pop(s)
+        seeds = [s for s in pending if s not in _index_highs]
+        stale = [s for s in pending if s in _index_highs]
+        groups = []  # (symbols, days, refresh, incremental)
+        if seeds:
+            groups.append((seeds, INDEX_HIGHS_SEED_DAYS, False, False))
+        if stale:
+            oldest = min(_index_highs[s]["last_bar_date"] for s in stale)
+            groups.append((stale, (today - datetime.date.fromisoformat(oldest)).days + 1, True, True))
+        
+        api = api or set_alpaca_environment(env=alpaca_environment)
+        changed = []
+        while groups:
+            group, days, refresh, incremental = groups.pop(0)
+            bars_by_symbol = get_alpaca_bars_batch(api, group, days=days, refresh=refresh)
+            reseed = []
+            for symbol in group:
+                state = _index_highs.setdefault(symbol, {
+                    "symbol": symbol, "ath": None, "ath_date": None, "last_close": None,
+                    "last_bar_date": None, "peak_dates": [], "peak_highs": []
+                })
+                bars = bars_by_symbol.get(symbol, [])
+                if incremental:
+                    overlap = next((bar for bar in bars if bar["t"][:10] == state["last_bar_date"]), None)
+                    if overlap and state["last_close"] and abs(overlap["c"] / state["last_close"] - 1) > INDEX_HIGHS_SPLIT_TOLERANCE:
+                        print(f"{symbol}: last stored close {state['last_close']:.2f} is now {overlap['c']:.2f} (split?), reseeding index highs")
+                        _index_highs.pop(symbol)
+                        reseed.append(symbol)
+                        continue
+                for bar in bars:
+                    _push_index_bar(state, bar["t"][:10], bar["h"], bar["c"])
+                if state["peak_dates"]:
+                    changed.append(symbol)
+                else:
+                    _index_highs.pop(symbol)
+            if reseed:
+                groups.append((reseed, INDEX_HIGHS_SEED_DAYS, True, False))
+        
+        if changed:
+            try:
+                batch = get_firestore_client().batch()
+                for symbol in changed:
+                    batch.set(refs[symbol], _index_highs[symbol])
+                batch.commit()
+            except Exception as e:
+                print(f"Warning: Could not save index highs to Firestore (local testing?): {e}")
+    
+    return {s: _index_highs[s] for s in symbols if s in _index_highs}
+
+
+def get_index_drawdown(symbol, window_days=None, api=None):
+    """
+    Drawdown of the latest close from the peak high over a trailing window.
+    
+    Args:
+        symbol: Stock symbol
+        window_days: Calendar days to look back for the peak (None = all-time high)
+        api: Alpaca API credentials (optional)
+    
+    Returns:
+        dict: {"current_price", "peak", "peak_date", "drawdown"} (drawdown as a fraction),
+              or None if no data is available
+    """
+    state = update_index_highs([symbol], api).get(symbol.upper())
+    if state is None:
+        return None
+    index = 0
+    if window_days is not None:
+        start = (datetime.date.today() - datetime.timedelta(days=window_days)).isoformat()
+        index = bisect.bisect_left(state["peak_dates"], start)
+        if index == len(state["peak_dates"]):
+            return None
+    peak = state["peak_highs"][index]
+    return {
+        "current_price": state["last_close"],
+        "peak": peak,
+        "peak_date": state["peak_dates"][index],
+        "drawdown": (peak - state["last_close"]) / peak,
+    }
+
+
 def get_index_data(index_symbol):
     """
-    Fetch the all-time high and current price for an index using Alpaca.
-    Uses 5 years of data (maximum available with Basic subscription).
+    Fetch the all-time high and current price for an index from the running-high index.
+    Only bars since the last stored bar are fetched (see update_index_highs).
     
     Args:
         index_symbol: Stock symbol (e.g., "SPY", "URTH")
@@ -2591,73 +4976,39 @@ def get_index_data(index_symbol):
         tuple: (current_price, all_time_high)
     """
     try:
-        # Get API credentials
-        api = set_alpaca_environment(env=alpaca_environment)
-        
-        # Fetch 5 years of data from Alpaca (max available with Basic plan)
-        from datetime import datetime, timedelta
-        
-        market_data_base_url = "https://data.alpaca.markets"
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=1825)  # 5 years
-        
-        url = f"{market_data_base_url}/v2/stocks/{index_symbol}/bars"
-        params = {
-            "start": start_date.strftime("%Y-%m-%d"),
-            "end": end_date.strftime("%Y-%m-%d"),
-            "timeframe": "1Day",
-            "limit": 10000,
-            "adjustment": "split",
-            "feed": "iex"
-        }
-        
-        response = requests.get(url, headers=get_auth_headers(api), params=params)
-        response.raise_for_status()
-        
-        data = response.json()
-        bars = data.get("bars", [])
-        
-        if not bars:
+        drawdown = get_index_drawdown(index_symbol)
+        if drawdown is None:
             raise ValueError(f"No Alpaca data returned for {index_symbol}")
-        
-        # Get all-time high and current close from bars
-        all_time_high = max(bar['h'] for bar in bars)
-        current_price = bars[-1]['c']
-        
-        return current_price, all_time_high
+        return drawdown["current_price"], drawdown["peak"]
         
     except Exception as e:
         print(f"Error fetching index data for {index_symbol}: {e}")
         raise
 
 
-def get_index_sma_state(index_symbol, sma_period):
+def get_index_sma_state(index_symbol, sma_period, noise_threshold=1.0):
     """
-    Load the previous SMA state for an index from Firestore.
+    Load the last notified SMA state for an index from the SMA state store.
+    
+    Alerts compare against the state they last notified, not the store's current state
+    (which update_market_data advances on every refresh), so a crossover is never missed.
     
     Args:
         index_symbol: Market symbol (e.g., "^GSPC")
         sma_period: SMA period (e.g., 200, 255)
+        noise_threshold: Band half-width in percent
     
     Returns:
         dict with keys: state, timestamp
         Returns None if no previous state exists
     """
     try:
-        # Normalize symbol for Firestore document ID
-        doc_id = index_symbol.replace("^", "").replace(".", "_")
-        
-        doc_ref = get_firestore_client().collection("market-data").document(doc_id)
-        doc = doc_ref.get()
-        
-        if not doc.exists:
+        data = get_all_market_data(index_symbol, allow_stale=True)
+        if data is None:
             return None
         
-        data = doc.to_dict()
-        
-        # Extract the state field for this SMA period
-        state_field = f"sma{sma_period}_state"
-        state = data.get(state_field)
+        entry = _stored_sma_entry(data.get("sma_states") or {}, data, sma_period, noise_threshold) or {}
+        state = entry.get("notified_state")
         
         if state is None:
             return None
@@ -2672,18 +5023,18 @@ def get_index_sma_state(index_symbol, sma_period):
         return None
 
 
-def save_index_sma_state(index_symbol, sma_period, state, price, sma_value):
+def save_index_sma_state(index_symbol, sma_period, state, price, sma_value, noise_threshold=1.0):
     """
-    Save the current SMA state for an index to Firestore.
-    Note: update_market_data() now handles price/SMA/state updates automatically.
-    This function is kept for backward compatibility with alert system.
+    Record a notified SMA state for an index in the SMA state store.
+    Advances the (period, band) entry with this observation and marks the state as notified.
     
     Args:
         index_symbol: Market symbol
         sma_period: SMA period
-        state: Current state ("above", "below", or "neutral")
-        price: Current price (ignored - preserved from update_market_data)
-        sma_value: Current SMA value (ignored - preserved from update_market_data)
+        state: Notified state ("above", "below", or "neutral")
+        price: Current price
+        sma_value: Current SMA value
+        noise_threshold: Band half-width in percent
     """
     try:
         # Normalize symbol for Firestore document ID
@@ -2699,11 +5050,16 @@ def save_index_sma_state(index_symbol, sma_period, state, price, sma_value):
         
         data = doc.to_dict()
         
-        # Only update the specific state field (price and SMA already set by update_market_data)
+        key = sma_state_key(sma_period, noise_threshold)
+        sma_states = dict(data.get("sma_states") or {})
+        sma_states[key] = advance_sma_state(_stored_sma_entry(sma_states, data, sma_period, noise_threshold), price, sma_value, noise_threshold)
+        sma_states[key]["notified_state"] = state
+        data["sma_states"] = sma_states
         data[f"sma{sma_period}_state"] = state
         data["timestamp"] = datetime.datetime.utcnow()
         
         doc_ref.set(data)
+        _market_data_docs.pop(index_symbol, None)
         
     except Exception as e:
         print(f"Warning: Could not save SMA state for {index_symbol}: {e}")
@@ -2826,6 +5182,7 @@ def mark_last_hour_alert_sent(index_symbol, sma_period):
         data["timestamp"] = datetime.datetime.utcnow()
         
         doc_ref.set(data)
+        _market_data_docs.pop(index_symbol, None)
         
     except Exception as e:
         print(f"Warning: Could not mark last hour alert as sent: {e}")
@@ -2833,8 +5190,93 @@ def mark_last_hour_alert_sent(index_symbol, sma_period):
 
 
 
+def evaluate_ath_drop_alert(index_name, current_price, all_time_high, threshold_percent):
+    """
+    Pure evaluation of an all-time-high drop alert (no I/O).
+    
+    Returns:
+        dict: message, status, drop_percentage and alert (True if a notification is due)
+    """
+    drop_percentage = ((all_time_high - current_price) / all_time_high) * 100
+    if drop_percentage >= threshold_percent:
+        return {
+            "message": f"Alert: {index_name} has dropped {drop_percentage:.2f}% from its ATH! Consider a loan with a duration of 6 to 8 years (50k to 100k) at around 4.5% interest max",
+            "status": "ath_drop_alert",
+            "drop_percentage": drop_percentage,
+            "alert": True,
+        }
+    return {
+        "message": f"{index_name} is within safe range ({drop_percentage:.2f}% below ATH)",
+        "status": "within_range",
+        "drop_percentage": drop_percentage,
+        "alert": False,
+    }
+
+
+def evaluate_sma_crossing_alert(index_name, sma_period, current_price, sma_value, previous_state,
+                                noise_threshold, in_last_hour, already_sent_last_hour):
+    """
+    Pure evaluation of an SMA crossing alert (no I/O).
+    
+    A state change against the stored previous state is a crossover alert; without one,
+    a single confirmation is due during the last trading hour (above/below only).
+    
+    Returns:
+        dict: message, status, alert, mark_last_hour (record today's last-hour alert),
+              price_diff_percent, current_price, sma_value, previous_state, current_state
+    """
+    price_diff_percent = ((current_price - sma_value) / sma_value) * 100
+    current_state = classify_sma_state(price_diff_percent, noise_threshold)
+    message = None
+    status = None
+    
+    if previous_state and previous_state != current_state:
+        # State changed - crossover alert
+        urgency = " ⚡🔔 LAST HOUR" if in_last_hour else ""
+        if current_state == "above":
+            emoji = "🚀" if price_diff_percent > 2.0 else "📈"
+            message = f"{emoji} {index_name} Alert: Crossed ABOVE its {sma_period}-day SMA!{urgency}\nCurrent: ${current_price:.2f} (SMA: ${sma_value:.2f}, +{price_diff_percent:.2f}%)"
+            status = "crossover_above"
+        elif current_state == "below":
+            emoji = "📉" if price_diff_percent < -2.0 else "📊"
+            message = f"{emoji} {index_name} Alert: Crossed BELOW its {sma_period}-day SMA!{urgency}\nCurrent: ${current_price:.2f} (SMA: ${sma_value:.2f}, {price_diff_percent:.2f}%)"
+            status = "crossover_below"
+        else:
+            # Moved into neutral zone from above or below
+            message = f"📊 {index_name}: Entered neutral zone (within {noise_threshold}% of {sma_period}-day SMA)\nCurrent: ${current_price:.2f} (SMA: ${sma_value:.2f}, {price_diff_percent:+.2f}%)"
+            status = "neutral_zone"
+    elif in_last_hour and not already_sent_last_hour and current_state != "neutral":
+        # Last hour confirmation (only if no crossover alert was due)
+        if current_state == "above":
+            message = f"⚡🔔 {index_name} FINAL HOUR CONFIRMATION:\nStill ABOVE {sma_period}-day SMA\nCurrent: ${current_price:.2f} (SMA: ${sma_value:.2f}, +{price_diff_percent:.2f}%)\n\n✅ Signal: Buy/Hold position"
+            status = "last_hour_above"
+        else:
+            message = f"⚡🔔 {index_name} FINAL HOUR CONFIRMATION:\nStill BELOW {sma_period}-day SMA\nCurrent: ${current_price:.2f} (SMA: ${sma_value:.2f}, {price_diff_percent:.2f}%)\n\n❌ Signal: Avoid/Sell position"
+            status = "last_hour_below"
+    
+    alert = message is not None
+    if not alert:
+        message = f"{index_name} is {current_state} {sma_period}-day SMA (no state change, no alert sent)"
+        status = f"{current_state}_no_change"
+    
+    return {
+        "message": message,
+        "status": status,
+        "alert": alert,
+        "mark_last_hour": alert and in_last_hour,
+        "price_diff_percent": price_diff_percent,
+        "current_price": current_price,
+        "sma_value": sma_value,
+        "previous_state": previous_state,
+        "current_state": current_state,
+    }
+
+
 def check_unified_index_alert(request):
-    """Unified index alert function that can handle multiple indices and alert types"""
+    """
+    Unified index alert function that can handle multiple indices and alert types.
+    A body with an "alerts" list is evaluated in batch by check_batch_index_alerts().
+    """
     
     # Handle case where Content-Type is not set to application/json (e.g., application/octet-stream)
     if request.content_type == "application/json":
@@ -2850,6 +5292,10 @@ def check_unified_index_alert(request):
     if not request_json:
         return jsonify({"error": "No request body provided"}), 400
     
+    # Batch mode: {"alerts": [{...}, ...]} evaluates every spec in one pass
+    if "alerts" in request_json:
+        return check_batch_index_alerts(request_json["alerts"])
+    
     # Extract parameters with defaults
     index_symbol = request_json.get("index_symbol")
     index_name = request_json.get("index_name", index_symbol)
@@ -2865,18 +5311,10 @@ def check_unified_index_alert(request):
         if alert_type == "ath_drop":
             # Handle all-time high drop alerts
             current_price, all_time_high = get_index_data(index_symbol)
-            drop_percentage = ((all_time_high - current_price) / all_time_high) * 100
-            
-            if drop_percentage >= threshold_percent:
-                message = f"Alert: {index_name} has dropped {drop_percentage:.2f}% from its ATH! Consider a loan with a duration of 6 to 8 years (50k to 100k) at around 4.5% interest max"
-                send_telegram_message(message)
-                return jsonify({"message": message, "status": "ath_drop_alert", "drop_percentage": drop_percentage}), 200
-            else:
-                return jsonify({
-                    "message": f"{index_name} is within safe range ({drop_percentage:.2f}% below ATH)",
-                    "status": "within_range",
-                    "drop_percentage": drop_percentage
-                }), 200
+            evaluation = evaluate_ath_drop_alert(index_name, current_price, all_time_high, threshold_percent)
+            if evaluation["alert"]:
+                send_telegram_message(evaluation["message"])
+            return jsonify({key: evaluation[key] for key in ("message", "status", "drop_percentage")}), 200
                 
         elif alert_type == "sma_crossing":
             # Handle SMA crossing alerts with crossover detection
@@ -2906,102 +5344,27 @@ def check_unified_index_alert(request):
                 else:
                     raise ValueError(f"Insufficient Alpaca data for {index_symbol} {sma_period}-day SMA. Got {len(closes) if closes else 0} bars, need {sma_period}.")
             
-            # Calculate percentage difference from SMA
-            price_diff_percent = ((current_price - sma_value) / sma_value) * 100
-            
             # Load previous state from Firestore
-            previous_state_data = get_index_sma_state(index_symbol, sma_period)
+            previous_state_data = get_index_sma_state(index_symbol, sma_period, noise_threshold)
             previous_state = previous_state_data.get("state") if previous_state_data else None
             
-            # Determine current state based on noise threshold
-            if price_diff_percent > noise_threshold:
-                current_state = "above"
-            elif price_diff_percent < -noise_threshold:
-                current_state = "below"
-            else:
-                current_state = "neutral"
-            
-            # Check if we're in the last trading hour
-            in_last_hour = is_last_trading_hour()
-            already_sent_last_hour = was_last_hour_alert_sent_today(index_symbol, sma_period)
-            
-            # Initialize response variables
-            message = None
-            status = None
-            alert_sent = False
-            
-            # Check for state change (crossover)
-            if previous_state and previous_state != current_state:
-                # State changed - send crossover alert
-                if current_state == "above":
-                    emoji = "🚀" if price_diff_percent > 2.0 else "📈"
-                    urgency = " ⚡🔔 LAST HOUR" if in_last_hour else ""
-                    message = f"{emoji} {index_name} Alert: Crossed ABOVE its {sma_period}-day SMA!{urgency}\nCurrent: ${current_price:.2f} (SMA: ${sma_value:.2f}, +{price_diff_percent:.2f}%)"
-                    status = "crossover_above"
-                    alert_sent = True
-                    
-                elif current_state == "below":
-                    emoji = "📉" if price_diff_percent < -2.0 else "📊"
-                    urgency = " ⚡🔔 LAST HOUR" if in_last_hour else ""
-                    message = f"{emoji} {index_name} Alert: Crossed BELOW its {sma_period}-day SMA!{urgency}\nCurrent: ${current_price:.2f} (SMA: ${sma_value:.2f}, {price_diff_percent:.2f}%)"
-                    status = "crossover_below"
-                    alert_sent = True
-                    
-                elif current_state == "neutral":
-                    # Moved into neutral zone from above or below
-                    message = f"📊 {index_name}: Entered neutral zone (within {noise_threshold}% of {sma_period}-day SMA)\nCurrent: ${current_price:.2f} (SMA: ${sma_value:.2f}, {price_diff_percent:+.2f}%)"
-                    status = "neutral_zone"
-                    alert_sent = True
-                
-                # Send the crossover alert
-                if message:
-                    send_telegram_message(message)
-                    # If sent during last hour, mark it
-                    if in_last_hour:
-                        mark_last_hour_alert_sent(index_symbol, sma_period)
-            
-            # Check for last hour confirmation (only if no crossover alert was sent)
-            elif in_last_hour and not already_sent_last_hour and current_state != "neutral":
-                # Send urgent confirmation alert during last trading hour
-                if current_state == "above":
-                    message = f"⚡🔔 {index_name} FINAL HOUR CONFIRMATION:\nStill ABOVE {sma_period}-day SMA\nCurrent: ${current_price:.2f} (SMA: ${sma_value:.2f}, +{price_diff_percent:.2f}%)\n\n✅ Signal: Buy/Hold position"
-                    status = "last_hour_above"
-                    alert_sent = True
-                elif current_state == "below":
-                    message = f"⚡🔔 {index_name} FINAL HOUR CONFIRMATION:\nStill BELOW {sma_period}-day SMA\nCurrent: ${current_price:.2f} (SMA: ${sma_value:.2f}, {price_diff_percent:.2f}%)\n\n❌ Signal: Avoid/Sell position"
-                    status = "last_hour_below"
-                    alert_sent = True
-                
-                # Send the last hour confirmation
-                if message:
-                    send_telegram_message(message)
+            evaluation = evaluate_sma_crossing_alert(
+                index_name, sma_period, current_price, sma_value, previous_state, noise_threshold,
+                is_last_trading_hour(), was_last_hour_alert_sent_today(index_symbol, sma_period)
+            )
+            if evaluation["alert"]:
+                send_telegram_message(evaluation["message"])
+                # If sent during last hour, mark it
+                if evaluation["mark_last_hour"]:
                     mark_last_hour_alert_sent(index_symbol, sma_period)
             
             # Save current state to Firestore (always update)
-            save_index_sma_state(index_symbol, sma_period, current_state, current_price, sma_value)
+            save_index_sma_state(index_symbol, sma_period, evaluation["current_state"], current_price, sma_value, noise_threshold)
             
-            # Return appropriate response
-            if alert_sent:
-                return jsonify({
-                    "message": message,
-                    "status": status,
-                    "price_diff_percent": price_diff_percent,
-                    "current_price": current_price,
-                    "sma_value": sma_value,
-                    "previous_state": previous_state,
-                    "current_state": current_state
-                }), 200
-            else:
-                # No alert sent - state unchanged
-                return jsonify({
-                    "message": f"{index_name} is {current_state} {sma_period}-day SMA (no state change, no alert sent)",
-                    "status": f"{current_state}_no_change",
-                    "price_diff_percent": price_diff_percent,
-                    "current_price": current_price,
-                    "sma_value": sma_value,
-                    "previous_state": previous_state,
-                    "current_state": current_state
-                }), 200
+            return jsonify({
+                key: evaluation[key]
+                for key in ("message", "status", "price_diff_percent", "current_price", "sma_value", "previous_state", "current_state")
+            }), 200
         else:
             return jsonify({"error": f"Invalid alert_type: {alert_type}. Must be 'ath_drop' or 'sma_crossing'"}), 400
                 
@@ -3012,6 +5375,485 @@ def check_unified_index_alert(request):
         return jsonify({"error": error_message}), 500
 
 
+def check_batch_index_alerts(specs):
+    """
+    Evaluate many index alerts in one invocation.
+    
+    SMA bars come from one batched bars request, current prices from one batched
+    latest-trades request, all-time highs from the running-high index (see
+    update_index_highs) and previous states from one Firestore get_all. Every
+    alert is evaluated in a single pass, state changes are persisted in one write batch
+    and the alerts that fire are sent as a single Telegram message.
+    
+    Args:
+        specs: List of alert dicts with the same keys as the single-index request
+               (index_symbol, index_name, alert_type, sma_period, threshold_percent,
+               noise_threshold)
+    
+    Returns:
+        tuple: (Flask JSON response, status code) with one result per spec
+    """
+    if not isinstance(specs, list) or not specs:
+        return jsonify({"error": "alerts must be a non-empty list"}), 400
+    
+    normalized = []
+    for raw in specs:
+        if not isinstance(raw, dict) or not raw.get("index_symbol"):
+            return jsonify({"error": "Every alert needs an index_symbol"}), 400
+        alert_type = raw.get("alert_type", "ath_drop")
+        if alert_type not in ("ath_drop", "sma_crossing"):
+            return jsonify({"error": f"Invalid alert_type: {alert_type}. Must be 'ath_drop' or 'sma_crossing'"}), 400
+        symbol = raw["index_symbol"].upper()
+        normalized.append({
+            "index_symbol": symbol,
+            "index_name": raw.get("index_name", raw["index_symbol"]),
+            "alert_type": alert_type,
+            "sma_period": int(raw.get("sma_period", 200)),
+            "threshold_percent": raw.get("threshold_percent", 30.0),
+            "noise_threshold": raw.get("noise_threshold", 1.0),
+        })
+    
+    try:
+        api = set_alpaca_environment(env=alpaca_environment)
+        symbols = list(dict.fromkeys(spec["index_symbol"] for spec in normalized))
+        sma_specs = [spec for spec in normalized if spec["alert_type"] == "sma_crossing"]
+        sma_symbols = list(dict.fromkeys(spec["index_symbol"] for spec in sma_specs))
+        ath_symbols = [spec["index_symbol"] for spec in normalized if spec["alert_type"] == "ath_drop"]
+        bars_by_symbol = {}
+        prices = {}
+        if sma_specs:
+            # Enough history for the longest SMA (add 50% buffer, trading days to calendar days)
+            days = max(max(500, int(spec["sma_period"] * 1.5 * 1.4)) for spec in sma_specs)
+            bars_by_symbol = get_alpaca_bars_batch(api, sma_symbols, days=days)
+            prices = get_latest_trades(api, sma_symbols)
+        highs = update_index_highs(ath_symbols, api) if ath_symbols else {}
+        
+        db = get_firestore_client()
+        refs = {
+            s: db.collection("market-data").document(s.replace("^", "").replace(".", "_"))
+            for s in symbols
+        }
+        stored = {s: {} for s in symbols}
+        doc_ids = {ref.id: s for s, ref in refs.items()}
+        for snapshot in db.get_all(list(refs.values())):
+            if snapshot.exists:
+                stored[doc_ids[snapshot.id]] = snapshot.to_dict()
+    except Exception as e:
+        error_message = f"Error checking batch index alerts: {str(e)}"
+        print(error_message)
+        send_telegram_message(error_message)
+        return jsonify({"error": error_message}), 500
+    
+    in_last_hour = is_last_trading_hour() if sma_symbols else False
+    today = datetime.datetime.now().date().isoformat()
+    now = datetime.datetime.utcnow()
+    updates = {}
+    results = []
+    alert_messages = []
+    
+    for spec in normalized:
+        symbol = spec["index_symbol"]
+        index_name = spec["index_name"]
+        try:
+            if spec["alert_type"] == "ath_drop":
+                if symbol not in highs:
+                    raise ValueError(f"No Alpaca data returned for {symbol}")
+                evaluation = evaluate_ath_drop_alert(
+                    index_name, highs[symbol]["last_close"], highs[symbol]["ath"], spec["threshold_percent"]
+                )
+            else:
+                sma_period = spec["sma_period"]
+                closes = [bar["c"] for bar in bars_by_symbol.get(symbol, [])]
+                if not closes:
+                    raise ValueError(f"No Alpaca data returned for {symbol}")
+                if len(closes) < sma_period:
+                    raise ValueError(f"Insufficient Alpaca data for {symbol} {sma_period}-day SMA. Got {len(closes)} bars, need {sma_period}.")
+                if symbol not in prices:
+                    raise ValueError(f"No latest trade returned for {symbol}")
+                current_price = prices[symbol]
+                sma_value = sum(closes[-sma_period:]) / sma_period
+                
+                doc = stored[symbol]
+                update = updates.setdefault(symbol, {
+                    "symbol": symbol, "price": float(current_price), "sma_states": dict(doc.get("sma_states") or {})
+                })
+                sma_states = update["sma_states"]
+                if len(closes) >= 255:
+                    # Keep the default SMAs and their state machines fresh, as update_market_data would
+                    for period in (200, 255):
+                        period_sma = sum(closes[-period:]) / period
+                        update[f"sma{period}"] = float(period_sma)
+                        entry = advance_sma_state(_stored_sma_entry(sma_states, doc, period), current_price, period_sma, 1.0, now)
+                        sma_states[sma_state_key(period, 1.0)] = entry
+                        update[f"sma{period}_state"] = entry["state"]
+                
+                key = sma_state_key(sma_period, spec["noise_threshold"])
+                entry = _stored_sma_entry(sma_states, doc, sma_period, spec["noise_threshold"]) or {}
+                alert_date_field = f"sma{sma_period}_last_hour_alert_date"
+                previous_state = entry.get("notified_state")
+                last_alert_date = doc.get(alert_date_field)
+                if last_alert_date is not None and not isinstance(last_alert_date, str):
+                    last_alert_date = last_alert_date.date().isoformat() if hasattr(last_alert_date, "date") else str(last_alert_date)
+                
+                evaluation = evaluate_sma_crossing_alert(
+                    index_name, sma_period, current_price, sma_value, previous_state,
+                    spec["noise_threshold"], in_last_hour, last_alert_date == today
+                )
+                entry = advance_sma_state(entry, current_price, sma_value, spec["noise_threshold"], now)
+                entry["notified_state"] = evaluation["current_state"]
+                sma_states[key] = entry
+                update[f"sma{sma_period}_state"] = evaluation["current_state"]
+                if evaluation["mark_last_hour"]:
+                    update[alert_date_field] = today
+            
+            if evaluation["alert"]:
+                alert_messages.append(evaluation["message"])
+            result = {key: value for key, value in evaluation.items() if key not in ("alert", "mark_last_hour")}
+            result.update({"index_symbol": symbol, "alert_type": spec["alert_type"], "alert_sent": evaluation["alert"]})
+            if spec["alert_type"] == "sma_crossing":
+                result["sma_period"] = spec["sma_period"]
+            results.append(result)
+        except Exception as e:
+            error_message = f"Error checking {index_name} alert: {str(e)}"
+            print(error_message)
+            results.append({"index_symbol": symbol, "alert_type": spec["alert_type"], "error": error_message})
+    
+    if updates:
+        try:
+            batch = db.batch()
+            for symbol, update in updates.items():
+                update["timestamp"] = now
+                batch.set(refs[symbol], update, merge=True)
+                _market_data_docs.pop(symbol, None)
+            batch.commit()
+        except Exception as e:
+            print(f"Warning: Could not save batch alert state: {e}")
+    
+    errors = [result["error"] for result in results if "error" in result]
+    if alert_messages or errors:
+        send_telegram_message("\n\n".join(alert_messages + errors))
+    
+    return jsonify({"results": results, "alerts_sent": len(alert_messages)}), 200
+
+
+# Long-running SMA crossover monitor (see run_sma_monitor); watches mirror the scheduled sma_crossing alerts
+sma_monitor_config = {
+    "watches": [
+        {"index_symbol": "SPY", "index_name": "S&P 500 (SPY)", "sma_period": 200, "noise_threshold": 1.0},
+        {"index_symbol": "URTH", "index_name": "iShares MSCI World ETF", "sma_period": 255, "noise_threshold": 1.0},
+    ],
+    "stream_url": "wss://stream.data.alpaca.markets/v2/iex",
+    "heartbeat_seconds": 30,  # Wake up without trades so the monitor can stop at the close
+    "reconnect_delay": 5,
+}
+
+
+def prepare_sma_monitor(api, watches=None, as_of=None):
+    """
+    Precompute everything the streaming monitor needs, so ticks never touch Firestore.
+    
+    SMAs come from completed daily bars (one batched request) and stay fixed for the
+    session; each watch holds its ±noise band as price levels. Previous states and
+    last-hour alert dates come from one Firestore get_all.
+    
+    Args:
+        api: Alpaca API credentials
+        watches: List of {"index_symbol", "index_name", "sma_period", "noise_threshold"}
+                 (defaults to sma_monitor_config["watches"])
+        as_of: Session date ("YYYY-MM-DD") of a replayed feed: the SMAs use the bars before it
+               and the stored (live) states are not loaded
+    
+    Returns:
+        list: Watch dicts with sma_value, upper, lower, state (last notified), entry (store entry)
+              and last_hour_sent
+    """
+    watches = watches or sma_monitor_config["watches"]
+    today = as_of or datetime.date.today().isoformat()
+    symbols = list(dict.fromkeys(w["index_symbol"].upper() for w in watches))
+    days = max(max(500, int(w["sma_period"] * 1.5 * 1.4)) for w in watches)
+    # The window is measured back from market_data_today(), so reach back to the session as well
+    days += max(0, (market_data_today().date() - datetime.date.fromisoformat(today)).days)
+    bars_by_symbol = get_alpaca_bars_batch(api, symbols, days=days, refresh=True)
+    
+    stored = {s: {} for s in symbols}
+    if as_of is None:
+        try:
+            db = get_firestore_client()
+            refs = [db.collection("market-data").document(s.replace("^", "").replace(".", "_")) for s in symbols]
+            doc_ids = {ref.id: s for ref, s in zip(refs, symbols)}
+            for snapshot in db.get_all(refs):
+                if snapshot.exists:
+                    stored[doc_ids[snapshot.id]] = snapshot.to_dict()
+        except Exception as e:
+            print(f"Warning: Could not load SMA states for the monitor (local testing?): {e}")
+    
+    prepared = []
+    for watch in watches:
+        symbol = watch["index_symbol"].upper()
+        sma_period = int(watch["sma_period"])
+        noise_threshold = watch.get("noise_threshold", 1.0)
+        closes = [bar["c"] for bar in bars_by_symbol.get(symbol, []) if bar["t"][:10] < today]
+        if len(closes) < sma_period:
+            print(f"Skipping {symbol} {sma_period}-day SMA monitor: got {len(closes)} bars, need {sma_period}")
+            continue
+        sma_value = sum(closes[-sma_period:]) / sma_period
+        last_alert_date = stored[symbol].get(f"sma{sma_period}_last_hour_alert_date")
+        entry = _stored_sma_entry(stored[symbol].get("sma_states") or {}, stored[symbol], sma_period, noise_threshold) or {}
+        prepared.append({
+            "index_symbol": symbol,
+            "index_name": watch.get("index_name", symbol),
+            "sma_period": sma_period,
+            "noise_threshold": noise_threshold,
+            "sma_value": sma_value,
+            "upper": sma_value * (1 + noise_threshold / 100),
+            "lower": sma_value * (1 - noise_threshold / 100),
+            "state": entry.get("notified_state"),
+            "entry": entry,
+            "last_hour_sent": str(last_alert_date)[:10] if last_alert_date else None,
+        })
+        print(f"Monitoring {symbol} vs {sma_period}-day SMA ${sma_value:.2f} (band ${prepared[-1]['lower']:.2f}-${prepared[-1]['upper']:.2f}, state {prepared[-1]['state']})")
+    return prepared
+
+
+def process_sma_tick(watch, price, in_last_hour, session_date):
+    """
+    Evaluate one trade against a prepared watch (in memory, no I/O).
+    
+    Prices inside the current state's region return immediately; a band crossing or a
+    due final-hour confirmation is evaluated with evaluate_sma_crossing_alert, so the
+    messages match the scheduled alerts. The watch is updated in place.
+    
+    Args:
+        watch: Watch dict from prepare_sma_monitor
+        price: Trade price
+        in_last_hour: Whether the trade falls in the last trading hour
+        session_date: Trading date of the trade ("YYYY-MM-DD")
+    
+    Returns:
+        dict: The evaluation if the state changed or an alert is due, else None
+    """
+    if price > watch["upper"]:
+        state = "above"
+    elif price < watch["lower"]:
+        state = "below"
+    else:
+        state = "neutral"
+    
+    confirmation_due = in_last_hour and watch["last_hour_sent"] != session_date and state != "neutral"
+    if state == watch["state"] and not confirmation_due:
+        return None
+    
+    evaluation = evaluate_sma_crossing_alert(
+        watch["index_name"], watch["sma_period"], price, watch["sma_value"], watch["state"],
+        watch["noise_threshold"], in_last_hour, watch["last_hour_sent"] == session_date
+    )
+    watch["state"] = evaluation["current_state"]
+    if evaluation["mark_last_hour"]:
+        watch["last_hour_sent"] = session_date
+    return evaluation
+
+
+def iter_alpaca_trade_stream(api, symbols):
+    """
+    Yield (symbol, price, timestamp) trades from the Alpaca real-time data stream.
+    
+    Requires the websocket-client package. Reconnects after errors; yields
+    (None, None, None) heartbeats when no trade arrives within heartbeat_seconds.
+    
+    Args:
+        api: Alpaca API credentials
+        symbols: Symbols to subscribe to
+    """
+    import websocket  # websocket-client, only needed for the streaming monitor
+    
+    while True:
+        ws = None
+        try:
+            ws = websocket.create_connection(sma_monitor_config["stream_url"], timeout=sma_monitor_config["heartbeat_seconds"])
+            ws.recv()  # [{"T": "success", "msg": "connected"}]
+            ws.send(json.dumps({"action": "auth", "key": api["API_KEY"], "secret": api["SECRET_KEY"]}))
+            for message in json.loads(ws.recv()):
+                if message.get("T") == "error":
+                    raise RuntimeError(f"Alpaca stream authentication failed: {message.get('msg')}")
+            ws.send(json.dumps({"action": "subscribe", "trades": list(symbols)}))
+            print(f"Subscribed to Alpaca trade stream for {', '.join(symbols)}")
+            while True:
+                try:
+                    raw = ws.recv()
+                except websocket.WebSocketTimeoutException:
+                    yield None, None, None
+                    continue
+                for message in json.loads(raw):
+                    if message.get("T") == "t":
+                        yield message["S"], float(message["p"]), message["t"]
+                    elif message.get("T") == "error":
+                        raise RuntimeError(f"Alpaca stream error: {message.get('msg')}")
+        except (RuntimeError, ImportError):
+            raise
+        except Exception as e:
+            print(f"Alpaca stream disconnected ({e}), reconnecting in {sma_monitor_config['reconnect_delay']}s")
+            time.sleep(sma_monitor_config["reconnect_delay"])
+        finally:
+            if ws is not None:
+                ws.close()
+
+
+def iter_replay_feed(path, speed=0):
+    """
+    Yield (symbol, price, timestamp) trades from a recorded file, as a stand-in for the stream.
+    
+    Accepts JSON lines in the Alpaca trade shape ({"S", "p", "t"}) or CSV rows of
+    symbol,price,timestamp (an optional header row is skipped).
+    
+    Args:
+        path: File to replay
+        speed: 0 replays as fast as possible; otherwise sleeps the recorded gaps divided by speed
+    """
+    previous = None
+    with open(path) as feed:
+        for line in feed:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                message = json.loads(line)
+                symbol, price, timestamp = message["S"], message["p"], message["t"]
+            else:
+                symbol, price, timestamp = [field.strip() for field in line.split(",")[:3]]
+                if symbol.lower() == "symbol":
+                    continue
+            if speed and previous is not None:
+                gap = (pd.Timestamp(timestamp) - previous).total_seconds() / speed
+                if gap > 0:
+                    time.sleep(gap)
+            previous = pd.Timestamp(timestamp)
+            yield symbol.upper(), float(price), timestamp
+
+
+def _trade_session(timestamp):
+    """(UTC pd.Timestamp, New York session date "YYYY-MM-DD") of a trade timestamp (None = now)."""
+    now = pd.Timestamp(timestamp) if timestamp else pd.Timestamp.now(tz="UTC")
+    if now.tzinfo is None:
+        now = now.tz_localize("UTC")
+    return now, now.tz_convert("America/New_York").date().isoformat()
+
+
+def run_sma_monitor(api, watches=None, feed=None, speed=0):
+    """
+    Stream trades and send SMA crossover and final-hour alerts as soon as a price crosses the band.
+    
+    Thresholds, states and session close times are held in memory; Firestore is only
+    written when a watch changes state or sends its final-hour confirmation. Runs until
+    the session closes or the feed ends.
+    
+    A replayed feed is side-effect free: SMAs are computed as of the feed's first session,
+    no Telegram message is sent and nothing is written to Firestore. The evaluations are
+    returned instead.
+    
+    Args:
+        api: Alpaca API credentials
+        watches: Watch list (defaults to sma_monitor_config["watches"])
+        feed: Path of a recorded feed to replay instead of the live stream
+        speed: Replay speed for recorded feeds (0 = as fast as possible)
+    
+    Returns:
+        dict: {"trades", "alerts", "states"}, plus "evaluations" (time, symbol, price, status,
+              alert, message) for a replayed feed
+    """
+    as_of = None
+    if feed:
+        stream = iter_replay_feed(feed, speed)
+        first = next(stream, None)
+        if first is None:
+            return {"trades": 0, "alerts": 0, "states": {}, "evaluations": []}
+        as_of = _trade_session(first[2])[1]
+    prepared = prepare_sma_monitor(api, watches, as_of=as_of)
+    if not prepared:
+        if feed:
+            stream.close()
+        return {"trades": 0, "alerts": 0, "states": {}, **({"evaluations": []} if feed else {})}
+    by_symbol = {}
+    for watch in prepared:
+        by_symbol.setdefault(watch["index_symbol"], []).append(watch)
+    
+    nyse = mcal.get_calendar("NYSE")
+    closes = {}
+    
+    def session_close(day):
+        if day not in closes:
+            schedule = nyse.schedule(start_date=day, end_date=day)
+            closes[day] = None if schedule.empty else schedule.iloc[0]["market_close"]
+        return closes[day]
+    
+    trades = alerts = 0
+    evaluations = []
+    if feed:
+        source = itertools.chain([first], stream)
+    else:
+        stream = source = iter_alpaca_trade_stream(api, list(by_symbol))
+    try:
+        for symbol, price, timestamp in source:
+            now, session_date = _trade_session(timestamp)
+            market_close = session_close(session_date)
+            if not feed and (market_close is None or now > market_close):
+                print("Market closed, stopping SMA monitor")
+                break
+            if symbol not in by_symbol:
+                continue
+            trades += 1
+            in_last_hour = market_close is not None and 0 <= (market_close - now).total_seconds() <= 3600
+            
+            for watch in by_symbol[symbol]:
+                previous_state = watch["state"]
+                evaluation = process_sma_tick(watch, price, in_last_hour, session_date)
+                if evaluation is None:
+                    continue
+                if evaluation["alert"]:
+                    alerts += 1
+                    print(f"{now.isoformat()} {evaluation['status']}: {symbol} ${price:.2f}")
+                if feed:
+                    # Replay: report only, never alert or touch the live alert state
+                    evaluations.append({
+                        "time": now.isoformat(), "symbol": symbol, "price": price, "status": evaluation["status"],
+                        "alert": evaluation["alert"], "message": evaluation["message"],
+                    })
+                    continue
+                if evaluation["alert"]:
+                    send_telegram_message(evaluation["message"])
+                
+                # Persist transitions only
+                if previous_state == watch["state"] and not evaluation["mark_last_hour"]:
+                    continue
+                watch["entry"] = advance_sma_state(
+                    watch["entry"], price, watch["sma_value"], watch["noise_threshold"], now.tz_convert(None).to_pydatetime()
+                )
+                watch["entry"]["notified_state"] = watch["state"]
+                update = {
+                    "sma_states": {sma_state_key(watch["sma_period"], watch["noise_threshold"]): watch["entry"]},
+                    f"sma{watch['sma_period']}_state": watch["state"],
+                }
+                if evaluation["mark_last_hour"]:
+                    update[f"sma{watch['sma_period']}_last_hour_alert_date"] = session_date
+                try:
+                    doc_id = symbol.replace("^", "").replace(".", "_")
+                    get_firestore_client().collection("market-data").document(doc_id).set(update, merge=True)
+                except Exception as e:
+                    print(f"Warning: Could not save SMA state for {symbol}: {e}")
+    except KeyboardInterrupt:
+        print("SMA monitor interrupted")
+    finally:
+        stream.close()
+    
+    result = {
+        "trades": trades,
+        "alerts": alerts,
+        "states": {f"{w['index_symbol']}:{w['sma_period']}": w["state"] for w in prepared},
+    }
+    if feed:
+        result["evaluations"] = evaluations
+    return result
+
+
 def get_dual_momentum_position_value(api):
     """
     Get current value and position details for dual momentum strategy.
@@ -3028,20 +5870,17 @@ def get_dual_momentum_position_value(api):
         }
     """
     try:
-        positions = api.list_positions()
-        dual_momentum_symbols = ["SPUU", "EFO", "BND"]
+        positions = get_sleeve_positions(api, "dual_momentum")
         
         total_value = 0
         current_position = None
         shares_held = 0
         
-        for position in positions:
-            if position.symbol in dual_momentum_symbols:
-                position_value = float(position.market_value)
-                total_value += position_value
-                if position_value > 0:
-                    current_position = position.symbol
-                    shares_held = float(position.qty)
+        for symbol, position in positions.items():
+            total_value += position["value"]
+            if position["value"] > 0:
+                current_position = symbol
+                shares_held = position["qty"]
         
         return {
             "total_value": total_value,
@@ -3094,94 +5933,301 @@ def calculate_12_month_returns(api, symbol):
         return None
 
 
+def build_close_matrix(closes_by_symbol, latest_prices=None):
+    """
+    Build an aligned (dates x symbols) close matrix from per-symbol close lists.
+
+    Close lists are aligned on their most recent bar, so symbols with shorter
+    histories simply get NaN for the older rows. If latest_prices is given, the
+    last row is marked to those prices (live scoring uses the latest trade as "today").
+
+    Args:
+        closes_by_symbol: dict of symbol -> list of closing prices (most recent last)
+        latest_prices: Optional dict of symbol -> latest trade price
+
+    Returns:
+        pd.DataFrame: Close matrix with one column per symbol (most recent row last)
+    """
+    columns = {
+        symbol: pd.Series(closes, index=range(1 - len(closes), 1), dtype=float)
+        for symbol, closes in closes_by_symbol.items()
+        if closes
+    }
+    closes = pd.DataFrame(columns).sort_index()
+
+    if latest_prices and not closes.empty:
+        for symbol, price in latest_prices.items():
+            if symbol in closes.columns and price:
+                closes.iloc[-1, closes.columns.get_loc(symbol)] = float(price)
+
+    return closes
+
+
+def calculate_momentum_scores(closes, weights=None, lookback_periods=None):
+    """
+    Vectorized multi-period momentum scores for every date and symbol of a close matrix.
+
+    Each period return is close / close.shift(days) - 1, computed for the whole matrix
+    at once, and the composite is the weighted sum of the period returns. Rows without
+    enough history (or with a zero reference price) are NaN.
+
+    Args:
+        closes: pd.DataFrame of closing prices (dates x symbols, most recent row last)
+        weights: Period weights (defaults to sector_momentum_config["momentum_weights"])
+        lookback_periods: Period lengths in trading days (defaults to sector_momentum_config["lookback_periods"])
+
+    Returns:
+        pd.DataFrame: Composite momentum score per date and symbol
+    """
+    weights = weights or sector_momentum_config["momentum_weights"]
+    lookback_periods = lookback_periods or sector_momentum_config["lookback_periods"]
+
+    scores = None
+    for period_name, days in lookback_periods.items():
+        reference = closes.shift(days)
+        period_return = closes / reference.where(reference != 0) - 1
+        weighted = period_return * weights[period_name]
+        scores = weighted if scores is None else scores + weighted
+
+    return scores
+
+
+def rank_momentum_scores(scores, top_n=None):
+    """
+    Cross-sectional ranks and top-N membership for a momentum score matrix.
+
+    Ties keep the symbol column order (same as a stable sort on the universe list).
+
+    Args:
+        scores: pd.DataFrame from calculate_momentum_scores()
+        top_n: Number of top-ranked symbols per date (defaults to sector_momentum_config["top_sectors_count"])
+
+    Returns:
+        tuple: (ranks, top_membership) - ranks are 1 = strongest (NaN where no score),
+               top_membership is a boolean DataFrame of the same shape
+    """
+    top_n = top_n or sector_momentum_config["top_sectors_count"]
+    ranks = scores.rank(axis=1, ascending=False, method="first")
+    top_membership = ranks <= top_n
+    return ranks, top_membership
+
+
 def calculate_multi_period_momentum(api, ticker):
     """
     Calculate multi-period momentum score for a sector ETF.
-    
+
     Uses weighted combination of 1-month (40%), 3-month (20%), 6-month (20%), and 12-month (20%) returns.
-    
+
     Args:
         api: Alpaca API credentials
         ticker: Sector ETF ticker (e.g., 'XLK', 'XLF')
-    
+
     Returns:
         float: Weighted composite momentum score or None if error
     """
     try:
         # Get current price
         current_price = float(get_latest_trade(api, ticker))
-        
+
         # Get historical bars (need 252+ days for 12-month calculation)
         bars = get_alpaca_historical_bars(api, ticker, days=400)
-        
-        if len(bars) < 252:
-            print(f"Warning: Only {len(bars)} days of data available for {ticker}")
+
+        if not bars or len(bars) < 252:
+            print(f"Warning: Only {len(bars) if bars else 0} days of data available for {ticker}")
             return None
-        
-        # Calculate returns for each period
-        returns = {}
-        weights = sector_momentum_config["momentum_weights"]
-        periods = sector_momentum_config["lookback_periods"]
-        
-        for period_name, days in periods.items():
-            try:
-                # Get price from N days ago
-                price_n_days_ago = bars[-(days + 1)]  # +1 because we want exactly N days ago
-                
-                if price_n_days_ago == 0:
-                    print(f"Warning: Zero price {days} days ago for {ticker}")
-                    return None
-                
-                # Calculate return
-                period_return = (current_price / price_n_days_ago) - 1
-                returns[period_name] = period_return
-                
-            except Exception as e:
-                print(f"Error calculating {period_name} return for {ticker}: {e}")
-                return None
-        
-        # Calculate weighted composite score
-        composite_score = (
-            weights["1_month"] * returns["1_month"] +
-            weights["3_month"] * returns["3_month"] +
-            weights["6_month"] * returns["6_month"] +
-            weights["12_month"] * returns["12_month"]
-        )
-        
-        return composite_score
-        
+
+        closes = build_close_matrix({ticker: bars}, {ticker: current_price})
+        score = calculate_momentum_scores(closes)[ticker].iloc[-1]
+
+        if pd.isna(score):
+            print(f"Warning: Could not calculate momentum for {ticker} (insufficient or zero prices)")
+            return None
+
+        return float(score)
+
     except Exception as e:
         print(f"Error calculating multi-period momentum for {ticker}: {e}")
         return None
 
 
+def load_universe_file(path):
+    """
+    Load a ticker universe from a file.
+
+    Supports plain text/CSV (one ticker per line, optional ",Name"; lines starting with # are
+    ignored), a JSON list of tickers, or a JSON object of ticker -> name.
+
+    Args:
+        path: Path to the universe file
+
+    Returns:
+        dict: ticker -> display name (ticker itself when no name is given), in file order
+    """
+    with open(path) as f:
+        content = f.read()
+
+    if path.endswith(".json"):
+        data = json.loads(content)
+        if isinstance(data, dict):
+            return {str(t).upper(): str(name) for t, name in data.items()}
+        return {str(t).upper(): str(t).upper() for t in data}
+
+    universe = {}
+    for line in content.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        ticker, _, name = line.partition(",")
+        ticker = ticker.strip().upper()
+        if ticker and ticker != "SYMBOL":  # Skip a CSV header row
+            universe[ticker] = name.strip() or ticker
+    return universe
+
+
+def screen_universe(api, candidates):
+    """
+    Filter a candidate list by last close and 20-day average dollar volume.
+    Uses the same batched, cached bars as the momentum scan (no extra round trips).
+
+    Args:
+        api: Alpaca API credentials
+        candidates: List of candidate tickers
+
+    Returns:
+        list: Tickers passing the screen, in candidate order
+    """
+    bars_by_symbol = get_alpaca_bars_batch(api, candidates, days=sector_momentum_config["history_days"])
+    if not bars_by_symbol:
+        return []
+
+    closes = pd.DataFrame({s: pd.Series([b["c"] for b in bars[-20:]], dtype=float) for s, bars in bars_by_symbol.items()})
+    volumes = pd.DataFrame({s: pd.Series([b.get("v", 0) for b in bars[-20:]], dtype=float) for s, bars in bars_by_symbol.items()})
+
+    last_close = closes.ffill().iloc[-1]
+    avg_dollar_volume = (closes * volumes).mean()
+    passed = (last_close >= sector_momentum_config["screen_min_price"]) & (
+        avg_dollar_volume >= sector_momentum_config["screen_min_dollar_volume"]
+    )
+
+    selected = [s for s in candidates if passed.get(s.upper(), False)]
+    print(f"Universe screen: {len(selected)}/{len(candidates)} candidates passed")
+    return selected
+
+
+def get_sector_universe(api=None):
+    """
+    Resolve the momentum universe from the configured provider (static, file or screen).
+
+    Args:
+        api: Alpaca API credentials (only needed for the "screen" provider)
+
+    Returns:
+        list: Tickers to scan
+    """
+    provider = sector_momentum_config.get("universe", "static")
+
+    if provider == "static":
+        return list(sector_momentum_config["sector_etfs"])
+
+    if provider in ("file", "screen") and sector_momentum_config.get("universe_file"):
+        file_universe = load_universe_file(sector_momentum_config["universe_file"])
+        # Names from the file are used for reporting
+        for ticker, name in file_universe.items():
+            sector_momentum_config["sector_names"].setdefault(ticker, name)
+        candidates = list(file_universe)
+    else:
+        candidates = list(sector_momentum_config.get("screen_candidates") or sector_momentum_config["sector_etfs"])
+
+    if provider == "file":
+        return candidates
+    if provider == "screen":
+        return screen_universe(api, candidates)
+
+    raise ValueError(f"Invalid universe provider: {provider}. Use 'static', 'file', or 'screen'.")
+
+
+def get_sector_target_weight():
+    """Target weight per selected sector (configured value or equal weight across the top N)."""
+    configured = sector_momentum_config.get("target_allocation_per_sector")
+    if configured:
+        return configured
+    return int(10000 / sector_momentum_config["top_sectors_count"]) / 10000
+
+
+def scan_momentum_universe(api, symbols=None, top_n=None):
+    """
+    Score a whole universe in one pass: batched bars, batched latest trades, vectorized scoring.
+    Cost is a fixed number of requests per 200 symbols regardless of universe size.
+
+    Args:
+        api: Alpaca API credentials
+        symbols: Tickers to scan (defaults to get_sector_universe())
+        top_n: Number of top-ranked tickers (defaults to top_sectors_count)
+
+    Returns:
+        dict: {
+            "rankings": list of (ticker, score) sorted by score descending,
+            "top": list of top-N tickers,
+            "prices": dict ticker -> latest trade price used for scoring,
+            "scores": pd.DataFrame of historical scores (dates x symbols),
+            "ranks": pd.DataFrame of historical ranks
+        }
+    """
+    symbols = symbols or get_sector_universe(api)
+    top_n = top_n or sector_momentum_config["top_sectors_count"]
+
+    closes = get_close_matrix(api, symbols, days=sector_momentum_config["history_days"])
+    try:
+        prices = get_latest_trades(api, symbols)
+    except Exception as e:
+        print(f"Warning: Batched latest trades failed, scoring on last close: {e}")
+        prices = {}
+
+    if closes.empty:
+        return {"rankings": [], "top": [], "prices": prices, "scores": closes, "ranks": closes}
+
+    # Mark the latest row to the latest trade (live scoring uses the latest trade as "today")
+    for symbol, price in prices.items():
+        if symbol in closes.columns and price:
+            closes.iloc[-1, closes.columns.get_loc(symbol)] = price
+
+    scores = calculate_momentum_scores(closes)
+    ranks, _ = rank_momentum_scores(scores, top_n)
+
+    latest_scores = scores.iloc[-1].dropna()
+    rankings = [
+        (ticker, float(latest_scores[ticker]))
+        for ticker in symbols
+        if ticker in latest_scores.index
+    ]
+    rankings.sort(key=lambda x: x[1], reverse=True)
+
+    missing = [t for t in symbols if t not in latest_scores.index]
+    if missing:
+        print(f"Warning: Could not calculate momentum for {len(missing)} tickers: {', '.join(missing[:20])}")
+
+    return {
+        "rankings": rankings,
+        "top": [ticker for ticker, _ in rankings[:top_n]],
+        "prices": prices,
+        "scores": scores,
+        "ranks": ranks,
+    }
+
+
 def rank_sectors_by_momentum(api):
     """
     Rank all sector ETFs by their multi-period momentum scores.
-    
+
     Args:
         api: Alpaca API credentials
-    
+
     Returns:
         list: List of tuples (ticker, momentum_score) sorted by score descending
     """
     print("Calculating momentum scores for all sector ETFs...")
-    
-    sector_scores = []
-    sector_etfs = sector_momentum_config["sector_etfs"]
-    
-    for ticker in sector_etfs:
-        print(f"Calculating momentum for {ticker}...")
-        momentum_score = calculate_multi_period_momentum(api, ticker)
-        
-        if momentum_score is not None:
-            sector_scores.append((ticker, momentum_score))
-            print(f"{ticker}: {momentum_score:.4f} ({momentum_score:.2%})")
-        else:
-            print(f"Warning: Could not calculate momentum for {ticker}")
-    
-    # Sort by momentum score (descending)
-    sector_scores.sort(key=lambda x: x[1], reverse=True)
+
+    sector_scores = scan_momentum_universe(api)["rankings"]
     
     print("\nSector momentum rankings:")
     for i, (ticker, score) in enumerate(sector_scores, 1):
@@ -3198,24 +6244,14 @@ def get_sector_momentum_positions(api):
         api: Alpaca API credentials
     
     Returns:
-        dict: Dictionary with ticker -> shares held for sector ETFs only
+        dict: Dictionary with ticker -> shares held for the sector sleeve (universe + bond ETF)
     """
     try:
-        # Get all positions
-        positions = api.list_positions()
-        
-        # Filter for sector ETFs only
-        sector_positions = {}
-        sector_etfs = sector_momentum_config["sector_etfs"]
-        bond_etf = sector_momentum_config["bond_etf"]
-        
-        # Include both sector ETFs and bond ETF
-        allowed_tickers = sector_etfs + [bond_etf]
-        
-        for position in positions:
-            ticker = position.symbol
-            if ticker in allowed_tickers and float(position.qty) > 0:
-                sector_positions[ticker] = float(position.qty)
+        sector_positions = {
+            ticker: position["qty"]
+            for ticker, position in get_sleeve_positions(api, "sector_momentum").items()
+            if position["qty"] > 0
+        }
         
         print(f"Current sector momentum positions: {sector_positions}")
         return sector_positions
@@ -3225,19 +6261,25 @@ def get_sector_momentum_positions(api):
         return {}
 
 
-def get_sector_momentum_value(api):
+def get_sector_momentum_value(api, env="live"):
     """
     Calculate total value of sector momentum strategy positions.
     
+    Holdings are valued from the positions snapshot, so no per-ticker quote is fetched.
+    
     Args:
         api: Alpaca API credentials
+        env: Environment ("live" or "paper") - selects the balances collection
     
     Returns:
         dict: Dictionary with total_value, position_breakdown, and invested_amount
     """
     try:
-        # Get current positions
-        positions = get_sector_momentum_positions(api)
+        positions = {
+            ticker: position
+            for ticker, position in get_sleeve_positions(api, "sector_momentum").items()
+            if position["qty"] > 0
+        }
         
         if not positions:
             return {
@@ -3246,33 +6288,18 @@ def get_sector_momentum_value(api):
                 "invested_amount": 0
             }
         
-        # Calculate current value for each position
-        position_breakdown = {}
-        total_value = 0
-        
-        for ticker, shares in positions.items():
-            try:
-                current_price = float(get_latest_trade(api, ticker))
-                position_value = shares * current_price
-                position_breakdown[ticker] = {
-                    "shares": shares,
-                    "price": current_price,
-                    "value": position_value
-                }
-                total_value += position_value
-                
-            except Exception as e:
-                print(f"Error calculating value for {ticker}: {e}")
-                position_breakdown[ticker] = {
-                    "shares": shares,
-                    "price": 0,
-                    "value": 0
-                }
+        position_breakdown = {
+            ticker: {
+                "shares": position["qty"],
+                "price": position["price"],
+                "value": position["value"]
+            }
+            for ticker, position in positions.items()
+        }
+        total_value = sum(position["value"] for position in positions.values())
         
         # Get invested amount from Firestore
-        balances = load_balances()
-        sector_data = balances.get("sector_momentum", {})
-        invested_amount = sector_data.get("total_invested", 0)
+        invested_amount = get_balance("sector_momentum", env, ["total_invested"]).get("total_invested", 0)
         
         return {
             "total_value": total_value,
@@ -3289,7 +6316,7 @@ def get_sector_momentum_value(api):
         }
 
 
-def monthly_dual_momentum_strategy(api, force_execute=False, investment_calc=None, margin_result=None, skip_order_wait=False, env="live"):
+def monthly_dual_momentum_strategy(api, force_execute=False, investment_calc=None, margin_result=None, skip_order_wait=False, env="live", risk_decision=None):
     """
     Dual Momentum Strategy implementation with SPUU/EFO/BND.
     
@@ -3301,6 +6328,7 @@ def monthly_dual_momentum_strategy(api, force_execute=False, investment_calc=Non
         force_execute: Bypass trading day check for testing
         investment_calc: Pre-calculated investment amounts (from orchestrator) - optional
         margin_result: Pre-calculated margin conditions (from orchestrator) - optional
+        risk_decision: Pre-evaluated risk gate decision (from orchestrator) - optional
     
     Returns:
         str: Result message
@@ -3322,9 +6350,16 @@ def monthly_dual_momentum_strategy(api, force_execute=False, investment_calc=Non
     
     investment_amount = investment_calc["strategy_amounts"]["dual_momentum_allo"]
     
+    # Pre-trade risk gates: a rejected contribution is skipped, existing holdings are still managed
+    if risk_decision is None:
+        risk_decision = evaluate_risk_gates([("dual_momentum", investment_amount)], margin_result, investment_calc)["dual_momentum"]
+    if not risk_decision["accepted"]:
+        print(f"Dual Momentum: New contribution {risk_decision['reason'].lower()}")
+        send_telegram_message(f"Dual Momentum: New contribution {risk_decision['reason'].lower()}")
+        investment_amount = 0
+    
     # Load current strategy state from Firestore
-    balances = load_balances(env)
-    dual_momentum_data = balances.get("dual_momentum", {})
+    dual_momentum_data = get_balance("dual_momentum", env)
     total_invested = dual_momentum_data.get("total_invested", 0)
     current_position = dual_momentum_data.get("current_position", None)
     shares_held = dual_momentum_data.get("shares_held", 0)
@@ -3368,15 +6403,24 @@ def monthly_dual_momentum_strategy(api, force_execute=False, investment_calc=Non
     
     # Check if we need to switch positions
     position_changed = current_position != target_position
+    journal_decision(env, "dual_momentum",
+                     f"Switch {current_position} -> {target_position}" if position_changed else f"Hold {target_position}",
+                     target_position, investment_amount)
     
     if position_changed:
         print(f"Position change required: {current_position} -> {target_position}")
         
+        # Value the sleeve before selling: once the sell fills the position is gone from
+        # the account, so the sale proceeds must be carried over explicitly
+        current_value = get_dual_momentum_position_value(api)["total_value"]
+        
         # Sell current position if exists
         if current_position is not None and shares_held > 0:
             try:
-                sell_order = submit_order(api, current_position, shares_held, "sell")
-                wait_for_order_fill(api, sell_order["id"])
+                sell_order = submit_order(api, current_position, shares_held, "sell", sleeve="dual_momentum")
+                sell_proceeds = wait_for_order_fill(api, sell_order["id"])
+                if sell_proceeds:
+                    current_value = sell_proceeds
                 print(f"Sold {shares_held:.4f} shares of {current_position}")
                 send_telegram_message(f"Dual Momentum: Sold {shares_held:.4f} shares of {current_position}")
             except Exception as e:
@@ -3386,18 +6430,26 @@ def monthly_dual_momentum_strategy(api, force_execute=False, investment_calc=Non
                 return error_msg
         
         # Calculate total value to invest (existing + new)
-        current_value = get_dual_momentum_position_value(api)["total_value"]
         total_to_invest = current_value + investment_amount
         
         # Buy new position
         if total_to_invest > 0:
             try:
-                target_price = float(get_latest_trade(api, target_position))
-                shares_to_buy = total_to_invest / target_price
-                
-                buy_order = submit_order(api, target_position, shares_to_buy, "buy")
-                if not skip_order_wait:
-                    wait_for_order_fill(api, buy_order["id"])
+                purchase = buy_amount(api, target_position, total_to_invest, sleeve="dual_momentum", skip_order_wait=skip_order_wait)
+                if buy_canceled(purchase):
+                    message = f"Dual Momentum: {target_position} order for ${total_to_invest:.2f} was {purchase['order']['status']} - nothing bought, holding cash"
+                    print(message)
+                    send_telegram_message(message)
+                    # The old position (if any) is sold: record the sleeve as flat
+                    save_balance("dual_momentum", {
+                        "total_invested": total_invested,
+                        "current_position": None,
+                        "shares_held": 0,
+                        "last_trade_date": datetime.datetime.now().strftime("%Y-%m-%d"),
+                    }, env)
+                    return message
+                target_price = purchase["price"]
+                shares_to_buy = purchase["qty"]
                 
                 print(f"Bought {shares_to_buy:.4f} shares of {target_position}")
                 
@@ -3448,12 +6500,13 @@ def monthly_dual_momentum_strategy(api, force_execute=False, investment_calc=Non
         # No position change needed, just add to existing position
         if investment_amount > 0:
             try:
-                target_price = float(get_latest_trade(api, target_position))
-                additional_shares = investment_amount / target_price
-                
-                buy_order = submit_order(api, target_position, additional_shares, "buy")
-                if not skip_order_wait:
-                    wait_for_order_fill(api, buy_order["id"])
+                purchase = buy_amount(api, target_position, investment_amount, sleeve="dual_momentum", skip_order_wait=skip_order_wait)
+                if buy_canceled(purchase):
+                    message = f"Dual Momentum: {target_position} order for ${investment_amount:.2f} was {purchase['order']['status']} - nothing added"
+                    print(message)
+                    send_telegram_message(message)
+                    return message
+                additional_shares = purchase["qty"]
                 
                 new_total_shares = shares_held + additional_shares
                 new_total_invested = total_invested + investment_amount
@@ -3506,11 +6559,88 @@ def monthly_dual_momentum_strategy(api, force_execute=False, investment_calc=Non
     return result_msg
 
 
-def monthly_sector_momentum_strategy(api, force_execute=False, investment_calc=None, margin_result=None, skip_order_wait=False, env="live"):
+def execute_sector_rotation(api, current_positions, target_values, prices, skip_order_wait=False, min_trade_shares=0.01):
+    """
+    Move the sector sleeve from its current holdings to target dollar values in two waves.
+    
+    Share deltas for every ticker are computed in one vectorized step from the given
+    (ranking-time) prices. All exits and reductions are submitted concurrently and
+    awaited, then all entries and additions. New holdings are derived from the filled
+    quantities reported by Alpaca (the submitted quantities when skip_order_wait is set
+    or an order is still open after the wait times out).
+    
+    Args:
+        api: Alpaca API credentials
+        current_positions: dict ticker -> shares currently held by the sleeve
+        target_values: dict ticker -> target dollar value (tickers not listed are exited)
+        prices: dict ticker -> price used to size the orders
+        skip_order_wait: Submit without waiting for fills
+        min_trade_shares: Rebalance deltas below this are skipped (full exits always trade)
+    
+    Returns:
+        dict: {"positions": ticker -> shares after trading, "trades": list of (ticker, side, qty),
+               "errors": list of error messages}
+    """
+    tickers = list(dict.fromkeys(list(current_positions) + list(target_values)))
+    current = pd.Series(current_positions, index=tickers, dtype=float).fillna(0.0)
+    targets = pd.Series(target_values, index=tickers, dtype=float).fillna(0.0)
+    price_vector = pd.Series({ticker: prices.get(ticker) for ticker in tickers}, index=tickers, dtype=float)
+    
+    missing = targets[(targets > 0) & price_vector.isna()].index.tolist()
+    if missing:
+        return {"positions": current_positions, "trades": [], "errors": [f"No price for {', '.join(missing)}"]}
+    
+    target_shares = (targets / price_vector).where(targets > 0, 0.0)
+    deltas = target_shares - current
+    exits = deltas[(targets == 0) & (current > 0)]
+    reductions = deltas[(targets > 0) & (deltas < -min_trade_shares)]
+    sells = pd.concat([exits, reductions])
+    buys = deltas[(targets > 0) & (deltas > min_trade_shares)]
+    
+    positions = current.copy()
+    trades = []
+    errors = []
+    
+    def place(ticker, qty, side):
+        order = submit_order(api, ticker, qty, side, sleeve="sector_momentum")
+        if skip_order_wait:
+            return qty
+        final = wait_for_order(api, order["id"])
+        if final is None:
+            # Still open after the timeout: count the submitted quantity, like skip_order_wait;
+            # settle_sleeve_orders attributes the actual fill to the sleeve ledger later
+            return qty
+        return float(final.get("filled_qty") or 0)
+    
+    for side, wave in (("sell", sells), ("buy", buys)):
+        if wave.empty:
+            continue
+        with ThreadPoolExecutor(max_workers=min(8, len(wave))) as pool:
+            futures = {ticker: pool.submit(place, ticker, abs(float(delta)), side) for ticker, delta in wave.items()}
+        for ticker, future in futures.items():
+            try:
+                filled = future.result()
+            except Exception as e:
+                errors.append(f"Failed to {side} {ticker}: {e}")
+                continue
+            positions[ticker] += filled if side == "buy" else -filled
+            trades.append((ticker, side, filled))
+            print(f"{'Bought' if side == 'buy' else 'Sold'} {filled:.4f} shares of {ticker}")
+        if errors:
+            break  # Do not enter new positions when an exit failed
+    
+    return {
+        "positions": {ticker: float(qty) for ticker, qty in positions.items() if qty > 1e-9},
+        "trades": trades,
+        "errors": errors,
+    }
+
+
+def monthly_sector_momentum_strategy(api, force_execute=False, investment_calc=None, margin_result=None, skip_order_wait=False, env="live", risk_decision=None):
     """
     Sector Momentum Rotation Strategy implementation.
     
-    Invests in top 3 performing sector ETFs based on multi-period momentum,
+    Invests in the top N (default 3) sector ETFs of the configured universe based on multi-period momentum,
     with SPY 200-SMA trend filtering. Switches to SCHZ bonds when SPY < 200-SMA.
     
     Args:
@@ -3518,6 +6648,7 @@ def monthly_sector_momentum_strategy(api, force_execute=False, investment_calc=N
         force_execute: Bypass trading day check for testing
         investment_calc: Pre-calculated investment amounts (from orchestrator) - optional
         margin_result: Pre-calculated margin conditions (from orchestrator) - optional
+        risk_decision: Pre-evaluated risk gate decision (from orchestrator) - optional
     
     Returns:
         str: Result message
@@ -3539,9 +6670,16 @@ def monthly_sector_momentum_strategy(api, force_execute=False, investment_calc=N
     
     investment_amount = investment_calc["strategy_amounts"]["sector_momentum_allo"]
     
+    # Pre-trade risk gates: a rejected contribution is skipped, existing holdings are still managed
+    if risk_decision is None:
+        risk_decision = evaluate_risk_gates([("sector_momentum", investment_amount)], margin_result, investment_calc)["sector_momentum"]
+    if not risk_decision["accepted"]:
+        print(f"Sector Momentum: New contribution {risk_decision['reason'].lower()}")
+        send_telegram_message(f"Sector Momentum: New contribution {risk_decision['reason'].lower()}")
+        investment_amount = 0
+    
     # Load current strategy state from Firestore
-    balances = load_balances(env)
-    sector_data = balances.get("sector_momentum", {})
+    sector_data = get_balance("sector_momentum", env)
     total_invested = sector_data.get("total_invested", 0)
     current_positions = sector_data.get("current_positions", {})
     
@@ -3552,22 +6690,11 @@ def monthly_sector_momentum_strategy(api, force_execute=False, investment_calc=N
     # Check SPY 200-SMA trend filter using cached market data
     print("Checking SPY 200-SMA trend filter...")
     try:
-        # Get all SPY market data at once (efficient single fetch/read)
-        spy_data = get_all_market_data("SPY")
-        if spy_data is None:
-            spy_data = update_market_data("SPY")
-        
-        spy_price = spy_data["price"]
-        spy_sma = spy_data["sma200"]
-        
-        if spy_sma is None:
-            error_msg = "Failed to get SPY SMA - skipping strategy"
-            print(error_msg)
-            send_telegram_message(f"Sector Momentum Error: {error_msg}")
-            return error_msg
-        
-        # Use 1% margin band for consistent trend filtering with SPXL strategy
-        spy_above_sma_current = spy_price > spy_sma * (1 + margin)
+        # Same 1% band state as the SPXL strategy (SMA state store)
+        spy_state = get_sma_state("SPY", 200, margin * 100)
+        spy_price = spy_state["price"]
+        spy_sma = spy_state["sma"]
+        spy_above_sma_current = spy_state["state"] == "above"
         print(f"SPY: ${spy_price:.2f}, 200-SMA: ${spy_sma:.2f}, Margin: {margin:.1%}, Above SMA: {spy_above_sma_current}")
         
     except Exception as e:
@@ -3577,7 +6704,7 @@ def monthly_sector_momentum_strategy(api, force_execute=False, investment_calc=N
         return error_msg
     
     # Calculate current strategy value
-    current_value_data = get_sector_momentum_value(api)
+    current_value_data = get_sector_momentum_value(api, env)
     current_value = current_value_data["total_value"]
     total_to_allocate = current_value + investment_amount
     
@@ -3585,91 +6712,60 @@ def monthly_sector_momentum_strategy(api, force_execute=False, investment_calc=N
     print(f"Total to allocate: ${total_to_allocate:.2f}")
     
     trades_executed = []
+    top_n = sector_momentum_config["top_sectors_count"]
+    target_weight = get_sector_target_weight()
     
     if spy_above_sma_current:
-        # Sector Mode: Invest in top 3 sectors
+        # Sector Mode: Invest in top N sectors
         print("SPY above 200-SMA: Proceeding with sector selection")
         
-        # Rank sectors by momentum
-        sector_rankings = rank_sectors_by_momentum(api)
+        # Rank sectors by momentum; the scan's latest trades also price the orders below
+        print("Calculating momentum scores for all sector ETFs...")
+        scan = scan_momentum_universe(api)
+        sector_rankings = scan["rankings"]
+        prices = scan["prices"]
+        print("\nSector momentum rankings:")
+        for i, (ticker, score) in enumerate(sector_rankings, 1):
+            print(f"{i:2d}. {ticker}: {score:.4f} ({score:.2%})")
         
-        if len(sector_rankings) < 3:
+        if len(sector_rankings) < top_n:
             error_msg = "Not enough sectors with valid momentum data"
             print(error_msg)
             send_telegram_message(f"Sector Momentum Error: {error_msg}")
             return error_msg
         
-        # Select top 3 sectors
-        top_3_sectors = [ticker for ticker, score in sector_rankings[:3]]
-        print(f"Top 3 sectors: {top_3_sectors}")
-        
-        # Calculate target allocation per sector (33.33% each)
-        target_allocation_per_sector = total_to_allocate * sector_momentum_config["target_allocation_per_sector"]
-        
-        # Sell sectors not in top 3
-        current_positions_list = list(current_positions.keys())
-        sectors_to_sell = [ticker for ticker in current_positions_list if ticker not in top_3_sectors]
-        
-        for ticker in sectors_to_sell:
-            shares_to_sell = current_positions[ticker]
-            if shares_to_sell > 0:
-                try:
-                    sell_order = submit_order(api, ticker, shares_to_sell, "sell")
-                    if not skip_order_wait:
-                        wait_for_order_fill(api, sell_order["id"])
-                    trades_executed.append(f"Sold {shares_to_sell:.4f} shares of {ticker} (dropped from top 3)")
-                    print(f"Sold {shares_to_sell:.4f} shares of {ticker}")
-                except Exception as e:
-                    error_msg = f"Failed to sell {ticker}: {e}"
-                    print(error_msg)
-                    send_telegram_message(f"Sector Momentum Error: {error_msg}")
-                    return error_msg
-        
-        # Rebalance to target allocations for top 3 sectors
-        for ticker in top_3_sectors:
-            try:
-                current_price = float(get_latest_trade(api, ticker))
-                current_shares = current_positions.get(ticker, 0)
-                
-                # Calculate target shares
-                target_shares = target_allocation_per_sector / current_price
-                shares_delta = target_shares - current_shares
-                
-                if abs(shares_delta) > 0.01:  # Only trade if difference is meaningful
-                    if shares_delta > 0:
-                        # Buy more shares
-                        buy_order = submit_order(api, ticker, shares_delta, "buy")
-                        if not skip_order_wait:
-                            wait_for_order_fill(api, buy_order["id"])
-                        trades_executed.append(f"Bought {shares_delta:.4f} shares of {ticker} (rebalancing to 33.33%)")
-                        print(f"Bought {shares_delta:.4f} shares of {ticker}")
-                    else:
-                        # Sell shares
-                        sell_order = submit_order(api, ticker, abs(shares_delta), "sell")
-                        if not skip_order_wait:
-                            wait_for_order_fill(api, sell_order["id"])
-                        trades_executed.append(f"Sold {abs(shares_delta):.4f} shares of {ticker} (rebalancing to 33.33%)")
-                        print(f"Sold {abs(shares_delta):.4f} shares of {ticker}")
-                
-            except Exception as e:
-                error_msg = f"Failed to rebalance {ticker}: {e}"
-                print(error_msg)
-                send_telegram_message(f"Sector Momentum Error: {error_msg}")
-                return error_msg
-        
-        # Update Firestore with sector positions
-        new_positions = {}
-        for ticker in top_3_sectors:
-            try:
-                current_price = float(get_latest_trade(api, ticker))
-                target_shares = target_allocation_per_sector / current_price
-                new_positions[ticker] = target_shares
-            except Exception as e:
-                print(f"Error updating position for {ticker}: {e}")
+        # Select top N sectors
+        top_3_sectors = [ticker for ticker, score in sector_rankings[:top_n]]
+        print(f"Top {top_n} sectors: {top_3_sectors}")
+        journal_decision(env, "sector_momentum", f"Sector mode: {','.join(top_3_sectors)}", amount=investment_amount)
+        
+        # Calculate target allocation per sector (equal weight, 33.33% each for top 3)
+        target_allocation_per_sector = total_to_allocate * target_weight
+        
+        unpriced = [ticker for ticker in top_3_sectors if not prices.get(ticker)]
+        if unpriced:
+            prices.update(get_latest_trades(api, unpriced))
+        
+        # Exits and reductions first, then entries, each wave submitted concurrently
+        rotation = execute_sector_rotation(
+            api, current_positions, {ticker: target_allocation_per_sector for ticker in top_3_sectors},
+            prices, skip_order_wait)
+        for ticker, side, qty in rotation["trades"]:
+            if side == "sell" and ticker not in top_3_sectors:
+                trades_executed.append(f"Sold {qty:.4f} shares of {ticker} (dropped from top {top_n})")
+            elif side == "sell":
+                trades_executed.append(f"Sold {qty:.4f} shares of {ticker} (rebalancing to {target_weight:.2%})")
+            else:
+                trades_executed.append(f"Bought {qty:.4f} shares of {ticker} (rebalancing to {target_weight:.2%})")
+        if rotation["errors"]:
+            error_msg = "; ".join(rotation["errors"])
+            print(error_msg)
+            send_telegram_message(f"Sector Momentum Error: {error_msg}")
+            return error_msg
         
         save_balance("sector_momentum", {
             "total_invested": total_invested + investment_amount,
-            "current_positions": new_positions,
+            "current_positions": rotation["positions"],
             "last_trade_date": datetime.datetime.now().strftime("%Y-%m-%d"),
             "top_3_sectors": top_3_sectors,
             "spy_above_sma": True,
@@ -3681,53 +6777,42 @@ def monthly_sector_momentum_strategy(api, force_execute=False, investment_calc=N
         print("SPY below 200-SMA: Switching to bond mode (SCHZ)")
         
         bond_etf = sector_momentum_config["bond_etf"]
+        journal_decision(env, "sector_momentum", "Bond mode: SPY below 200-SMA", bond_etf, investment_amount)
         
-        # Sell all sector positions
-        for ticker, shares in current_positions.items():
-            if shares > 0:
-                try:
-                    sell_order = submit_order(api, ticker, shares, "sell")
-                    if not skip_order_wait:
-                        wait_for_order_fill(api, sell_order["id"])
-                    trades_executed.append(f"Sold {shares:.4f} shares of {ticker}")
-                    print(f"Sold {shares:.4f} shares of {ticker}")
-                except Exception as e:
-                    error_msg = f"Failed to sell {ticker}: {e}"
-                    print(error_msg)
-                    send_telegram_message(f"Sector Momentum Error: {error_msg}")
-                    return error_msg
+        target_values = {bond_etf: total_to_allocate} if total_to_allocate > 0 else {}
+        try:
+            prices = get_latest_trades(api, [bond_etf]) if target_values else {}
+        except Exception as e:
+            error_msg = f"Failed to buy {bond_etf}: {e}"
+            print(error_msg)
+            send_telegram_message(f"Sector Momentum Error: {error_msg}")
+            return error_msg
         
-        # Invest all in SCHZ
-        if total_to_allocate > 0:
-            try:
-                schz_price = float(get_latest_trade(api, bond_etf))
-                schz_shares = total_to_allocate / schz_price
-                
-                buy_order = submit_order(api, bond_etf, schz_shares, "buy")
-                if not skip_order_wait:
-                    wait_for_order_fill(api, buy_order["id"])
-                
-                trades_executed.append(f"Bought {schz_shares:.4f} shares of {bond_etf} (bear market protection)")
-                print(f"Bought {schz_shares:.4f} shares of {bond_etf}")
-                
-                # Update Firestore
-                save_balance("sector_momentum", {
-                    "total_invested": total_invested + investment_amount,
-                    "current_positions": {bond_etf: schz_shares},
-                    "last_trade_date": datetime.datetime.now().strftime("%Y-%m-%d"),
-                    "top_3_sectors": [],
-                    "spy_above_sma": False,
-                    "last_momentum_scores": {}
-                }, env)
-                
-            except Exception as e:
-                error_msg = f"Failed to buy {bond_etf}: {e}"
-                print(error_msg)
-                send_telegram_message(f"Sector Momentum Error: {error_msg}")
-                return error_msg
+        # Sell all sector positions, then invest all in SCHZ
+        rotation = execute_sector_rotation(api, current_positions, target_values, prices, skip_order_wait)
+        for ticker, side, qty in rotation["trades"]:
+            if side == "buy":
+                trades_executed.append(f"Bought {qty:.4f} shares of {ticker} (bear market protection)")
+            else:
+                trades_executed.append(f"Sold {qty:.4f} shares of {ticker}")
+        if rotation["errors"]:
+            error_msg = "; ".join(rotation["errors"])
+            print(error_msg)
+            send_telegram_message(f"Sector Momentum Error: {error_msg}")
+            return error_msg
+        
+        if target_values:
+            save_balance("sector_momentum", {
+                "total_invested": total_invested + investment_amount,
+                "current_positions": rotation["positions"],
+                "last_trade_date": datetime.datetime.now().strftime("%Y-%m-%d"),
+                "top_3_sectors": [],
+                "spy_above_sma": False,
+                "last_momentum_scores": {}
+            }, env)
     
     # Calculate and report strategy performance
-    final_value_data = get_sector_momentum_value(api)
+    final_value_data = get_sector_momentum_value(api, env)
     final_total_invested = total_invested + investment_amount
     strategy_return = (final_value_data["total_value"] / final_total_invested - 1) if final_total_invested > 0 else 0
     
@@ -3751,8 +6836,8 @@ def monthly_sector_momentum_strategy(api, force_execute=False, investment_calc=N
             telegram_msg += f"  {i}. {ticker} ({sector_name}): {score:.2%}\n"
         telegram_msg += f"\n🎯 Selection Logic:\n"
         top_3_with_names = [f"{ticker} ({sector_momentum_config['sector_names'].get(ticker, ticker)})" for ticker in top_3_sectors]
-        telegram_msg += f"• Top 3 sectors selected: {', '.join(top_3_with_names)}\n"
-        telegram_msg += f"• Allocation: 33.33% each\n"
+        telegram_msg += f"• Top {top_n} sectors selected: {', '.join(top_3_with_names)}\n"
+        telegram_msg += f"• Allocation: {target_weight:.2%} each\n"
         telegram_msg += f"• Investment per sector: ${target_allocation_per_sector:.2f}\n\n"
     else:
         telegram_msg += f"🔒 Bond Mode Activated:\n"
@@ -3780,24 +6865,40 @@ def monthly_sector_momentum_strategy(api, force_execute=False, investment_calc=N
 
 # Helper function to wait for an order to be filled
 def wait_for_order_fill(api, order_id, timeout=300, poll_interval=5):
+    order = wait_for_order(api, order_id, timeout, poll_interval)
+    if order and order["status"] == "filled":
+        return float(order["filled_avg_price"]) * float(order["filled_qty"])
+
+
+def wait_for_order(api, order_id, timeout=300, poll_interval=5, notify_timeout=True):
+    """
+    Wait for an order to reach a terminal status (filled, canceled, expired or rejected)
+    and record its fill.
+    
+    Returns:
+        dict: The final order, or None on timeout
+    """
     elapsed_time = 0
     while elapsed_time < timeout:
         order = get_order(api, order_id)
         if order["status"] == "filled":
             print(f"Order {order_id} filled.")
-            return float(order["filled_avg_price"]) * float(order["filled_qty"])
-        elif order["status"] == "canceled":
-            print(f"Order {order_id} was canceled.")
-            send_telegram_message(f"Order {order_id} was canceled.")
-            return
+            record_order_fill(api, order)
+            return order
+        elif order["status"] in TERMINAL_ORDER_STATUSES:
+            print(f"Order {order_id} was {order['status']}.")
+            record_order_fill(api, order)
+            send_telegram_message(f"Order {order_id} was {order['status']}.")
+            return order
         else:
             print(f"Waiting for order {order_id} to fill... (status: {order['status']})")
             time.sleep(poll_interval)
             elapsed_time += poll_interval
     print(f"Timeout: Order {order_id} did not fill within {timeout} seconds.")
-    send_telegram_message(
-        f"Timeout: Order {order_id} did not fill within {timeout} seconds."
-    )
+    if notify_timeout:
+        send_telegram_message(
+            f"Timeout: Order {order_id} did not fill within {timeout} seconds."
+        )
 
 
 def monthly_invest_all_strategies(api, force_execute=False, skip_order_wait=False, env="live"):
@@ -3822,8 +6923,17 @@ def monthly_invest_all_strategies(api, force_execute=False, skip_order_wait=Fals
     print("=== Monthly Investment Orchestrator ===")
     print("Calculating budgets for all strategies...")
     
-    margin_result = check_margin_conditions(api)
-    investment_calc = calculate_monthly_investments(api, margin_result, env)
+    # One snapshots request prices every strategy in this run
+    try:
+        with TraceSpan("stage", "prefetch_snapshots"):
+            run_symbols = [symbol for sleeve in strategy_sleeves for symbol in get_sleeve_symbols(sleeve)]
+            prefetch_snapshots(api, run_symbols + ["SPY", "EFA"])
+    except Exception as e:
+        print(f"Warning: Snapshot prefetch failed, strategies will fetch prices individually: {e}")
+    
+    with TraceSpan("stage", "budgets"):
+        margin_result = check_margin_conditions(api)
+        investment_calc = calculate_monthly_investments(api, margin_result, env)
     
     print(f"Total investing power: ${investment_calc['total_investing']:.2f}")
     print(f"  HFEA (18.75%): ${investment_calc['strategy_amounts']['hfea_allo']:.2f}")
@@ -3833,44 +6943,276 @@ def monthly_invest_all_strategies(api, force_execute=False, skip_order_wait=Fals
     print(f"  Dual Momentum (10%): ${investment_calc['strategy_amounts']['dual_momentum_allo']:.2f}")
     print(f"  Sector Momentum (10%): ${investment_calc['strategy_amounts']['sector_momentum_allo']:.2f}")
     
+    # Evaluate every strategy's buy against one running projected account state (execution order).
+    # SPXL only buys in a bullish trend, so it proposes nothing otherwise.
+    amounts = investment_calc["strategy_amounts"]
+    with TraceSpan("stage", "risk_gates"):
+        spxl_bullish = get_sma_state("SPY", 200, margin * 100)["state"] == "above"
+        proposals = [("hfea", amounts["hfea_allo"]), ("golden_hfea_lite", amounts["golden_hfea_lite_allo"])]
+        if spxl_bullish:
+            proposals.append(("SPXL_SMA", amounts["spxl_allo"]))
+        proposals += [
+            ("nine_sig", amounts["nine_sig_allo"]),
+            ("dual_momentum", amounts["dual_momentum_allo"]),
+            ("sector_momentum", amounts["sector_momentum_allo"]),
+        ]
+        risk_decisions = evaluate_risk_gates(proposals, margin_result, investment_calc)
+    
     # Run all five strategies with pre-calculated budgets
     results = {}
     
     print("\n=== Executing HFEA ===")
-    results["hfea"] = make_monthly_buys(api, force_execute, investment_calc, margin_result, skip_order_wait, env)
+    with TraceSpan("stage", "hfea"):
+        results["hfea"] = make_monthly_buys(api, force_execute, investment_calc, margin_result, skip_order_wait, env, risk_decisions["hfea"])
     
     print("\n=== Executing Golden HFEA Lite ===")
-    results["golden_hfea_lite"] = make_monthly_buys_golden_hfea_lite(api, force_execute, investment_calc, margin_result, skip_order_wait, env)
+    with TraceSpan("stage", "golden_hfea_lite"):
+        results["golden_hfea_lite"] = make_monthly_buys_golden_hfea_lite(api, force_execute, investment_calc, margin_result, skip_order_wait, env, risk_decisions["golden_hfea_lite"])
     
     print("\n=== Executing SPXL SMA ===")
-    results["spxl"] = monthly_buying_sma(api, "SPXL", force_execute, investment_calc, margin_result, skip_order_wait, env)
+    with TraceSpan("stage", "spxl"):
+        results["spxl"] = monthly_buying_sma(api, "SPXL", force_execute, investment_calc, margin_result, skip_order_wait, env, risk_decisions.get("SPXL_SMA"))
     
     print("\n=== Executing 9-Sig ===")
-    results["nine_sig"] = make_monthly_nine_sig_contributions(api, force_execute, investment_calc, margin_result, skip_order_wait, env)
+    with TraceSpan("stage", "nine_sig"):
+        results["nine_sig"] = make_monthly_nine_sig_contributions(api, force_execute, investment_calc, margin_result, skip_order_wait, env, risk_decisions["nine_sig"])
     
     print("\n=== Executing Dual Momentum ===")
-    results["dual_momentum"] = monthly_dual_momentum_strategy(api, force_execute, investment_calc, margin_result, skip_order_wait, env)
+    with TraceSpan("stage", "dual_momentum"):
+        results["dual_momentum"] = monthly_dual_momentum_strategy(api, force_execute, investment_calc, margin_result, skip_order_wait, env, risk_decisions["dual_momentum"])
     
     print("\n=== Executing Sector Momentum ===")
-    results["sector_momentum"] = monthly_sector_momentum_strategy(api, force_execute, investment_calc, margin_result, skip_order_wait, env)
+    with TraceSpan("stage", "sector_momentum"):
+        results["sector_momentum"] = monthly_sector_momentum_strategy(api, force_execute, investment_calc, margin_result, skip_order_wait, env, risk_decisions["sector_momentum"])
+    
+    # Attribute fills of orders that were not waited on to their sleeves
+    with TraceSpan("stage", "settle_sleeve_orders"):
+        settle_sleeve_orders(api)
     
     print("\n=== All Monthly Strategies Complete ===")
     
     return results
 
 
+# On-demand profiling of one invocation, requested with an X-Profile header, a ?profile= parameter
+# or run_local --profile. Value: "cprofile" (deterministic), "sampling" (stack sampler only) or
+# "1"/"true" for the default mode. Nothing is imported or started unless a profile is requested.
+# Request-driven profiles (header or parameter) are only honored with PROFILE_ALLOWED=true or an
+# X-Profile-Secret header matching PROFILE_SECRET; run_local --profile is always honored.
+profile_config = {
+    "mode": "cprofile",
+    "allowed": os.getenv("PROFILE_ALLOWED", "").lower() in ("1", "true", "yes"),
+    "secret": os.getenv("PROFILE_SECRET"),  # Shared secret for the X-Profile-Secret header
+    "directory": os.getenv("PROFILE_DIR"),  # Defaults to /tmp/profiles in the cloud, profiles/ locally
+    "bucket": os.getenv("PROFILE_BUCKET"),  # Also upload to gs://{bucket}/profiles/... (needs google-cloud-storage)
+    "sample_interval": 0.005,  # Seconds between stack samples
+    "trace_memory": True,  # tracemalloc peak and top allocation sites (slows the run down)
+    "top": 25,  # Functions, stacks and allocation sites listed in the summary
+}
+PROFILE_MODES = ("cprofile", "sampling")
+
+
+def requested_profile_mode(args, kwargs):
+    """
+    Profile mode requested for an entry point call, or None.
+
+    Args:
+        args, kwargs: Arguments of the entry point (a Flask request, or run_local's profile=...)
+
+    Returns:
+        str or None: One of PROFILE_MODES (None for requests not allowed to profile)
+    """
+    mode = kwargs.get("profile")
+    request = args[0] if args else kwargs.get("request")
+    if mode is None and getattr(request, "headers", None) is not None:
+        mode = request.headers.get("X-Profile") or request.args.get("profile")
+    if not mode or str(mode).lower() in ("0", "false", "off"):
+        return None
+    if kwargs.get("profile") is None and not _profile_request_allowed(request):
+        print("Warning: Profile requested but not allowed (set PROFILE_ALLOWED or send X-Profile-Secret), ignoring")
+        return None
+    mode = str(mode).lower()
+    if mode not in PROFILE_MODES:
+        if mode not in ("1", "true", "on"):
+            print(f"Warning: Unknown profile mode '{mode}', using {profile_config['mode']}")
+        mode = profile_config["mode"]
+    return mode
+
+
+def _profile_request_allowed(request):
+    """Whether a request may ask for a profile: PROFILE_ALLOWED is set or the X-Profile-Secret header matches PROFILE_SECRET."""
+    if profile_config["allowed"]:
+        return True
+    secret = profile_config["secret"]
+    supplied = request.headers.get("X-Profile-Secret")
+    return bool(secret and supplied) and hmac.compare_digest(secret.encode(), supplied.encode())
+
+
+def _sample_stacks(stop, interval, stacks):
+    """Count the stack of every other thread each interval, as collapsed "outer;...;inner" strings."""
+    import sys
+    own = threading.get_ident()
+    while not stop.wait(interval):
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            key = ";".join(reversed(names))
+            stacks[key] = stacks.get(key, 0) + 1
+
+
+def _upload_profile(directory, files):
+    from google.cloud import storage  # google-cloud-storage, only needed to upload profiles
+    bucket = storage.Client().bucket(profile_config["bucket"])
+    prefix = f"profiles/{os.path.basename(directory)}"
+    for name in files:
+        bucket.blob(f"{prefix}/{name}").upload_from_filename(os.path.join(directory, name))
+    return f"gs://{profile_config['bucket']}/{prefix}/"
+
+
+def run_profiled(handler, mode, args, kwargs):
+    """
+    Run an entry point handler under a profiler and write the profile.
+
+    Every mode samples the stacks of all threads (collapsed-stack format, e.g. for flamegraph.pl
+    or speedscope) and measures wall and CPU time; "cprofile" also records a deterministic profile
+    of the handler thread (profile.prof, readable with pstats or snakeviz). With trace_memory,
+    tracemalloc reports the allocation peak and the top allocation sites.
+
+    Files (summary.json, stacks.txt, profile.prof) go to {directory}/{handler}-{timestamp}/ and,
+    when a bucket is configured, to object storage. A failure to write the profile is printed,
+    never raised.
+
+    Returns:
+        The handler's return value
+    """
+    import cProfile
+    import pstats
+    import tracemalloc
+
+    stacks = {}
+    stop = threading.Event()
+    sampler = threading.Thread(target=_sample_stacks, args=(stop, profile_config["sample_interval"], stacks), daemon=True)
+    profiler = cProfile.Profile() if mode == "cprofile" else None
+    trace_memory = profile_config["trace_memory"] and not tracemalloc.is_tracing()
+    if trace_memory:
+        tracemalloc.start()
+    started_at = datetime.datetime.utcnow()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    sampler.start()
+    if profiler:
+        profiler.enable()
+    try:
+        return handler(*args, **kwargs)
+    finally:
+        if profiler:
+            profiler.disable()
+        stop.set()
+        sampler.join()
+        summary = {
+            "invocation": handler.__name__,
+            "mode": mode,
+            "started": started_at.isoformat() + "Z",
+            "wall_seconds": round(time.perf_counter() - wall, 6),
+            "cpu_seconds": round(time.process_time() - cpu, 6),
+            "samples": sum(stacks.values()),
+        }
+        if trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            sites = tracemalloc.take_snapshot().statistics("lineno")[:profile_config["top"]]
+            tracemalloc.stop()
+            summary["memory"] = {
+                "peak_bytes": peak,
+                "current_bytes": current,
+                "top": [{"site": str(stat.traceback), "bytes": stat.size, "count": stat.count} for stat in sites],
+            }
+        try:
+            directory = os.path.join(
+                profile_config["directory"] or ("/tmp/profiles" if is_running_in_cloud() else "profiles"),
+                f"{handler.__name__}-{started_at.strftime('%Y%m%dT%H%M%S-%f')}",
+            )
+            os.makedirs(directory, exist_ok=True)
+            files = ["summary.json", "stacks.txt"]
+            top_stacks = sorted(stacks.items(), key=lambda item: -item[1])
+            with open(os.path.join(directory, "stacks.txt"), "w") as f:
+                f.writelines(f"{stack} {count}\n" for stack, count in top_stacks)
+            summary["top_stacks"] = [
+                {"stack": stack.rsplit(";", 3)[-3:], "samples": count} for stack, count in top_stacks[:profile_config["top"]]
+            ]
+            if profiler:
+                profiler.dump_stats(os.path.join(directory, "profile.prof"))
+                files.append("profile.prof")
+                stats = pstats.Stats(profiler)
+                rows = sorted(stats.stats.items(), key=lambda item: -item[1][3])[:profile_config["top"]]
+                summary["top_functions"] = [
+                    {"function": f"{name} ({os.path.basename(filename)}:{line})", "calls": calls,
+                     "self_seconds": round(self_time, 6), "cumulative_seconds": round(cumulative, 6)}
+                    for (filename, line, name), (_, calls, self_time, cumulative, _) in rows
+                ]
+            with open(os.path.join(directory, "summary.json"), "w") as f:
+                json.dump(summary, f, indent=2)
+            location = directory
+            if profile_config["bucket"]:
+                location = _upload_profile(directory, files)
+            print(json.dumps({"profile": {
+                "location": location, "mode": mode, "wall_seconds": summary["wall_seconds"],
+                "cpu_seconds": summary["cpu_seconds"], "peak_bytes": summary.get("memory", {}).get("peak_bytes"),
+            }}))
+        except Exception as e:
+            print(f"Warning: Could not write profile for {handler.__name__}: {e}")
+
+
+def entry_point(handler):
+    """
+    Wrap an entry point with per-run setup and teardown: refuse offline market data on the
+    live state (see check_offline_market_data), reset the per-run caches (warm instances
+    keep module state), settle sleeve orders still open (see
+    settle_open_sleeve_orders), flush the trade journal when the run ends and print
+    the trace report as one JSON line. The handler runs under run_profiled when a
+    profile is requested (see requested_profile_mode).
+    """
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
+        check_offline_market_data()
+        reset_run_caches()
+        start_trace(handler.__name__)
+        profile_mode = requested_profile_mode(args, kwargs)
+        try:
+            if profile_mode:
+                return run_profiled(handler, profile_mode, args, kwargs)
+            return handler(*args, **kwargs)
+        finally:
+            with TraceSpan("stage", "settle_open_sleeve_orders"):
+                settle_open_sleeve_orders()
+            with TraceSpan("stage", "flush_journal"):
+                flush_journal()
+            if trace_config["enabled"] and trace_config["log_report"]:
+                print(json.dumps({"trace": trace_report()}))
+    return wrapper
+
+
 @app.route("/monthly_invest_all", methods=["POST"])
+@entry_point
 def monthly_invest_all(request):
     """
     Orchestrator endpoint that runs all three monthly strategies in one coordinated execution.
     Recommended for production use to ensure exact budget splits and avoid over-spending.
+    With ?trace=1 the trace report of the run is included in the response under "trace".
     """
     api = set_alpaca_environment(env=alpaca_environment)
     results = monthly_invest_all_strategies(api)
+    if request.args.get("trace") in ("1", "true"):
+        results["trace"] = trace_report()
     return jsonify(results), 200
 
 
 @app.route("/monthly_buy_hfea", methods=["POST"])
+@entry_point
 def monthly_buy_hfea(request):
     api = set_alpaca_environment(
         env=alpaca_environment
@@ -3879,6 +7221,7 @@ def monthly_buy_hfea(request):
 
 
 @app.route("/rebalance_hfea", methods=["POST"])
+@entry_point
 def rebalance_hfea(request):
     api = set_alpaca_environment(
         env=alpaca_environment
@@ -3887,30 +7230,35 @@ def rebalance_hfea(request):
 
 
 @app.route("/monthly_buy_golden_hfea_lite", methods=["POST"])
+@entry_point
 def monthly_buy_golden_hfea_lite(request):
     api = set_alpaca_environment(env=alpaca_environment)
     return make_monthly_buys_golden_hfea_lite(api)
 
 
 @app.route("/rebalance_golden_hfea_lite", methods=["POST"])
+@entry_point
 def rebalance_golden_hfea_lite(request):
     api = set_alpaca_environment(env=alpaca_environment)
     return rebalance_golden_hfea_lite_portfolio(api)
 
 
 @app.route("/monthly_nine_sig_contributions", methods=["POST"])
+@entry_point
 def monthly_nine_sig_contributions(request):
     api = set_alpaca_environment(env=alpaca_environment)
     return make_monthly_nine_sig_contributions(api)
 
 
 @app.route("/quarterly_nine_sig_signal", methods=["POST"])
+@entry_point
 def quarterly_nine_sig_signal(request):
     api = set_alpaca_environment(env=alpaca_environment)
     return execute_quarterly_nine_sig_signal(api)
 
 
 @app.route("/monthly_buy_spxl", methods=["POST"])
+@entry_point
 def monthly_buy_spxl(request):
     api = set_alpaca_environment(
         env=alpaca_environment
@@ -3921,6 +7269,7 @@ def monthly_buy_spxl(request):
 
 
 @app.route("/daily_trade_spxl_200sma", methods=["POST"])
+@entry_point
 def daily_trade_spxl_200sma(request):
     api = set_alpaca_environment(
         env=alpaca_environment
@@ -3931,6 +7280,7 @@ def daily_trade_spxl_200sma(request):
 
 
 @app.route("/monthly_dual_momentum", methods=["POST"])
+@entry_point
 def monthly_dual_momentum(request):
     """
     Cloud Function endpoint for Dual Momentum Strategy.
@@ -3948,10 +7298,11 @@ def monthly_dual_momentum(request):
 
 
 @app.route("/monthly_sector_momentum", methods=["POST"])
+@entry_point
 def monthly_sector_momentum(request):
     """
     Cloud Function endpoint for Sector Momentum Strategy.
-    Executes monthly sector momentum rotation strategy with top 3 sector ETFs.
+    Executes monthly sector momentum rotation strategy with the top N sector ETFs.
     """
     try:
         api = set_alpaca_environment(env=alpaca_environment)
@@ -3965,6 +7316,7 @@ def monthly_sector_momentum(request):
 
 
 @app.route("/index_alert", methods=["POST"])
+@entry_point
 def index_alert(request):
     return check_unified_index_alert(request)
 
@@ -3985,7 +7337,8 @@ def index_alert(request):
 #     return buy_tqqq_if_above_200sma(api)
 
 
-def run_local(action, env="paper", request="test", force_execute=False):
+@entry_point
+def run_local(action, env="paper", request="test", force_execute=False, feed=None, profile=None):
     api = set_alpaca_environment(env=env, use_secret_manager=False)
     if action == "monthly_invest_all":
         return monthly_invest_all_strategies(api, force_execute=force_execute, skip_order_wait=True, env=env)
@@ -4010,9 +7363,17 @@ def run_local(action, env="paper", request="test", force_execute=False):
     elif action == "index_alert":
         return check_unified_index_alert(request)
     elif action == "monthly_dual_momentum":
-        return monthly_dual_momentum_strategy(api, force_execute=force_execute, skip_order_wait=True, env=env)
+        result = monthly_dual_momentum_strategy(api, force_execute=force_execute, skip_order_wait=True, env=env)
+        settle_sleeve_orders(api)
+        return result
     elif action == "monthly_sector_momentum":
-        return monthly_sector_momentum_strategy(api, force_execute=force_execute, skip_order_wait=True, env=env)
+        result = monthly_sector_momentum_strategy(api, force_execute=force_execute, skip_order_wait=True, env=env)
+        settle_sleeve_orders(api)
+        return result
+    elif action == "sma_monitor":
+        return run_sma_monitor(api, feed=feed)
+    elif action == "export_market_data":
+        return export_market_data(api)
     else:
         return "No valid action provided."
 
@@ -4036,7 +7397,9 @@ if __name__ == "__main__":
             "buy_spxl_above_200sma",
             "index_alert",
             "monthly_dual_momentum",
-            "monthly_sector_momentum"
+            "monthly_sector_momentum",
+            "sma_monitor",
+            "export_market_data"
         ],
         required=True,
         help="Action to perform: 'monthly_invest_all' runs all five monthly strategies with coordinated budgets (recommended)",
@@ -4057,10 +7420,21 @@ if __name__ == "__main__":
         action="store_true",
         help="Force execution even if not on the correct trading day (for testing)",
     )
+    parser.add_argument(
+        "--feed",
+        help="Recorded trade feed (JSON lines or CSV) to replay with sma_monitor instead of the live stream",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const=profile_config["mode"],
+        choices=PROFILE_MODES,
+        help="Profile the run and write the profile to PROFILE_DIR (default: profiles/)",
+    )
     args = parser.parse_args()
 
     # Run the function locally
-    result = run_local(action=args.action, env=args.env, force_execute=args.force)
+    result = run_local(action=args.action, env=args.env, force_execute=args.force, feed=args.feed, profile=args.profile)
     # save_balance("SPXL_SMA", 100)
 
 # local execution:
@@ -4078,5 +7452,9 @@ if __name__ == "__main__":
 # python3 main.py --action sell_spxl_below_200sma --env paper
 # python3 main.py --action buy_spxl_above_200sma --env paper
 # python3 main.py --action index_alert --env paper  # For unified index alerts (use with request body)
+# python3 main.py --action sma_monitor --env paper  # Stream SMA crossings until the close
+# python3 main.py --action sma_monitor --feed trades.jsonl  # Replay a recorded feed
+# python3 main.py --action export_market_data --env paper  # Seed MARKET_DATA_DIR for the files provider
+# MARKET_DATA_PROVIDER=files MARKET_DATA_AS_OF=2024-03-01 python3 main.py --action index_alert  # Offline data
 
 # consider shifting to short term bonds when 200sma is below https://app.alpaca.markets/trade/BIL?asset_class=stocks
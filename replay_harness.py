@@ -0,0 +1,296 @@
+"""
+Record/replay harness and latency benchmark for monthly_invest_all_strategies.
+
+record: run the orchestrator against the paper account and write every outbound HTTP exchange
+        (Alpaca, FRED, Telegram) plus the Firestore documents the run reads to a JSON fixture.
+replay: run the orchestrator again without network. HTTP is answered from the fixture and state
+        is served by the SQLite backend (STATE_BACKEND=sqlite) seeded from the fixture. Latency is
+        injected per call, order-poll sleeps are virtual, and the harness reports end-to-end time,
+        time per stage and call counts.
+
+Usage:
+    python3 replay_harness.py record --out fixtures/monthly_invest_all.json --force
+    python3 replay_harness.py replay fixtures/monthly_invest_all.json
+    python3 replay_harness.py replay fixtures/monthly_invest_all.json --http-latency 0.05 --state-latency 0.02 --repeat 3 --json
+
+Replays always force execution (the fixture was recorded on a trading day; today may not be one).
+Requests are matched by method, host, path, query and body. Date-range and credential parameters
+are ignored, so a fixture replays on later days. Unmatched requests get a 404 and are counted.
+"""
+import argparse
+import collections
+import json
+import os
+import statistics
+import tempfile
+import threading
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+
+import main
+
+# Query parameters that change with the run date or carry credentials
+VOLATILE_PARAMS = {"start", "end", "api_key", "observation_start", "observation_end"}
+
+# Orchestrator stages timed during replay (module attributes of main, looked up at call time)
+STAGES = [
+    "prefetch_snapshots",
+    "check_margin_conditions",
+    "calculate_monthly_investments",
+    "evaluate_risk_gates",
+    "make_monthly_buys",
+    "make_monthly_buys_golden_hfea_lite",
+    "monthly_buying_sma",
+    "make_monthly_nine_sig_contributions",
+    "monthly_dual_momentum_strategy",
+    "monthly_sector_momentum_strategy",
+    "settle_sleeve_orders",
+    "flush_journal",
+]
+
+_real_request = requests.Session.request
+_real_sleep = time.sleep
+
+
+def state_collections(env):
+    """Firestore collections read by a monthly run."""
+    return [
+        f"strategy-balances-{env}", "market-data", "index-highs", f"sleeve-ledger-{env}", f"sleeve-orders-{env}", "fred-series",
+        "nine-sig-quarters", "nine-sig-monthly-contributions", "nine-sig-state",
+    ]
+
+
+def request_key(method, url, params=None, data=None, json_body=None):
+    """
+    Stable match key for a request: (exact key, fallback key).
+
+    The fallback key (method, host and path) answers requests whose query or body differs from
+    the recording, e.g. a different order quantity.
+    """
+    parts = urlsplit(url)
+    path = parts.path
+    if parts.netloc == "api.telegram.org":
+        # Bot token in the path, chat id in the query or body, free text in the body
+        path = "/bot*/" + path.rsplit("/", 1)[-1]
+        data = json_body = None
+    query = {} if parts.netloc == "api.telegram.org" else dict(parse_qsl(parts.query))
+    query.update({key: str(value) for key, value in (params or {}).items()})
+    query = sorted((key, value) for key, value in query.items() if key not in VOLATILE_PARAMS)
+    body = json.dumps(json_body if json_body is not None else data, sort_keys=True, default=str)
+    fallback = f"{method.upper()} {parts.netloc}{path}"
+    return f"{fallback}?{json.dumps(query)} {body}", fallback
+
+
+def record(out_path, force_execute=False):
+    """Run the orchestrator against the paper account and write the HTTP exchanges and read state to out_path."""
+    env = "paper"  # Recording places real orders: never against the live account
+    api = main.set_alpaca_environment(env=env, use_secret_manager=False)
+    db = main.get_firestore_client()
+    state = {
+        name: {doc.id: main._encode_state(doc.to_dict()) for doc in db.collection(name).stream()}
+        for name in state_collections(env)
+    }
+
+    exchanges = []
+    lock = threading.Lock()
+
+    def recording_request(session, method, url, params=None, data=None, json=None, **kwargs):
+        response = _real_request(session, method, url, params=params, data=data, json=json, **kwargs)
+        key, fallback = request_key(method, url, params, data, json)
+        with lock:
+            exchanges.append({
+                "key": key,
+                "fallback": fallback,
+                "status": response.status_code,
+                "content_type": response.headers.get("Content-Type", "application/json"),
+                "body": response.text,
+                "elapsed": response.elapsed.total_seconds(),
+            })
+        return response
+
+    requests.Session.request = recording_request
+    started = time.perf_counter()
+    try:
+        result = main.entry_point(main.monthly_invest_all_strategies)(
+            api, force_execute=force_execute, skip_order_wait=True, env=env)
+    finally:
+        requests.Session.request = _real_request
+    elapsed = time.perf_counter() - started
+
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    with open(out_path, "w") as f:
+        json.dump({"env": env, "base_url": api["BASE_URL"], "recorded_seconds": elapsed,
+                   "state": state, "http": exchanges}, f)
+    print(f"Recorded {len(exchanges)} HTTP exchanges and {sum(len(docs) for docs in state.values())} "
+          f"documents in {elapsed:.2f}s to {out_path}")
+    return result
+
+
+def _response(exchange, url):
+    response = requests.Response()
+    response.status_code = exchange["status"]
+    response._content = exchange["body"].encode("utf-8")
+    response.headers["Content-Type"] = exchange["content_type"]
+    response.encoding = "utf-8"
+    response.url = url
+    return response
+
+
+def replay_once(fixture, http_latency=None, state_latency=0.0):
+    """
+    Replay a recorded run once.
+
+    Args:
+        fixture: Loaded fixture dict
+        http_latency: Seconds added to every HTTP call (None = the recorded per-call latency)
+        state_latency: Seconds added to every state read, query or write
+
+    Returns:
+        dict: Timing and call-count report
+    """
+    exact = collections.defaultdict(collections.deque)
+    by_path = collections.defaultdict(collections.deque)
+    for exchange in fixture["http"]:
+        exact[exchange["key"]].append(exchange)
+        by_path[exchange["fallback"]].append(exchange)
+
+    lock = threading.Lock()
+    counts = collections.Counter()
+    virtual_sleep = [0.0]
+
+    def take(queues, key):
+        # Consume recorded answers in order; keep repeating the last one (e.g. extra order polls)
+        queue = queues.get(key)
+        if not queue:
+            return None
+        return queue.popleft() if len(queue) > 1 else queue[0]
+
+    def replay_request(session, method, url, params=None, data=None, json=None, **kwargs):
+        key, fallback = request_key(method, url, params, data, json)
+        with lock:
+            exchange = take(exact, key) or take(by_path, fallback)
+            counts["http"] += 1
+            counts[f"http {urlsplit(url).netloc}"] += 1
+            if exchange is None:
+                counts["http unmatched"] += 1
+        _real_sleep(exchange["elapsed"] if http_latency is None and exchange else http_latency or 0)
+        if exchange is None:
+            return _response({"status": 404, "content_type": "application/json", "body": "{}"}, url)
+        return _response(exchange, url)
+
+    def sleep(seconds):
+        with lock:
+            virtual_sleep[0] += seconds
+
+    # Fresh SQLite state seeded from the fixture, with latency and counts per state operation
+    workdir = tempfile.mkdtemp(prefix="replay-")
+    main.state_config.update(backend="sqlite", sqlite_path=os.path.join(workdir, "state.db"))
+    main.journal_config["directory"] = os.path.join(workdir, "journal")
+    main._db_client = None
+    main.get_firestore_client()
+    db = main._db_client  # The backend itself; get_firestore_client() returns it wrapped for tracing
+    batch = db.batch()
+    for name, docs in fixture["state"].items():
+        for doc_id, data in docs.items():
+            batch.set(db.collection(name).document(doc_id), main._decode_state(data))
+    batch.commit()
+    for operation in ("_read", "_scan", "_write"):
+        original = getattr(db, operation)
+
+        def timed(*args, _original=original, _operation=operation):
+            with lock:
+                counts["state"] += 1
+                counts[f"state {_operation.strip('_')}"] += 1
+            _real_sleep(state_latency)
+            return _original(*args)
+        setattr(db, operation, timed)
+
+    stage_times = collections.defaultdict(float)
+    stage_calls = collections.defaultdict(lambda: collections.Counter())
+    originals = {name: getattr(main, name) for name in STAGES}
+
+    def timed_stage(name, function):
+        def wrapper(*args, **kwargs):
+            before = counts.copy()
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stage_times[name] += time.perf_counter() - started
+                stage_calls[name].update(counts - before)
+        return wrapper
+
+    for name, function in originals.items():
+        setattr(main, name, timed_stage(name, function))
+    main._bars_cache.clear()
+    main._fred_series_cache.clear()
+    main._sleeve_orders.clear()
+    requests.Session.request = replay_request
+    time.sleep = sleep
+    api = {"API_KEY": "replay", "SECRET_KEY": "replay", "BASE_URL": fixture["base_url"]}
+    started = time.perf_counter()
+    try:
+        main.entry_point(main.monthly_invest_all_strategies)(
+            api, force_execute=True, skip_order_wait=True, env=fixture["env"])
+    finally:
+        elapsed = time.perf_counter() - started
+        requests.Session.request = _real_request
+        time.sleep = _real_sleep
+        for name, function in originals.items():
+            setattr(main, name, function)
+        main._db_client = None
+
+    return {
+        "seconds": elapsed,
+        "recorded_seconds": fixture.get("recorded_seconds"),
+        "virtual_sleep_seconds": virtual_sleep[0],
+        "calls": dict(counts),
+        "stages": {
+            name: {"seconds": stage_times[name], "calls": dict(stage_calls[name])}
+            for name in STAGES if name in stage_times
+        },
+    }
+
+
+def print_report(reports):
+    seconds = [report["seconds"] for report in reports]
+    report = reports[-1]
+    print(f"\nEnd-to-end: median {statistics.median(seconds):.3f}s over {len(seconds)} run(s)"
+          f" (recorded live run: {report['recorded_seconds'] or 0:.2f}s,"
+          f" virtual sleep skipped: {report['virtual_sleep_seconds']:.0f}s)")
+    print("Calls: " + ", ".join(f"{name}={count}" for name, count in sorted(report["calls"].items())))
+    print(f"\n{'stage':40s} {'seconds':>9s} {'http':>6s} {'state':>6s}")
+    for name, stage in report["stages"].items():
+        print(f"{name:40s} {stage['seconds']:9.3f} {stage['calls'].get('http', 0):6d} {stage['calls'].get('state', 0):6d}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = commands.add_parser("record", help="Record a live paper run")
+    record_parser.add_argument("--out", default="fixtures/monthly_invest_all.json")
+    record_parser.add_argument("--force", action="store_true", help="Run even if today is not the first trading day")
+
+    replay_parser = commands.add_parser("replay", help="Replay a fixture and report timings")
+    replay_parser.add_argument("fixture")
+    replay_parser.add_argument("--http-latency", type=float, default=None,
+                               help="Seconds per HTTP call (default: the recorded latency of each call)")
+    replay_parser.add_argument("--state-latency", type=float, default=0.02,
+                               help="Seconds per state read/query/write (Firestore round trip stand-in)")
+    replay_parser.add_argument("--repeat", type=int, default=1)
+    replay_parser.add_argument("--json", action="store_true", help="Print the last report as JSON")
+
+    args = parser.parse_args()
+    if args.command == "record":
+        record(args.out, force_execute=args.force)
+    else:
+        with open(args.fixture) as f:
+            fixture = json.load(f)
+        reports = [replay_once(fixture, args.http_latency, args.state_latency) for _ in range(args.repeat)]
+        if args.json:
+            print(json.dumps(reports[-1], indent=2))
+        else:
+            print_report(reports)